@@ -0,0 +1,343 @@
+# scripts/benchmark.py
+"""
+Deterministic performance benchmarks for the research pipeline (mock mode only; no
+network or API keys needed).
+
+Measures
+- pipeline:    per-stage and total latency of Orchestrator.run_pipeline with synthetic
+               LLM latency (MOCK_LLM_LATENCY) in the mock agents
+- memory:      MemoryStore lazy/eager load, index build, lookup and append throughput
+               at each --sizes record count (default 1k, 100k, 1M)
+- search:      simple_search overhead on top of a synthetic backend latency (MOCK_SEARCH_LATENCY)
+- ratelimiter: try_acquire throughput under thread contention for the in-process, shared-memory
+               and file-backed token buckets, plus quota accuracy with 8 competing threads
+
+Results are written as JSON ({"meta": ..., "metrics": {name: {"value", "unit", "better"}}}).
+Throughput metrics (ops/s) are the median of --repeats runs, whose values are kept under
+"samples"; latency metrics are percentiles over --runs samples already.
+With a baseline file present, every metric is compared against it and the script exits
+with status 1 if any got worse by more than --tolerance (relative); metrics with a
+"target" (quota accuracy) must instead be within --tolerance of it. --update-baseline
+stores the current results as the new baseline instead.
+
+The committed baseline (scripts/benchmark_baseline.json) was recorded on a 1-CPU Linux
+VM; absolute numbers, and especially the 8-thread contention figures, do not carry over
+to other machines. Compare against a baseline recorded on the same machine (the script
+warns when the CPU count or platform differ).
+
+Usage:
+    python scripts/benchmark.py                       # full run, compare with the baseline
+    python scripts/benchmark.py --quick               # skip the 1M-record memory set
+    python scripts/benchmark.py --update-baseline     # re-record the baseline on this machine
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+# mock mode, no caches, traces or metric files: only the code paths under test run
+for var in ("GOOGLE_API_KEY", "GOOGLE_APPLICATION_CREDENTIALS", "GOOGLE_CX", "CUSTOM_SEARCH_CX", "SEARCH_HEDGE_DELAY"):
+    os.environ.pop(var, None)
+os.environ.update({"LLM_CACHE_DISABLED": "1", "SEARCH_CACHE_DISABLED": "1", "TRACING_DISABLED": "1", "METRICS_PATH": ""})
+
+DEFAULT_BASELINE = os.path.join(ROOT, "scripts", "benchmark_baseline.json")
+
+class Results:
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name: str, value: float, unit: str, better: str = "lower", samples=None, target: float = None):
+        metric = {"value": round(value, 6), "unit": unit, "better": better}
+        if samples is not None:
+            metric["samples"] = [round(v, 6) for v in samples]
+        if target is not None:
+            metric["target"] = target
+        self.metrics[name] = metric
+        print(f"  {name:<48} {value:>14.6f} {unit}")
+
+    def add_median(self, name: str, measure, repeats: int, unit: str, better: str = "higher"):
+        """Run measure() `repeats` times and record the median, so one noisy run cannot fail the check."""
+        samples = [measure() for _ in range(max(1, repeats))]
+        self.add(name, statistics.median(samples), unit, better, samples=samples)
+
+def _pct(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+# --- pipeline ---
+def bench_pipeline(res: Results, llm_latency: float, runs: int, tmp: str):
+    import agents
+    from agents import ResearchAgent, SummarizerAgent, CriticAgent, WriterAgent
+    from orchestrator import Orchestrator
+    agents.AGENT_DEBUG_LOG = os.path.join(tmp, "agent_debug.log")
+    os.environ["MOCK_LLM_LATENCY"] = str(llm_latency)
+    orch = Orchestrator(agents=[ResearchAgent("ResearchAgent"), SummarizerAgent("SummarizerAgent"),
+                                CriticAgent("CriticAgent"), WriterAgent("WriterAgent")], use_mock=True)
+    stages = {}
+    totals = []
+    orch.run_pipeline("warmup", "warm up")
+    for i in range(runs):
+        t0 = time.perf_counter()
+        orch.run_pipeline(f"bench-{i}", f"benchmark query {i}",
+                          on_stage=lambda e: stages.setdefault(e["stage"], []).append(e["elapsed"]))
+        totals.append(time.perf_counter() - t0)
+    for stage, samples in stages.items():
+        res.add(f"pipeline.{stage}.p50_s", statistics.median(samples), "s")
+        res.add(f"pipeline.{stage}.p95_s", _pct(samples, 0.95), "s")
+    res.add("pipeline.total.p50_s", statistics.median(totals), "s")
+    # everything beyond the synthetic LLM time (4 agent calls) is orchestration overhead
+    res.add("pipeline.overhead.p50_s", max(0.0, statistics.median(totals) - 4 * llm_latency), "s")
+
+# --- memory store ---
+def _write_records(path: str, n: int, rng: random.Random):
+    # same layout MemoryStore._write_snapshot produces: a JSON array, one record per line
+    base = 1_700_000_000
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for i in range(n):
+            rec = {"session_id": f"s-{i}", "timestamp": base + i, "query": f"query {rng.randrange(n // 4 + 1)}",
+                   "findings": "f" * 40, "summary": "s" * 40, "critique": "c" * 20, "draft": "d" * 60}
+            f.write(json.dumps(rec) + (",\n" if i < n - 1 else "\n"))
+        f.write("]\n")
+
+def bench_memory(res: Results, sizes, eager_max: int, tmp: str, repeats: int):
+    from memory import MemoryStore
+    for n in sizes:
+        rng = random.Random(n)
+        d = os.path.join(tmp, f"memory_{n}")
+        os.makedirs(d, exist_ok=True)
+        path = os.path.join(d, "memory_store.json")
+        _write_records(path, n, rng)
+        label = f"memory.{n}"
+
+        t0 = time.perf_counter()
+        store = MemoryStore(path, lazy=True, fsync="never", background_compaction=False)
+        assert len(store.store) == n
+        res.add(f"{label}.load_lazy_s", time.perf_counter() - t0, "s")
+
+        t0 = time.perf_counter()
+        store.find_last_by_session("s-0")
+        res.add(f"{label}.index_build_s", time.perf_counter() - t0, "s")
+
+        lookups = 2000
+        keys = [rng.randrange(n) for _ in range(lookups)]
+
+        def lookup_rate():
+            t0 = time.perf_counter()
+            for k in keys:
+                store.find_last_by_session(f"s-{k}")
+                store.find_last_by_query(f"Query  {k // 4}")
+            return 2 * lookups / (time.perf_counter() - t0)
+        res.add_median(f"{label}.lookups_per_s", lookup_rate, repeats, "ops/s")
+
+        appends = 1000
+
+        def append_rate():
+            t0 = time.perf_counter()
+            for i in range(appends):
+                store.append({"session_id": f"new-{i}", "timestamp": time.time(), "query": "appended", "draft": "x"})
+            return appends / (time.perf_counter() - t0)
+        res.add_median(f"{label}.appends_per_s", append_rate, repeats, "ops/s")
+        if hasattr(store.store, "close"):
+            store.store.close()
+
+        if n <= eager_max:
+            t0 = time.perf_counter()
+            eager = MemoryStore(path, fsync="never", background_compaction=False)
+            assert len(eager.store) == n + appends * max(1, repeats)
+            res.add(f"{label}.load_eager_s", time.perf_counter() - t0, "s")
+        shutil.rmtree(d, ignore_errors=True)
+
+# --- search ---
+def bench_search(res: Results, search_latency: float, calls: int):
+    import tool_adapter
+    os.environ["MOCK_SEARCH_LATENCY"] = str(search_latency)
+    tool_adapter.simple_search("warm up")
+    samples = []
+    for i in range(calls):
+        t0 = time.perf_counter()
+        out = tool_adapter.simple_search(f"benchmark search {i}")
+        samples.append(time.perf_counter() - t0)
+        assert out.get("source") == "mock"
+    res.add("search.simple_search.p50_s", statistics.median(samples), "s")
+    res.add("search.simple_search.overhead_p50_s", max(0.0, statistics.median(samples) - search_latency), "s")
+
+# --- rate limiter ---
+def _hammer(limiter, threads: int, total_ops: int) -> float:
+    per_thread = max(1, total_ops // threads)
+    start = threading.Barrier(threads + 1)
+
+    def worker():
+        start.wait()
+        for _ in range(per_thread):
+            limiter.try_acquire()
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in pool:
+        t.join()
+    return per_thread * threads / (time.perf_counter() - t0)
+
+def bench_ratelimiter(res: Results, tmp: str, repeats: int):
+    from genai_wrapper import RateLimiter, SharedRateLimiter, FileRateLimiter
+    huge = 10 ** 9  # never throttles: measures the cost of the bookkeeping itself
+    limiters = {
+        "inprocess": (lambda: RateLimiter(huge, 1, burst=huge), 40000),
+        "shared": (lambda: SharedRateLimiter(huge, 1, burst=huge), 40000),
+        "file": (lambda: FileRateLimiter(huge, 1, path=os.path.join(tmp, "bench.bucket"), burst=huge), 4000),
+    }
+    for name, (make, ops) in limiters.items():
+        for threads in (1, 8):
+            res.add_median(f"ratelimiter.{name}.threads{threads}.ops_per_s",
+                           lambda: _hammer(make(), threads, ops), repeats, "ops/s")
+
+    # quota accuracy: 8 threads compete for 50 tokens at 100/s (burst 1) -> ~0.5s
+    rate = 100
+    limiter = RateLimiter(rate, 1, burst=1)
+    limiter.try_acquire()
+    waits = []
+    lock = threading.Lock()
+
+    def taker():
+        for _ in range(50 // 8 + 1):
+            t0 = time.perf_counter()
+            limiter.acquire()
+            with lock:
+                waits.append(time.perf_counter() - t0)
+
+    pool = [threading.Thread(target=taker) for _ in range(8)]
+    t0 = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    # neither faster (quota overrun) nor much slower (lost wakeups) than the configured rate
+    res.add("ratelimiter.contended.achieved_rate_per_s", len(waits) / elapsed, "ops/s", "target", target=rate)
+    res.add("ratelimiter.contended.max_wait_s", max(waits), "s")
+
+# --- baseline comparison ---
+def compare(current: dict, baseline: dict, tolerance: float, min_abs_delta: float):
+    regressions = []
+    for name, base in sorted(baseline.get("metrics", {}).items()):
+        cur = current.get(name)
+        if cur is None:
+            continue
+        b, v = base["value"], cur["value"]
+        if cur.get("better") == "target":
+            target = cur["target"]
+            worse = abs(v - target) > tolerance * target
+            flag = "OUT OF RANGE" if worse else "ok"
+            print(f"  {name:<48} {'target ' + format(target, 'g'):>14} -> {v:>14.6f} {cur['unit']:<6} "
+                  f"{(v - target) / target * 100:+7.1f}%  {flag}")
+            if worse:
+                regressions.append(name)
+            continue
+        if base.get("better", "lower") == "lower":
+            worse = v > b * (1 + tolerance) and (base.get("unit") != "s" or v - b > min_abs_delta)
+        else:
+            worse = v < b * (1 - tolerance)
+        change = (v - b) / b * 100 if b else 0.0
+        flag = "REGRESSION" if worse else "ok"
+        print(f"  {name:<48} {b:>14.6f} -> {v:>14.6f} {cur['unit']:<6} {change:+7.1f}%  {flag}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run pipeline benchmarks and compare with a stored baseline.")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="MemoryStore record counts, comma-separated")
+    parser.add_argument("--quick", action="store_true", help="only 1k and 100k memory records")
+    parser.add_argument("--eager-max", type=int, default=100000, help="largest size also loaded eagerly")
+    parser.add_argument("--llm-latency", type=float, default=0.02, help="synthetic seconds per mock LLM call")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="synthetic seconds per mock search")
+    parser.add_argument("--runs", type=int, default=20, help="pipeline runs / search calls")
+    parser.add_argument("--repeats", type=int, default=5, help="runs per throughput metric; the median is reported")
+    parser.add_argument("--only", default="", help="comma-separated subset: pipeline,memory,search,ratelimiter")
+    parser.add_argument("--output", default=None, help="write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative slowdown before failing")
+    parser.add_argument("--min-abs-delta", type=float, default=0.005,
+                        help="latency changes smaller than this many seconds never count as regressions")
+    args = parser.parse_args(argv)
+
+    sizes = [1000, 100000] if args.quick else [int(s) for s in args.sizes.split(",") if s.strip()]
+    only = {s.strip() for s in args.only.split(",") if s.strip()}
+    res = Results()
+    tmp = tempfile.mkdtemp(prefix="pipeline-bench-")
+    # set before the modules under test are imported: their log files and caches default
+    # to data/processed, which must not change when the benchmark runs
+    logging.basicConfig(filename=os.path.join(tmp, "benchmark.log"), level=logging.INFO)
+    os.environ.update({"LLM_CACHE_PATH": os.path.join(tmp, "llm_cache.json"),
+                       "SEARCH_CACHE_PATH": os.path.join(tmp, "search_cache.json")})
+    try:
+        if not only or "pipeline" in only:
+            print("[benchmark] pipeline")
+            bench_pipeline(res, args.llm_latency, args.runs, tmp)
+        if not only or "memory" in only:
+            print("[benchmark] memory")
+            bench_memory(res, sizes, args.eager_max, tmp, args.repeats)
+        if not only or "search" in only:
+            print("[benchmark] search")
+            bench_search(res, args.search_latency, args.runs)
+        if not only or "ratelimiter" in only:
+            print("[benchmark] ratelimiter")
+            bench_ratelimiter(res, tmp, args.repeats)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(),
+                 "cpu_count": os.cpu_count(), "timestamp": int(time.time()),
+                 "config": {"sizes": sizes, "llm_latency": args.llm_latency,
+                            "search_latency": args.search_latency, "runs": args.runs,
+                            "repeats": args.repeats}},
+        "metrics": res.metrics,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"[benchmark] baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"[benchmark] no baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"[benchmark] comparing with {args.baseline} (tolerance {args.tolerance:.0%})")
+    base_meta = baseline.get("meta", {})
+    if (base_meta.get("cpu_count"), base_meta.get("platform")) != (os.cpu_count(), platform.platform()):
+        print(f"[benchmark] warning: baseline recorded on {base_meta.get('platform')} with "
+              f"{base_meta.get('cpu_count')} CPU(s), this machine has {os.cpu_count()}; "
+              "re-record it here with --update-baseline for a meaningful comparison")
+    regressions = compare(res.metrics, baseline, args.tolerance, args.min_abs_delta)
+    if regressions:
+        print(f"[benchmark] FAILED: {len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("[benchmark] no regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,240 @@
-"""Simple A2A (Agent-to-Agent) protocol simulator for demos."""
-import uuid, time, queue, threading
-from typing import Dict, Any
+"""
+A2A (Agent-to-Agent) message bus on asyncio.
+
+- Mailboxes: every registered agent owns a bounded asyncio.Queue. `send` awaits free
+  space (backpressure); `send_nowait` raises BusFull instead.
+- Topics: `subscribe(topic, name)` adds a mailbox to a topic; `publish` delivers a copy
+  to every subscriber and `broadcast` to every registered agent.
+- Request/reply: `request` sends a message and awaits the reply whose correlation_id is
+  the request's id; `reply` resolves it directly (or queues it for the sender when no
+  one is waiting). A reply carrying an error re-raises it in the requester.
+- Transports: `attach(name, transport)` routes that agent's messages to an out-of-process
+  transport (see a2a_transport.ProcessAgentPool) instead of a local mailbox.
+- Metrics (observability.METRICS): a2a_messages_total, a2a_dropped_total,
+  a2a_queue_depth, a2a_send_blocked_seconds, a2a_delivery_seconds, a2a_request_seconds.
+
+The bus belongs to one event loop at a time; used from a new loop (e.g. a later
+asyncio.run) it starts over with empty mailboxes, keeping registrations and subscriptions.
+"""
+import uuid, time, asyncio
+from typing import Any, Dict, List, Optional, Set
+
+from observability import METRICS
+
+class BusFull(Exception):
+    pass
+
+def _receiver_label(name: str) -> str:
+    # per-orchestrator mailboxes ("orch-1a2b3c4d/WriterAgent", replies to "orch-1a2b3c4d")
+    # report under the agent name, so metrics keep one series per agent across instances
+    instance, sep, agent = name.partition("/")
+    if sep:
+        return agent
+    return "orchestrator" if name.startswith("orch-") else name
 
 class A2AMessage:
-    def __init__(self, sender: str, receiver: str, content: str):
+    def __init__(self, sender: str, receiver: str, content: Any, topic: str = None,
+                 correlation_id: str = None, kind: str = "message", error: BaseException = None):
         self.id = str(uuid.uuid4())
         self.sender = sender
         self.receiver = receiver
         self.content = content
+        self.topic = topic
+        self.correlation_id = correlation_id
+        self.kind = kind
+        self.error = error
         self.ts = time.time()
+        self._queued_at = None
+
+    def copy_to(self, receiver: str) -> 'A2AMessage':
+        msg = A2AMessage(self.sender, receiver, self.content, topic=self.topic,
+                         correlation_id=self.correlation_id, kind=self.kind, error=self.error)
+        msg.id = self.id
+        return msg
 
     def to_dict(self):
-        return {'id': self.id, 'sender': self.sender, 'receiver': self.receiver, 'content': self.content, 'ts': self.ts}
+        return {'id': self.id, 'sender': self.sender, 'receiver': self.receiver, 'content': self.content,
+                'topic': self.topic, 'correlation_id': self.correlation_id, 'kind': self.kind,
+                'error': repr(self.error) if self.error is not None else None, 'ts': self.ts}
 
 class A2ABus:
-    def __init__(self):
-        self.queues = {}
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._sizes: Dict[str, int] = {}
+        self._topics: Dict[str, Set[str]] = {}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._remote: Dict[str, Any] = {}
+        self._loop = None
+
+    # --- registration ---
+    def register(self, agent_name: str, maxsize: int = None):
+        self._sizes.setdefault(agent_name, maxsize or self.maxsize)
 
-    def register(self, agent_name: str):
-        self.queues.setdefault(agent_name, queue.Queue())
+    def unregister(self, agent_name: str):
+        self._sizes.pop(agent_name, None)
+        self._queues.pop(agent_name, None)
+        self._remote.pop(agent_name, None)
+        for subscribers in self._topics.values():
+            subscribers.discard(agent_name)
 
-    def send(self, msg: A2AMessage):
-        if msg.receiver not in self.queues:
-            raise KeyError(f"Receiver {msg.receiver} not registered")
-        self.queues[msg.receiver].put(msg)
+    def subscribe(self, topic: str, agent_name: str):
+        self.register(agent_name)
+        self._topics.setdefault(topic, set()).add(agent_name)
 
-    def receive(self, agent_name: str, timeout: float = 0.1):
-        q = self.queues.get(agent_name)
+    def unsubscribe(self, topic: str, agent_name: str):
+        self._topics.get(topic, set()).discard(agent_name)
+
+    def registered(self) -> List[str]:
+        return list(self._sizes)
+
+    def attach(self, agent_name: str, transport):
+        """Deliver messages for agent_name through `transport` (submit/asubmit returning a reply Future)."""
+        self.register(agent_name)
+        self._remote[agent_name] = transport
+
+    def detach(self, agent_name: str):
+        return self._remote.pop(agent_name, None)
+
+    def is_remote(self, agent_name: str) -> bool:
+        return agent_name in self._remote
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            stale = sum(q.qsize() for q in self._queues.values())
+            if stale:
+                METRICS.inc("a2a_dropped_total", stale, {"reason": "loop_changed"})
+            self._queues.clear()
+            self._pending.clear()
+            self._loop = loop
+
+    def _mailbox(self, agent_name: str) -> asyncio.Queue:
+        self._bind()
+        q = self._queues.get(agent_name)
         if q is None:
-            return None
+            if agent_name not in self._sizes:
+                raise KeyError(f"Receiver {agent_name} not registered")
+            q = self._queues[agent_name] = asyncio.Queue(maxsize=self._sizes[agent_name])
+        return q
+
+    # --- point to point ---
+    def _enqueued(self, msg: A2AMessage, q: asyncio.Queue):
+        METRICS.inc("a2a_messages_total", 1, {"receiver": _receiver_label(msg.receiver), "kind": msg.kind})
+        METRICS.set_gauge("a2a_queue_depth", q.qsize(), {"receiver": _receiver_label(msg.receiver)})
+
+    async def send(self, msg: A2AMessage, timeout: float = None):
+        """Queue msg for its receiver, waiting while the mailbox is full (BusFull after `timeout`)."""
+        transport = self._remote.get(msg.receiver)
+        if transport is not None:
+            fut = await transport.asubmit(msg, timeout)
+            METRICS.inc("a2a_messages_total", 1, {"receiver": _receiver_label(msg.receiver), "kind": msg.kind})
+            loop = asyncio.get_running_loop()
+            fut.add_done_callback(lambda f: loop.call_soon_threadsafe(self._route_remote_reply, f))
+            return
+        q = self._mailbox(msg.receiver)
+        msg._queued_at = time.perf_counter()
+        if q.full():
+            try:
+                await asyncio.wait_for(q.put(msg), timeout)
+            except asyncio.TimeoutError:
+                METRICS.inc("a2a_dropped_total", 1, {"reason": "full"})
+                raise BusFull(f"mailbox of {msg.receiver} is full") from None
+            finally:
+                METRICS.observe("a2a_send_blocked_seconds", time.perf_counter() - msg._queued_at,
+                                {"receiver": _receiver_label(msg.receiver)})
+            msg._queued_at = time.perf_counter()
+        else:
+            q.put_nowait(msg)
+        self._enqueued(msg, q)
+
+    def _route_remote_reply(self, fut):
+        # replies to fire-and-forget sends land in the sender's mailbox, if it has one
+        if fut.cancelled() or fut.exception() is not None:
+            METRICS.inc("a2a_dropped_total", 1, {"reason": "transport_error"})
+            return
+        reply = fut.result()
+        try:
+            self.send_nowait(reply)
+        except (KeyError, BusFull):
+            METRICS.inc("a2a_dropped_total", 1, {"reason": "no_receiver"})
+
+    def send_nowait(self, msg: A2AMessage):
+        q = self._mailbox(msg.receiver)
+        msg._queued_at = time.perf_counter()
+        try:
+            q.put_nowait(msg)
+        except asyncio.QueueFull:
+            METRICS.inc("a2a_dropped_total", 1, {"reason": "full"})
+            raise BusFull(f"mailbox of {msg.receiver} is full") from None
+        self._enqueued(msg, q)
+
+    async def receive(self, agent_name: str, timeout: float = None) -> Optional[A2AMessage]:
+        """Next message for agent_name; None if nothing arrives within `timeout` seconds."""
+        q = self._mailbox(agent_name)
         try:
-            return q.get(timeout=timeout)
-        except Exception:
+            msg = q.get_nowait() if not q.empty() else await asyncio.wait_for(q.get(), timeout)
+        except asyncio.TimeoutError:
             return None
+        METRICS.set_gauge("a2a_queue_depth", q.qsize(), {"receiver": _receiver_label(agent_name)})
+        if msg._queued_at is not None:
+            METRICS.observe("a2a_delivery_seconds", time.perf_counter() - msg._queued_at, {"receiver": _receiver_label(agent_name)})
+        return msg
+
+    # --- topics ---
+    async def publish(self, msg: A2AMessage, timeout: float = None) -> int:
+        """Deliver a copy of msg to every subscriber of msg.topic. Returns the number delivered."""
+        subscribers = [name for name in self._topics.get(msg.topic, ()) if name != msg.sender]
+        for name in subscribers:
+            await self.send(msg.copy_to(name), timeout)
+        return len(subscribers)
+
+    async def broadcast(self, msg: A2AMessage, timeout: float = None) -> int:
+        receivers = [name for name in self._sizes if name != msg.sender]
+        for name in receivers:
+            await self.send(msg.copy_to(name), timeout)
+        return len(receivers)
+
+    # --- request / reply ---
+    async def request(self, msg: A2AMessage, timeout: float = None) -> A2AMessage:
+        """Send msg and await its reply; raises the reply's error, or TimeoutError after `timeout`."""
+        self._bind()
+        fut = self._loop.create_future()
+        self._pending[msg.id] = fut
+        started = time.perf_counter()
+        transport = self._remote.get(msg.receiver)
+        try:
+            if transport is not None:
+                remote = await transport.asubmit(msg, timeout)
+                METRICS.inc("a2a_messages_total", 1, {"receiver": _receiver_label(msg.receiver), "kind": msg.kind})
+                fut = asyncio.wrap_future(remote)
+            else:
+                await self.send(msg, timeout)
+            reply = await asyncio.wait_for(fut, timeout)
+        finally:
+            self._pending.pop(msg.id, None)
+            METRICS.observe("a2a_request_seconds", time.perf_counter() - started, {"receiver": _receiver_label(msg.receiver)})
+        if reply.error is not None:
+            raise reply.error
+        return reply
+
+    async def reply(self, request: A2AMessage, content: Any = None, error: BaseException = None):
+        msg = A2AMessage(request.receiver, request.sender, content, correlation_id=request.id,
+                         kind="error" if error is not None else "reply", error=error)
+        self._bind()
+        fut = self._pending.get(request.id)
+        if fut is not None:
+            if not fut.done():
+                fut.set_result(msg)
+                METRICS.inc("a2a_messages_total", 1, {"receiver": _receiver_label(msg.receiver), "kind": msg.kind})
+            return
+        if msg.receiver in self._sizes:
+            await self.send(msg)
+        else:
+            # the requester gave up (timeout/cancel) and has no mailbox to hold a late reply
+            METRICS.inc("a2a_dropped_total", 1, {"reason": "no_receiver"})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queues": {name: q.qsize() for name, q in self._queues.items()},
+                "topics": {t: sorted(s) for t, s in self._topics.items()},
+                "pending_requests": len(self._pending), "remote": sorted(self._remote)}
@@ -0,0 +1,332 @@
+# src/a2a_transport.py
+"""
+Cross-process A2A transport: run an agent in N worker processes behind one A2ABus.
+
+    pool = ProcessAgentPool(SummarizerAgent("SummarizerAgent", use_mock=True), workers=4)
+    bus.attach("SummarizerAgent", pool)      # bus.request(...) to that name now goes to the pool
+    ...
+    pool.close()
+
+- Wire: workers connect back over a Unix domain socket in a private temp dir (TCP on
+  127.0.0.1 where AF_UNIX is unavailable) and authenticate with a random key. Frames
+  are a 5-byte header (payload length, frame type) followed by a pickled message tuple.
+- Dispatch is pull based: each connection's dispatcher thread takes the next request
+  from the shared queue only after its worker has answered the previous one, so idle
+  workers take work and a slow or busy worker never holds a backlog of its own.
+- Backpressure: at most `max_pending` requests are queued or in flight; `submit`
+  waits for a slot (BusFull after `timeout`).
+- A worker that dies fails its in-flight request with TransportError; the others keep
+  serving. A request that could not be sent to a worker is requeued for another one, and
+  a worker that does not answer within `request_timeout` seconds is dropped the same way
+  as a dead one. Workers are started with the "spawn" method, so the agent must be
+  picklable.
+"""
+import os
+import hmac
+import queue
+import socket
+import struct
+import pickle
+import shutil
+import atexit
+import asyncio
+import secrets
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+from a2a_simulator import A2AMessage, BusFull
+from observability import METRICS
+
+_HEADER = struct.Struct("!IB")
+FRAME_REQUEST, FRAME_REPLY, FRAME_ERROR, FRAME_SHUTDOWN = 1, 2, 3, 4
+_AUTH_LEN = 16
+_MAX_FRAME = 64 * 1024 * 1024
+
+class TransportError(Exception):
+    pass
+
+# --- framing ---
+def encode_frame(kind: int, msg: Optional[A2AMessage] = None) -> bytes:
+    payload = b"" if msg is None else pickle.dumps(
+        (msg.id, msg.sender, msg.receiver, msg.kind, msg.correlation_id, msg.topic, msg.content, msg.error),
+        protocol=pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(payload), kind) + payload
+
+def decode_payload(payload: bytes) -> A2AMessage:
+    mid, sender, receiver, kind, correlation_id, topic, content, error = pickle.loads(payload)
+    msg = A2AMessage(sender, receiver, content, topic=topic, correlation_id=correlation_id, kind=kind, error=error)
+    msg.id = mid
+    return msg
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        buf += chunk
+    return bytes(buf)
+
+def read_frame(sock: socket.socket) -> Tuple[int, Optional[A2AMessage]]:
+    length, kind = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    if length > _MAX_FRAME:
+        raise TransportError(f"frame of {length} bytes exceeds limit")
+    return kind, decode_payload(_recv_exact(sock, length)) if length else None
+
+def _picklable_error(e: BaseException) -> BaseException:
+    try:
+        pickle.dumps(e)
+        return e
+    except Exception:
+        return RuntimeError(f"{type(e).__name__}: {e}")
+
+# --- worker process ---
+def _serve(agent, msg: A2AMessage):
+    from llm_gateway import llm_context
+    content = msg.content
+    if not isinstance(content, dict):
+        return agent.act(content)
+    with llm_context(priority=content.get("priority"), session_id=content.get("session_id")):
+        return agent.act(content["message"], session=content.get("session_id"))
+
+def _worker_main(family: int, address, authkey: bytes, agent):
+    # metrics stay in the worker: flushing them would overwrite the orchestrator's file
+    METRICS.path = None
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(address)
+    sock.sendall(authkey)
+    try:
+        while True:
+            try:
+                kind, msg = read_frame(sock)
+            except ConnectionError:
+                return
+            if kind == FRAME_SHUTDOWN:
+                return
+            reply = A2AMessage(msg.receiver, msg.sender, None, correlation_id=msg.id, kind="reply")
+            try:
+                reply.content = _serve(agent, msg)
+                frame = FRAME_REPLY
+            except Exception as e:
+                reply.kind, reply.error, frame = "error", _picklable_error(e), FRAME_ERROR
+            try:
+                data = encode_frame(frame, reply)
+            except Exception as e:
+                reply.content, reply.kind, reply.error = None, "error", TransportError(f"unpicklable reply: {e}")
+                data = encode_frame(FRAME_ERROR, reply)
+            sock.sendall(data)
+    finally:
+        sock.close()
+
+# --- parent side ---
+class _Request:
+    __slots__ = ("msg", "future")
+
+    def __init__(self, msg: A2AMessage):
+        self.msg = msg
+        self.future: Future = Future()
+
+    def start(self) -> bool:
+        """False if the caller cancelled; a requeued request is already running."""
+        return self.future.running() or self.future.set_running_or_notify_cancel()
+
+_STOP = object()
+
+class ProcessAgentPool:
+    def __init__(self, agent, workers: int = 2, max_pending: int = 256, start_timeout: float = 30.0,
+                 request_timeout: float = 600.0):
+        self.agent_name = agent.name
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.request_timeout = request_timeout
+        self.served = 0
+        self.failed = 0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._authkey = secrets.token_bytes(_AUTH_LEN)
+        self._closed = False
+        self._alive = 0
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._tmpdir = None
+        self._server = self._listen()
+        ctx = multiprocessing.get_context("spawn")
+        self._procs = [ctx.Process(target=_worker_main, name=f"a2a-{agent.name}-{i}", daemon=True,
+                                   args=(self._server.family, self._server.getsockname(), self._authkey, agent))
+                       for i in range(self.workers)]
+        for p in self._procs:
+            p.start()
+        try:
+            self._accept(start_timeout)
+        except BaseException:
+            self.close()
+            raise
+        atexit.register(self.close)
+
+    def _listen(self) -> socket.socket:
+        if hasattr(socket, "AF_UNIX"):
+            self._tmpdir = tempfile.mkdtemp(prefix="a2a-")
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(os.path.join(self._tmpdir, "agent.sock"))
+        else:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.bind(("127.0.0.1", 0))
+        server.listen(self.workers)
+        return server
+
+    def _accept(self, timeout: float):
+        self._server.settimeout(timeout)
+        while len(self._threads) < self.workers:
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                raise TransportError(f"only {len(self._threads)}/{self.workers} {self.agent_name} workers connected") from None
+            conn.settimeout(timeout)
+            try:
+                ok = hmac.compare_digest(_recv_exact(conn, _AUTH_LEN), self._authkey)
+            except (OSError, ConnectionError):
+                ok = False
+            if not ok:
+                conn.close()
+                continue
+            conn.settimeout(self.request_timeout)
+            with self._lock:
+                self._alive += 1
+            t = threading.Thread(target=self._dispatch, args=(conn,), daemon=True,
+                                 name=f"a2a-dispatch:{self.agent_name}:{len(self._threads)}")
+            self._threads.append(t)
+            t.start()
+        METRICS.set_gauge("a2a_remote_workers", self._alive, {"agent": self.agent_name})
+
+    def _dispatch(self, conn: socket.socket):
+        # one thread per worker connection: pull a request only once the worker is idle
+        labels = {"agent": self.agent_name}
+        try:
+            while True:
+                req = self._queue.get()
+                if req is _STOP:
+                    try:
+                        conn.sendall(encode_frame(FRAME_SHUTDOWN))
+                    except OSError:
+                        pass
+                    return
+                if not req.start():
+                    self._slots.release()
+                    continue
+                try:
+                    data = encode_frame(FRAME_REQUEST, req.msg)
+                except Exception as e:
+                    self._finish(req, exc=TransportError(f"unpicklable request: {e}"))
+                    METRICS.inc("a2a_remote_requests_total", 1, dict(labels, outcome="error"))
+                    continue
+                try:
+                    conn.sendall(data)
+                except OSError:
+                    # the worker never got it: another one can serve it
+                    self._queue.put(req)
+                    METRICS.inc("a2a_remote_requests_total", 1, dict(labels, outcome="requeued"))
+                    return
+                try:
+                    kind, reply = read_frame(conn)
+                except socket.timeout:
+                    # a late reply would desynchronise the connection, so the worker is dropped
+                    self._finish(req, exc=TransportError(
+                        f"{self.agent_name} worker did not answer within {self.request_timeout}s"))
+                    METRICS.inc("a2a_remote_requests_total", 1, dict(labels, outcome="timeout"))
+                    return
+                except Exception as e:
+                    self._finish(req, exc=TransportError(f"{self.agent_name} worker lost: {e}"))
+                    METRICS.inc("a2a_remote_requests_total", 1, dict(labels, outcome="lost"))
+                    return
+                self._finish(req, reply=reply)
+                METRICS.inc("a2a_remote_requests_total", 1,
+                            dict(labels, outcome="ok" if kind == FRAME_REPLY else "error"))
+        finally:
+            conn.close()
+            with self._lock:
+                self._alive -= 1
+                alive = self._alive
+            METRICS.set_gauge("a2a_remote_workers", alive, labels)
+            if alive == 0:
+                self._fail_queued(TransportError(f"no {self.agent_name} workers left"))
+
+    def _finish(self, req: _Request, reply: A2AMessage = None, exc: BaseException = None):
+        self._slots.release()
+        with self._lock:
+            if exc is None:
+                self.served += 1
+            else:
+                self.failed += 1
+        if exc is not None:
+            req.future.set_exception(exc)
+        else:
+            req.future.set_result(reply)
+
+    def _fail_queued(self, exc: BaseException):
+        while True:
+            try:
+                req = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if req is not _STOP and req.start():
+                self._finish(req, exc=exc)
+
+    # --- API used by A2ABus ---
+    def submit(self, msg: A2AMessage, timeout: float = None) -> Future:
+        """Queue msg for the next idle worker; the Future resolves to the reply message."""
+        if self._closed:
+            raise TransportError(f"{self.agent_name} pool is closed")
+        if not self._slots.acquire(timeout=timeout):
+            METRICS.inc("a2a_dropped_total", 1, {"reason": "full"})
+            raise BusFull(f"{self.agent_name} pool has {self.max_pending} requests pending")
+        return self._enqueue(msg)
+
+    async def asubmit(self, msg: A2AMessage, timeout: float = None) -> Future:
+        # only leave the event loop when the pool is saturated
+        if not self._closed and self._slots.acquire(blocking=False):
+            return self._enqueue(msg)
+        return await asyncio.to_thread(self.submit, msg, timeout)
+
+    def _enqueue(self, msg: A2AMessage) -> Future:
+        req = _Request(msg)
+        self._queue.put(req)
+        if self._alive == 0:
+            self._fail_queued(TransportError(f"no {self.agent_name} workers left"))
+        return req.future
+
+    def call(self, msg: A2AMessage, timeout: float = None) -> A2AMessage:
+        """Blocking request/reply, for callers without an event loop."""
+        reply = self.submit(msg, timeout).result(timeout)
+        if reply.error is not None:
+            raise reply.error
+        return reply
+
+    def alive(self) -> int:
+        return self._alive
+
+    def close(self, timeout: float = 5.0):
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for t in self._threads:
+            t.join(timeout)
+        self._fail_queued(TransportError(f"{self.agent_name} pool is closed"))
+        for p in self._procs:
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+        self._server.close()
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,7 +1,18 @@
 # src/agents.py
 import os
+import json
 import time
-from typing import Dict
+import asyncio
+import hashlib
+from typing import Dict, Iterator
+
+from cache import PersistentLRUCache
+from genai_wrapper import default_model_name, get_model
+from llm_gateway import current_priority, get_gateway
+from log_writer import get_log_writer
+from singleflight import SingleFlight
+from observability import METRICS
+from search_fanout import fanout_search
 
 # Optional: use google-generativeai if available
 GENAI_AVAILABLE = False
@@ -11,37 +22,185 @@ try:
 except Exception:
     GENAI_AVAILABLE = False
 
+AGENT_DEBUG_LOG = os.path.join(os.path.dirname(__file__), "..", "data", "processed", "agent_debug.log")
+
+# --- Content-addressed LLM response cache ---
+# Prompts are deterministic functions of the agent input, so identical input maps to
+# identical (model, prompt, generation config) and can reuse the stored response text.
+LLM_CACHE = PersistentLRUCache(
+    path=os.environ.get("LLM_CACHE_PATH", os.path.join(os.path.dirname(__file__), "..", "data", "processed", "llm_cache.json")),
+    max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "2000")),
+    default_ttl=float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+)
+
+def _llm_cache_enabled() -> bool:
+    return os.environ.get("LLM_CACHE_DISABLED", "").lower() not in ("1", "true", "yes")
+
+def response_cache_key(model_name: str, prompt: str, generation_config: dict = None) -> str:
+    payload = json.dumps([model_name, prompt, generation_config or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Identical prompts in flight at the same time share one LLM call. Flights are per
+# priority class, so an interactive request never waits behind a queued batch leader.
+LLM_FLIGHTS = SingleFlight()
+
+# An act() result carrying "degraded": True is a stand-in produced after a failure on the
+# real path (search error, mock text after a Gemini error, ...). It is shown to the user
+# but must not be checkpointed or reused as if it were the real answer.
+def is_degraded(out) -> bool:
+    return isinstance(out, dict) and bool(out.get("degraded"))
+
+def _fallback(out: Dict[str, str], degraded: bool) -> Dict[str, str]:
+    if degraded:
+        out["degraded"] = True
+    return out
+
+def _generate(prompt: str, session=None, use_cache: bool = False, generation_config: dict = None) -> str:
+    """Response text for `prompt`, from the cache if allowed, else via the LLM gateway."""
+    model_name = default_model_name()
+    key = response_cache_key(model_name, prompt, generation_config)
+    cache = use_cache and _llm_cache_enabled()
+    if cache:
+        cached = LLM_CACHE.get(key)
+        METRICS.inc("llm_cache_total", labels={"result": "miss" if cached is None else "hit"})
+        if cached is not None:
+            return cached
+
+    def call():
+        # every Gemini call is queued through the gateway (priority, fairness, per-model quota)
+        model = get_model(model_name)
+        session_id = getattr(session, "session_id", session)
+        kwargs = {"generation_config": generation_config} if generation_config else {}
+        resp = get_gateway().call(lambda: model.generate_content(contents=prompt, **kwargs),
+                                  model=model_name, session_id=session_id)
+        text = getattr(resp, "text", None) or str(resp)
+        if cache:
+            LLM_CACHE.set(key, text)
+        return text
+
+    return LLM_FLIGHTS.do((key, current_priority()), call)
+
+def _generate_stream(prompt: str, session=None, use_cache: bool = False, generation_config: dict = None) -> Iterator[str]:
+    """
+    Streaming _generate: yields response text chunks as the model produces them. Only the
+    request itself is queued and retried through the gateway; the complete text is cached
+    once the stream ends, and a cache hit is yielded as a single chunk.
+    Not coalesced through LLM_FLIGHTS: a caller joining a stream midway would miss the
+    chunks already yielded, so identical concurrent streams each make their own call.
+    """
+    model_name = default_model_name()
+    key = response_cache_key(model_name, prompt, generation_config)
+    cache = use_cache and _llm_cache_enabled()
+    if cache:
+        cached = LLM_CACHE.get(key)
+        METRICS.inc("llm_cache_total", labels={"result": "miss" if cached is None else "hit"})
+        if cached is not None:
+            yield cached
+            return
+
+    model = get_model(model_name)
+    session_id = getattr(session, "session_id", session)
+    kwargs = {"generation_config": generation_config} if generation_config else {}
+    resp = get_gateway().call(lambda: model.generate_content(contents=prompt, stream=True, **kwargs),
+                              model=model_name, session_id=session_id)
+    parts = []
+    for chunk in resp:
+        text = getattr(chunk, "text", None) or ""
+        if text:
+            parts.append(text)
+            yield text
+    if cache and parts:
+        LLM_CACHE.set(key, "".join(parts))
+
 class BaseAgent:
-    def __init__(self, name: str, tools: dict = None, use_mock: bool = True):
+    # whether LLM responses are served from / stored in LLM_CACHE unless overridden per instance
+    CACHE_RESPONSES = True
+    # passed to generate_content and part of the cache key
+    GENERATION_CONFIG = None
+
+    def __init__(self, name: str, tools: dict = None, use_mock: bool = True, cache_responses: bool = None):
         self.name = name
         self.tools = tools or {}
         self.use_mock = use_mock
+        self.cache_responses = self.CACHE_RESPONSES if cache_responses is None else cache_responses
         self.client = None
         if GENAI_AVAILABLE and not self.use_mock:
-            # We'll create GenerativeModel on demand to avoid heavy init
+            # GenerativeModel objects come from the shared registry in genai_wrapper
             pass
 
     def act(self, message: str, session=None) -> Dict[str, str]:
         raise NotImplementedError("act must be implemented by subclasses")
 
+    @staticmethod
+    def _mock_latency():
+        # synthetic LLM latency for mock outputs (benchmarks set MOCK_LLM_LATENCY; default 0)
+        delay = float(os.environ.get("MOCK_LLM_LATENCY", "0") or 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _generate(self, prompt: str, session=None) -> str:
+        return _generate(prompt, session, use_cache=self.cache_responses,
+                         generation_config=self.GENERATION_CONFIG)
+
+    def _generate_stream(self, prompt: str, session=None) -> Iterator[str]:
+        return _generate_stream(prompt, session, use_cache=self.cache_responses,
+                                generation_config=self.GENERATION_CONFIG)
+
+    def stream(self, message: str, session=None) -> Iterator[str]:
+        """
+        Yield the output text in chunks as it is produced; the chunks joined together
+        are the "content" act() would return. Agents without a streaming path yield
+        their whole act() content as one chunk. The generator returns True (the
+        StopIteration value) when the streamed text is a fallback or was cut short.
+        """
+        out = self.act(message, session)
+        yield out.get("content", "") if isinstance(out, dict) else str(out)
+        return is_degraded(out)
+
+    async def aact(self, message: str, session=None) -> Dict[str, str]:
+        """
+        Awaitable act. Agent work is dominated by blocking Gemini/CSE calls, so it runs
+        in the loop's default executor and the event loop is free for other sessions.
+        """
+        return await asyncio.to_thread(self.act, message, session)
+
 class ResearchAgent(BaseAgent):
+    # findings should reflect the current web, so the LLM fallback is not cached by default
+    CACHE_RESPONSES = False
+
+    def __init__(self, name: str, tools: dict = None, use_mock: bool = True, cache_responses: bool = None,
+                 fanout: bool = None, max_subqueries: int = 4, max_hits: int = 10):
+        super().__init__(name, tools=tools, use_mock=use_mock, cache_responses=cache_responses)
+        # fan-out mode (search_fanout): search sub-queries concurrently and merge the hits;
+        # None follows RESEARCH_FANOUT=1. Each sub-query is one search request against
+        # the Gemini quota, so max_subqueries multiplies the quota cost of a research step
+        if fanout is None:
+            fanout = os.environ.get("RESEARCH_FANOUT", "").lower() in ("1", "true", "yes")
+        self.fanout = fanout
+        self.max_subqueries = max_subqueries
+        self.max_hits = max_hits
+
+    def _search(self, query: str) -> dict:
+        tool = self.tools["search"]
+        if not self.fanout:
+            return tool.call(query)
+        try:
+            return {"status": "ok", "result": fanout_search(tool, query, max_subqueries=self.max_subqueries,
+                                                            max_hits=self.max_hits)}
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
+
     def act(self, message: str, session=None):
         query = message or ""
         # LOG what this agent received
         print(f"[ResearchAgent.act] received message: {query!r}")
-        try:
-            import logging, os
-            logdir = os.path.join(os.path.dirname(__file__), "..", "data", "processed")
-            os.makedirs(logdir, exist_ok=True)
-            with open(os.path.join(logdir, "agent_debug.log"), "a", encoding="utf-8") as fh:
-                fh.write(f"{int(time.time())} RESEARCH_ACT received: {query!r}\n")
-        except Exception:
-            pass
+        get_log_writer(AGENT_DEBUG_LOG).write(f"{int(time.time())} RESEARCH_ACT received: {query!r}")
 
+        degraded = False
         # Use search tool if provided and not mock
         if not self.use_mock and "search" in self.tools:
             try:
-                resp = self.tools["search"].call(query)
+                resp = self._search(query)
                 print(f"[ResearchAgent.act] tool returned status={resp.get('status')} result_source={resp.get('result', {}).get('source') if isinstance(resp.get('result'), dict) else None}")
                 if resp.get("status") == "ok":
                     result = resp["result"]
@@ -52,78 +211,111 @@ class ResearchAgent(BaseAgent):
                         return {"role": self.name, "type": "findings", "content": content}
                     # If result included an error field, surface it for debugging
                     if result.get("error"):
-                        return {"role": self.name, "type": "findings", "content": f"[search-error] {result.get('error')}"}
+                        return {"role": self.name, "type": "findings", "content": f"[search-error] {result.get('error')}",
+                                "degraded": True}
+                else:
+                    degraded = True
             except Exception as e:
                 print(f"[ResearchAgent] search tool error: {e}")
+                degraded = True
 
         # LLM fallback if available & not mock (short retrieval)
         if not self.use_mock and GENAI_AVAILABLE:
             try:
-                model_name = os.environ.get("GENAI_MODEL", "models/gemini-pro-latest")
-                model = genai.GenerativeModel(model_name)
                 prompt = f"Retrieve concise findings for: {query}\nProvide 3 bullet points (title - snippet)."
-                resp = model.generate_content(contents=prompt)
-                text = getattr(resp, "text", None) or str(resp)
-                return {"role": self.name, "type": "findings", "content": text}
+                text = self._generate(prompt, session)
+                # without a working search these are unsourced, so a later run should retry it
+                return _fallback({"role": self.name, "type": "findings", "content": text}, degraded)
             except Exception as e:
                 print("[ResearchAgent] genai LLM error:", e)
+                degraded = True
 
         # Mock fallback
+        self._mock_latency()
         mock_findings = [
             "Found paper: Quantum Supremacy 2024 - improved qubit stability technique.",
             "News: Qubit coherence improvement announced by University X."
         ]
-        return {"role": self.name, "type": "findings", "content": "\n".join(mock_findings)}
+        return _fallback({"role": self.name, "type": "findings", "content": "\n".join(mock_findings)}, degraded)
 
 class SummarizerAgent(BaseAgent):
     def act(self, message: str, session=None):
         text = message or ""
+        degraded = False
         if not self.use_mock and GENAI_AVAILABLE:
             try:
-                model_name = os.environ.get("GENAI_MODEL", "models/gemini-pro-latest")
-                model = genai.GenerativeModel(model_name)
                 prompt = f"Summarize the following findings in 3 clear bullets:\n\n{text}"
-                resp = model.generate_content(contents=prompt)
-                text_out = getattr(resp, "text", None) or str(resp)
+                text_out = self._generate(prompt, session)
                 return {"role": self.name, "type": "summary", "content": text_out}
             except Exception as e:
                 print("[SummarizerAgent] genai error:", e)
+                degraded = True
 
+        self._mock_latency()
         lines = [l.strip() for l in text.splitlines() if l.strip()]
         bullets = lines[:3] if lines else ["No findings to summarize."]
         summary = "Summary: " + " | ".join(bullets)
-        return {"role": self.name, "type": "summary", "content": summary}
+        return _fallback({"role": self.name, "type": "summary", "content": summary}, degraded)
 
 class CriticAgent(BaseAgent):
     def act(self, message: str, session=None):
         text = message or ""
+        degraded = False
         if not self.use_mock and GENAI_AVAILABLE:
             try:
-                model_name = os.environ.get("GENAI_MODEL", "models/gemini-pro-latest")
-                model = genai.GenerativeModel(model_name)
                 prompt = f"Critically evaluate for factuality and gaps:\n\n{text}"
-                resp = model.generate_content(contents=prompt)
-                text_out = getattr(resp, "text", None) or str(resp)
+                text_out = self._generate(prompt, session)
                 return {"role": self.name, "type": "critique", "content": text_out}
             except Exception as e:
                 print("[CriticAgent] genai error:", e)
+                degraded = True
 
+        self._mock_latency()
         critique = "Critique: Verify claims and add citations for key statements."
-        return {"role": self.name, "type": "critique", "content": critique}
+        return _fallback({"role": self.name, "type": "critique", "content": critique}, degraded)
 
 class WriterAgent(BaseAgent):
+    @staticmethod
+    def _prompt(text: str) -> str:
+        return f"Write a concise technical brief using the following input:\n\n{text}"
+
+    @staticmethod
+    def _mock_draft(text: str) -> str:
+        return "Draft Brief:\n\n" + (text[:2000] + ("..." if len(text) > 2000 else ""))
+
     def act(self, message: str, session=None):
         text = message or ""
+        degraded = False
         if not self.use_mock and GENAI_AVAILABLE:
             try:
-                model_name = os.environ.get("GENAI_MODEL", "models/gemini-pro-latest")
-                model = genai.GenerativeModel(model_name)
-                prompt = f"Write a concise technical brief using the following input:\n\n{text}"
-                resp = model.generate_content(contents=prompt)
-                text_out = getattr(resp, "text", None) or str(resp)
+                text_out = self._generate(self._prompt(text), session)
                 return {"role": self.name, "type": "draft", "content": text_out}
             except Exception as e:
                 print("[WriterAgent] genai error:", e)
+                degraded = True
+
+        self._mock_latency()
+        return _fallback({"role": self.name, "type": "draft", "content": self._mock_draft(text)}, degraded)
+
+    def stream(self, message: str, session=None) -> Iterator[str]:
+        # the draft is the longest output, so it is streamed token-by-token from Gemini
+        text = message or ""
+        degraded = False
+        if not self.use_mock and GENAI_AVAILABLE:
+            started = False
+            try:
+                for chunk in self._generate_stream(self._prompt(text), session):
+                    started = True
+                    yield chunk
+                return False
+            except Exception as e:
+                print("[WriterAgent] genai stream error:", e)
+                if started:
+                    # part of the draft is already out; don't append the mock draft to it,
+                    # but report it as cut short
+                    return True
+                degraded = True
 
-        draft = "Draft Brief:\n\n" + (text[:2000] + ("..." if len(text) > 2000 else ""))
-        return {"role": self.name, "type": "draft", "content": draft}
+        self._mock_latency()
+        yield self._mock_draft(text)
+        return degraded
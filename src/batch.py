@@ -0,0 +1,220 @@
+# src/batch.py
+"""
+Offline batch runner: pushes many queries through the Research -> Summarize -> Critique -> Write
+pipeline using a pool of worker processes, each with its own Orchestrator.
+
+- Input: JSONL (one {"id": ..., "query": ...} object or bare string per line) or CSV
+  (a "query" column, optional "id" column).
+- Output: JSONL, one line per finished query, written and fsync'ed as soon as it completes.
+- Resume: ids already recorded with status "ok" in the output file are skipped; a query
+  that failed part-way resumes from per-stage checkpoints (<output>.checkpoints.jsonl),
+  so only the stages after the last completed one run again. A query whose results hold
+  fallback output (search error, mock text after a Gemini failure) is recorded with
+  status "degraded" and runs again on resume, like an error.
+- Metrics: workers do not write agent_metrics.json themselves; each job's metrics travel back
+  with its result and the parent merges them, so the file holds totals for the whole pool.
+- Quota: workers keep genai_wrapper's file-backed GLOBAL_RATE_LIMITER, so the pool, the UI
+  and any other job on this host draw from one API quota. --max-requests/--per-seconds
+  set the rate stored in that state file (same GENAI_RATE_LIMIT_PATH) for the length of
+  the run, so every process refills at it; the previous rate is restored afterwards.
+
+Usage:
+    python src/batch.py queries.jsonl results.jsonl --workers 4 --real --max-requests 2 --per-seconds 60
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+from genai_wrapper import FileRateLimiter, get_global_rate_limiter
+from llm_gateway import PRIORITY_BATCH, get_gateway
+from observability import METRICS
+
+# Per-process orchestrator, built once by the pool initializer
+_WORKER_ORCH = None
+
+def read_queries(path: str) -> List[Dict[str, Any]]:
+    """Load jobs as [{"id": str, "query": str}, ...]. Missing ids default to the row number."""
+    jobs: List[Dict[str, Any]] = []
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for i, row in enumerate(csv.DictReader(f), start=1):
+                query = (row.get("query") or "").strip()
+                if query:
+                    jobs.append({"id": (row.get("id") or "").strip() or f"row-{i}", "query": query})
+        return jobs
+
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                # tolerate plain-text lines
+                item = line
+            if isinstance(item, str):
+                item = {"query": item}
+            query = str(item.get("query") or "").strip()
+            if query:
+                jobs.append({"id": str(item.get("id") or f"row-{i}"), "query": query})
+    return jobs
+
+def _completed_ids(output_path: str) -> set:
+    """
+    Ids with status "ok" in an existing output file. A trailing partial line left by a
+    crash mid-write is truncated so the next append starts on a clean line.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+    for line in data.decode("utf-8", errors="replace").splitlines():
+        try:
+            rec = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if rec.get("status") == "ok":
+            done.add(str(rec.get("id")))
+    return done
+
+def _quota_limiter(max_requests: int, per_seconds: int) -> FileRateLimiter:
+    # same state file as the default limiter: the override is the budget every other
+    # process on this host shares, not a private one
+    return FileRateLimiter(max_requests, per_seconds, path=get_global_rate_limiter().path)
+
+def _worker_init(use_mock: bool, memory_path: Optional[str], quota: Optional[tuple],
+                 checkpoint_path: Optional[str] = None):
+    global _WORKER_ORCH
+    # the parent owns the metrics file; a forked worker also drops the parent's series it inherited
+    METRICS.path = None
+    METRICS.reset()
+    if quota is not None:
+        # a worker that imported genai_wrapper afresh (spawn/forkserver) may have reset the
+        # shared rate from GENAI_RATE_LIMIT_RPM: put the run's rate back
+        _quota_limiter(*quota).configure()
+    # offline work yields to interactive requests wherever the two share a gateway
+    get_gateway().default_priority = PRIORITY_BATCH
+    from agents import ResearchAgent, SummarizerAgent, CriticAgent, WriterAgent
+    from orchestrator import Orchestrator
+    from tool_adapter import Tool, simple_search
+    search_tool = Tool("web_search", simple_search)
+    _WORKER_ORCH = Orchestrator(
+        agents=[
+            ResearchAgent("ResearchAgent", tools={"search": search_tool}, use_mock=use_mock),
+            SummarizerAgent("SummarizerAgent", use_mock=use_mock),
+            CriticAgent("CriticAgent", use_mock=use_mock),
+            WriterAgent("WriterAgent", use_mock=use_mock),
+        ],
+        memory_path=memory_path,
+        use_mock=use_mock,
+        priority=PRIORITY_BATCH,
+        checkpoint_path=checkpoint_path,
+    )
+
+def _flush_caches():
+    # pool workers exit without running atexit hooks, so each job's LLM and search
+    # responses are saved (merged into the shared cache files) when the job ends
+    from agents import LLM_CACHE
+    from tool_adapter import SEARCH_CACHE
+    for cache in (LLM_CACHE, SEARCH_CACHE):
+        cache.save()
+
+def _worker_run(job: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, list]]:
+    start = time.time()
+    session_id = f"batch-{job['id']}"
+    try:
+        results = _WORKER_ORCH.run_pipeline(session_id=session_id, user_query=job["query"])
+        # fallback stages were not checkpointed; the resume re-runs just those
+        status = "degraded" if results.get("degraded") else "ok"
+        rec = {"id": job["id"], "session_id": session_id, "query": job["query"], "status": status,
+               "results": results, "elapsed": round(time.time() - start, 3)}
+    except Exception as e:
+        rec = {"id": job["id"], "session_id": session_id, "query": job["query"], "status": "error",
+               "error": str(e), "elapsed": round(time.time() - start, 3)}
+    _flush_caches()
+    return rec, METRICS.drain()
+
+def run_batch(input_path: str, output_path: str, workers: int = 4, use_mock: bool = True,
+              memory_path: str = None, max_requests: int = None, per_seconds: int = 60,
+              resume: bool = True, checkpoints: bool = True) -> Dict[str, Any]:
+    """
+    Run every query in input_path and stream results to output_path.
+    max_requests/per_seconds set the rate of the host-wide GLOBAL_RATE_LIMITER for the run
+    (None/0 keeps the current one); either way the quota is shared with every other
+    process using GENAI_RATE_LIMIT_PATH.
+    With `checkpoints`, stage outputs go to output_path + ".checkpoints.jsonl" (shared by
+    all workers); resume=False starts that file over as well.
+    Returns counts: {"total", "skipped", "ok", "degraded", "error", "elapsed"}.
+    """
+    start = time.time()
+    jobs = read_queries(input_path)
+    out_dir = os.path.dirname(output_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    done = _completed_ids(output_path) if resume else set()
+    pending = [j for j in jobs if j["id"] not in done]
+    checkpoint_path = output_path + ".checkpoints.jsonl" if checkpoints else None
+    if checkpoint_path and not resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    summary = {"total": len(jobs), "skipped": len(jobs) - len(pending), "ok": 0, "degraded": 0, "error": 0}
+
+    quota = (max_requests, per_seconds) if max_requests else None
+    previous_budget = _quota_limiter(*quota).configure() if quota else None
+    mode = "a" if resume else "w"
+    try:
+        with open(output_path, mode, encoding="utf-8") as out, \
+                ProcessPoolExecutor(max_workers=max(1, workers), initializer=_worker_init,
+                                    initargs=(use_mock, memory_path, quota, checkpoint_path)) as pool:
+            futures = [pool.submit(_worker_run, job) for job in pending]
+            for fut in as_completed(futures):
+                rec, metrics = fut.result()
+                METRICS.merge(metrics)
+                out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+                summary[rec["status"]] += 1
+                print(f"[batch] {rec['id']}: {rec['status']} ({rec['elapsed']}s)")
+    finally:
+        if quota:
+            # back to the rate in force before the run (this process's default if none was)
+            if previous_budget is not None:
+                _quota_limiter(*quota).configure(*previous_budget)
+            else:
+                get_global_rate_limiter().configure()
+
+    METRICS.flush()
+    summary["elapsed"] = round(time.time() - start, 3)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run research queries through the pipeline in a worker pool.")
+    parser.add_argument("input", help="queries file (.jsonl or .csv)")
+    parser.add_argument("output", help="results file (.jsonl), appended to when resuming")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--real", action="store_true", help="use Gemini / Google APIs instead of mock mode")
+    parser.add_argument("--memory-path", default=None, help="optional memory store to record runs in")
+    parser.add_argument("--max-requests", type=int, default=0, help="host-wide quota: requests per window (0 = GENAI_RATE_LIMIT_RPM)")
+    parser.add_argument("--per-seconds", type=int, default=60, help="host-wide quota: window length in seconds")
+    parser.add_argument("--no-resume", action="store_true", help="ignore and overwrite an existing output file")
+    parser.add_argument("--no-checkpoints", action="store_true", help="do not keep per-stage checkpoints")
+    args = parser.parse_args(argv)
+
+    summary = run_batch(args.input, args.output, workers=args.workers, use_mock=not args.real,
+                        memory_path=args.memory_path, max_requests=args.max_requests,
+                        per_seconds=args.per_seconds, resume=not args.no_resume,
+                        checkpoints=not args.no_checkpoints)
+    print(json.dumps(summary))
+    return 0 if summary["error"] == 0 and summary["degraded"] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# src/cache.py
+"""Small thread-safe LRU cache with per-entry TTLs and optional JSON persistence."""
+import os
+import json
+import copy
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from file_lock import FileLock
+
+class PersistentLRUCache:
+    """
+    - Entries expire `ttl` seconds after they are set (ttl <= 0 means "do not cache").
+    - At most `max_entries` are kept; the least recently used entry is evicted first.
+    - When `path` is set the cache is loaded from it at start-up and saved at most every
+      `save_interval` seconds on write, plus once at interpreter exit.
+    - Several processes may share one path (batch workers, the UI): save() re-reads the
+      file under a lock file and merges it with this process's entries, so each writer
+      adds its entries instead of replacing everyone else's.
+    - Values must be JSON-serializable; get() returns a copy so callers cannot mutate entries.
+    """
+    def __init__(self, path: str = None, max_entries: int = 1000, default_ttl: float = 3600,
+                 save_interval: float = 5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, list]" = OrderedDict()  # key -> [expires_at, value]
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._removed = set()   # keys deleted here since the last save
+        self._cleared = False
+        self._last_save = time.time()
+        self._file_lock = FileLock(self.path + ".lock") if self.path else None
+        if self.path:
+            self.load()
+            atexit.register(self.save)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = [time.time() + ttl, copy.deepcopy(value)]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+            due = self.path and time.time() - self._last_save >= self.save_interval
+        if due:
+            self.save()
+
+    def delete(self, key: str):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._removed.add(key)
+                self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._removed.clear()
+            self._cleared = True
+            self._dirty = True
+        if self.path:
+            self.save()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "size": len(self._entries)}
+
+    def _read_rows(self) -> List[list]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                rows = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            print("[PersistentLRUCache] ignoring unreadable cache file:", e)
+            return []
+        return rows if isinstance(rows, list) else []
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        rows = self._read_rows()
+        now = time.time()
+        with self._lock:
+            for key, expires_at, value in rows:
+                if expires_at > now:
+                    self._entries[key] = [expires_at, value]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                now = time.time()
+                # least recently used first, so load() restores the same eviction order
+                ours = [[k, e[0], e[1]] for k, e in self._entries.items() if e[0] > now]
+                removed, cleared = self._removed, self._cleared
+                self._removed, self._cleared = set(), False
+                self._dirty = False
+                self._last_save = now
+            try:
+                cache_dir = os.path.dirname(self.path)
+                if cache_dir:
+                    os.makedirs(cache_dir, exist_ok=True)
+                with self._file_lock:
+                    rows = self._merge([] if cleared else self._read_rows(), ours, removed, now)
+                    # per-process tmp name: writers never share a half-written file
+                    tmp = f"{self.path}.{os.getpid()}.tmp"
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        json.dump(rows, f, ensure_ascii=False)
+                    os.replace(tmp, self.path)
+            except OSError as e:
+                print("[PersistentLRUCache] save error:", e)
+
+    def _merge(self, disk: List[list], ours: List[list], removed: set, now: float) -> List[list]:
+        """Entries on disk that this process does not hold, oldest first, then ours."""
+        mine = {row[0] for row in ours}
+        merged = [row for row in disk
+                  if isinstance(row, list) and len(row) == 3 and row[1] > now
+                  and row[0] not in mine and row[0] not in removed]
+        merged.extend(ours)
+        return merged[-self.max_entries:] if self.max_entries > 0 else []
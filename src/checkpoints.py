@@ -0,0 +1,138 @@
+# src/checkpoints.py
+"""
+Per-stage pipeline checkpoints: (session_id, stage, input hash) -> stage output.
+
+The orchestrator hashes what a stage is about to receive (stage, agent, model and the
+input message, which embeds the upstream outputs) and looks that up before running it, so a
+re-run or a resumed crash only recomputes stages whose inputs changed.
+
+- Storage: one append-only JSONL file, one line per completed stage, written under a
+  FileLock so worker processes (batch.py) can share it. Only an offset index is kept
+  in memory; outputs are read back from the file on a hit.
+- Lines appended by other processes are picked up on the next miss.
+- A later line for the same key wins; a torn last line (crash mid-write) is ignored.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from file_lock import FileLock
+from genai_wrapper import default_model_name
+
+def input_hash(stage: str, agent, message: str) -> str:
+    """
+    Content hash of one stage's inputs; agent class, mock mode and (for real agents) the
+    model name and generation config are part of it, so switching models re-runs stages.
+    """
+    mock = getattr(agent, "use_mock", None)
+    model = None if mock else default_model_name()
+    ident = [stage, getattr(agent, "name", None), type(agent).__name__, mock, model,
+             getattr(agent, "GENERATION_CONFIG", None), message]
+    return hashlib.sha256(json.dumps(ident, ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+
+class CheckpointStore:
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self.hits = 0
+        self.misses = 0
+        self._index: Dict[Tuple[str, str, str], Tuple[int, int]] = {}  # key -> (offset, length)
+        self._sessions: Dict[str, Dict[str, Tuple[str, str, str]]] = {}  # session -> stage -> latest key
+        self._scanned = 0
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(self.path + ".lock")
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with self._lock:
+            self._scan()
+
+    def _scan(self):
+        # index complete lines appended since the last scan (called with self._lock held)
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size <= self._scanned:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._scanned)
+            data = f.read(size - self._scanned)
+        end = data.rfind(b"\n") + 1
+        pos = 0
+        while pos < end:
+            nl = data.index(b"\n", pos)
+            line = data[pos:nl]
+            try:
+                rec = json.loads(line)
+                key = (rec["session_id"], rec["stage"], rec["input_hash"])
+            except (ValueError, KeyError, TypeError):
+                pos = nl + 1
+                continue
+            self._index[key] = (self._scanned + pos, nl - pos)
+            self._sessions.setdefault(key[0], {})[key[1]] = key
+            pos = nl + 1
+        self._scanned += end
+
+    def _read(self, loc: Tuple[int, int]) -> Optional[Dict[str, Any]]:
+        offset, length = loc
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                return json.loads(f.read(length))
+        except (OSError, ValueError):
+            return None
+
+    def get(self, session_id: str, stage: str, digest: str) -> Optional[str]:
+        """The checkpointed output for these inputs, or None."""
+        key = (session_id, stage, digest)
+        with self._lock:
+            loc = self._index.get(key)
+            if loc is None:
+                self._scan()
+                loc = self._index.get(key)
+        rec = self._read(loc) if loc is not None else None
+        if rec is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rec.get("output")
+
+    def put(self, session_id: str, stage: str, digest: str, output: str, agent: str = None):
+        rec = {"session_id": session_id, "stage": stage, "input_hash": digest, "agent": agent,
+               "output": output, "ts": time.time()}
+        line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock, self._file_lock:
+            with open(self.path, "ab") as f:
+                # a torn line left by a crashed writer must not swallow this one
+                if f.tell() and not self._ends_with_newline():
+                    f.write(b"\n")
+                f.write(line)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            # picks up other writers' lines and this one
+            self._scan()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def latest(self, session_id: str) -> Dict[str, str]:
+        """stage -> most recently checkpointed output for a session (e.g. to prefill UI edits)."""
+        with self._lock:
+            self._scan()
+            keys = dict(self._sessions.get(session_id, {}))
+        out = {}
+        for stage, key in keys.items():
+            rec = self._read(self._index[key])
+            if rec is not None:
+                out[stage] = rec.get("output", "")
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._index), "sessions": len(self._sessions), "hits": self.hits, "misses": self.misses}
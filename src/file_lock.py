@@ -0,0 +1,76 @@
+# src/file_lock.py
+"""Cross-process exclusive lock on a lock file (fcntl on POSIX, msvcrt on Windows)."""
+import os
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+class FileLock:
+    """
+    Re-entrant exclusive lock shared by threads of this process and by other processes
+    opening the same lock file. Use as a context manager.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._fh = None
+        self._depth = 0
+        lock_dir = os.path.dirname(self.path)
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                fh = open(self.path, "a+b")
+                self._lock(fh)
+            except Exception:
+                self._thread_lock.release()
+                raise
+            self._fh = fh
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                self._unlock(self._fh)
+            finally:
+                self._fh.close()
+                self._fh = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    @staticmethod
+    def _lock(fh):
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            return
+        fh.seek(0)
+        while True:
+            try:
+                msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK gives up after ~10s of retries; keep waiting
+                time.sleep(0.05)
+
+    @staticmethod
+    def _unlock(fh):
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            return
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
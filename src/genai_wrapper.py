@@ -1,36 +1,182 @@
 # src/genai_wrapper.py
-import time, random, threading, re
-from typing import Callable, Any, Optional
+import os, time, random, threading, re, multiprocessing, asyncio, struct, tempfile
+from typing import Callable, Any, Optional, Iterable
 
-# Simple in-process rate limiter (sliding window)
+from file_lock import FileLock
+
+# Token-bucket rate limiter: refills at max_requests / per_seconds tokens per second, up to
+# `burst` tokens. try_acquire() is O(1) arithmetic on (tokens, last refill time).
+# With the default burst=1 requests are spaced per_seconds / max_requests apart, so no
+# per_seconds window ever sees more than max_requests; a larger burst trades that
+# strictness for lower latency on idle-then-busy traffic.
 class RateLimiter:
-    def __init__(self, max_requests: int, per_seconds: int):
+    def __init__(self, max_requests: int, per_seconds: int, burst: int = 1):
         self.max_requests = max_requests
         self.per_seconds = per_seconds
+        self.rate = max_requests / float(per_seconds)
+        self.capacity = float(max(1, burst))
         self.lock = threading.Lock()
-        self.timestamps = []
+        self._tokens = self.capacity
+        self._last = time.time()
 
-    def wait_for_slot(self):
-        """Block until a slot is available. Keeps timestamps of recent requests."""
+    def _take(self, tokens: float, last: float, n: float, rate: float = None, capacity: float = None):
+        """Refill then try to take n tokens. Returns (tokens, last, seconds_to_wait)."""
+        rate = self.rate if rate is None else rate
+        capacity = self.capacity if capacity is None else capacity
+        now = time.time()
+        tokens = min(capacity, tokens + max(0.0, now - last) * rate)
+        if tokens >= n:
+            return tokens - n, now, 0.0
+        return tokens, now, max((n - tokens) / rate, 0.001)
+
+    def _update(self, n: float) -> float:
+        # state lives on the instance here; shared subclasses override this
+        with self.lock:
+            self._tokens, self._last, wait = self._take(self._tokens, self._last, n)
+            return wait
+
+    def try_acquire(self, n: float = 1) -> float:
+        """Take n tokens if available. Returns 0.0 on success, else seconds until they will be."""
+        return self._update(n)
+
+    def acquire(self, n: float = 1, timeout: float = None) -> bool:
+        """Block until n tokens are taken (True) or `timeout` seconds pass (False)."""
+        deadline = None if timeout is None else time.time() + timeout
         while True:
-            with self.lock:
-                now = time.time()
-                # drop old timestamps
-                self.timestamps = [t for t in self.timestamps if t > now - self.per_seconds]
-                if len(self.timestamps) < self.max_requests:
-                    # we can proceed
-                    self.timestamps.append(now)
-                    return
-                # otherwise compute sleep time until earliest timestamp falls out of window
-                earliest = min(self.timestamps)
-                sleep_for = (earliest + self.per_seconds) - now
-            # sleep outside lock
-            if sleep_for > 0:
-                time.sleep(sleep_for + 0.01)  # tiny cushion
+            wait = self.try_acquire(n)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    async def aacquire(self, n: float = 1, timeout: float = None) -> bool:
+        """Awaitable acquire(): sleeps on the event loop instead of blocking the thread."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = self.try_acquire(n)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            await asyncio.sleep(wait)
+
+    def wait_for_slot(self):
+        """Block until a slot is available."""
+        self.acquire()
+
+# Token bucket shared by processes forked/spawned from one parent (e.g. a batch worker
+# pool): state lives in multiprocessing shared memory.
+class SharedRateLimiter(RateLimiter):
+    def __init__(self, max_requests: int, per_seconds: int, burst: int = 1, ctx=None):
+        super().__init__(max_requests, per_seconds, burst)
+        ctx = ctx or multiprocessing.get_context()
+        self.lock = ctx.Lock()
+        self._shared = ctx.Array("d", [self.capacity, time.time()], lock=False)
+
+    def _update(self, n: float) -> float:
+        with self.lock:
+            tokens, last, wait = self._take(self._shared[0], self._shared[1], n)
+            self._shared[0], self._shared[1] = tokens, last
+            return wait
+
+# Token bucket shared by every process on the host that uses the same state file,
+# e.g. several Streamlit workers, notebooks and batch jobs. The state (tokens, last
+# refill time, rate, capacity) is read-modified-written under an exclusive file lock.
+# The rate and capacity in the file are the host-wide budget every instance refills at,
+# whatever it was constructed with; configure() changes them for all of them at once.
+class FileRateLimiter(RateLimiter):
+    _STATE = struct.Struct("<dddd")
+    _LEGACY_STATE = struct.Struct("<dd")
+
+    def __init__(self, max_requests: int, per_seconds: int, path: str, burst: int = 1):
+        super().__init__(max_requests, per_seconds, burst)
+        self.path = path
+        self._file_lock = FileLock(path + ".lock")
+
+    def _read_state(self, f):
+        """(tokens, last, rate, capacity) from the open state file; None where it has none."""
+        f.seek(0)
+        raw = f.read(self._STATE.size)
+        if len(raw) == self._STATE.size:
+            return self._STATE.unpack(raw)
+        if len(raw) >= self._LEGACY_STATE.size:
+            # written before the rate was stored: keep the tokens, adopt our rate
+            return self._LEGACY_STATE.unpack(raw[:self._LEGACY_STATE.size]) + (None, None)
+        return None, None, None, None
+
+    def _write_state(self, f, tokens: float, last: float, rate: float, capacity: float):
+        f.seek(0)
+        f.truncate()
+        f.write(self._STATE.pack(tokens, last, rate, capacity))
+
+    def _update(self, n: float) -> float:
+        with self._file_lock:
+            with open(self.path, "a+b") as f:
+                tokens, last, rate, capacity = self._read_state(f)
+                if rate is None:
+                    rate, capacity = self.rate, self.capacity
+                if tokens is None:
+                    tokens, last = capacity, time.time()
+                tokens, last, wait = self._take(tokens, last, n, rate, capacity)
+                self._write_state(f, tokens, last, rate, capacity)
+            return wait
+
+    def budget(self) -> Optional[tuple]:
+        """(rate per second, capacity) currently in the state file, or None before first use."""
+        with self._file_lock:
+            with open(self.path, "a+b") as f:
+                _, _, rate, capacity = self._read_state(f)
+        return None if rate is None else (rate, capacity)
+
+    def configure(self, rate: float = None, capacity: float = None) -> Optional[tuple]:
+        """
+        Make this limiter's rate and capacity (or the given ones) the host-wide budget.
+        Tokens already in the bucket are kept, up to the new capacity. Returns the
+        previous (rate, capacity), or None if the file had none, e.g. to restore it later.
+        """
+        rate = self.rate if rate is None else rate
+        capacity = self.capacity if capacity is None else capacity
+        with self._file_lock:
+            with open(self.path, "a+b") as f:
+                tokens, last, old_rate, old_capacity = self._read_state(f)
+                if tokens is None:
+                    tokens, last = capacity, time.time()
+                elif old_rate is not None:
+                    # settle the refill owed at the old rate before switching
+                    tokens, last, _ = self._take(tokens, last, 0, old_rate, old_capacity)
+                self._write_state(f, min(tokens, capacity), last, rate, capacity)
+        return None if old_rate is None else (old_rate, old_capacity)
 
 # Global rate limiter: adjust to your quota (example: free tier shows 2/min -> use 2)
 # Set to allowed requests per minute. To be conservative, set slightly lower.
-GLOBAL_RATE_LIMITER = RateLimiter(max_requests=2, per_seconds=60)
+# File-backed so every process on this host (UI workers, notebooks, scripts) shares one budget.
+# The first process to use the file sets its rate; setting GENAI_RATE_LIMIT_RPM explicitly
+# (re)configures the shared budget when the module is imported.
+GLOBAL_RATE_LIMITER = FileRateLimiter(
+    max_requests=int(os.environ.get("GENAI_RATE_LIMIT_RPM", "2")),
+    per_seconds=60,
+    path=os.environ.get("GENAI_RATE_LIMIT_PATH", os.path.join(tempfile.gettempdir(), "genai_rate_limit.bucket")),
+)
+if os.environ.get("GENAI_RATE_LIMIT_RPM"):
+    try:
+        GLOBAL_RATE_LIMITER.configure()
+    except OSError as e:
+        print("[genai_wrapper] could not configure the shared rate limit:", e)
+
+def get_global_rate_limiter():
+    return GLOBAL_RATE_LIMITER
+
+def set_global_rate_limiter(limiter):
+    """Swap the process-wide limiter, e.g. for a SharedRateLimiter inherited by a worker process."""
+    global GLOBAL_RATE_LIMITER
+    GLOBAL_RATE_LIMITER = limiter
 
 def _parse_retry_seconds_from_msg(msg: str) -> Optional[float]:
     """
@@ -48,6 +194,27 @@ def _parse_retry_seconds_from_msg(msg: str) -> Optional[float]:
         return float(m2.group(1))
     return None
 
+def retry_delay_for(exc: Exception, attempt: int, initial_backoff: float = 1.0,
+                    max_backoff: float = 120.0) -> Optional[float]:
+    """
+    Seconds to sleep before retrying after `exc` on the given (1-based) attempt,
+    or None if the error is not retryable.
+    """
+    msg = str(exc)
+    # If server instructs a retry delay, use it
+    retry_seconds = _parse_retry_seconds_from_msg(msg)
+    if retry_seconds is not None:
+        # jitter small
+        sleep_for = min(max(retry_seconds, initial_backoff), max_backoff)
+        return sleep_for + random.uniform(0, min(2.0, sleep_for * 0.1))
+
+    # If it's quota/rate-limit type or transient (429, 503, 502), do exponential backoff
+    # We'll look for common HTTP codes or phrases
+    if "429" in msg or "quota" in msg.lower() or "rate" in msg.lower() or "503" in msg or "Timeout" in msg:
+        backoff = min(initial_backoff * (2 ** (attempt - 1)), max_backoff)
+        return backoff + random.uniform(0, backoff * 0.1)
+    return None
+
 def call_with_backoff(genai_call: Callable[[], Any],
                       max_attempts: int = 5,
                       initial_backoff: float = 1.0,
@@ -61,29 +228,89 @@ def call_with_backoff(genai_call: Callable[[], Any],
     while attempt < max_attempts:
         attempt += 1
         # wait for rate-limit slot
-        GLOBAL_RATE_LIMITER.wait_for_slot()
+        get_global_rate_limiter().wait_for_slot()
         try:
             return genai_call()
         except Exception as e:
-            msg = str(e)
-            # If server instructs a retry delay, use it
-            retry_seconds = _parse_retry_seconds_from_msg(msg)
-            if retry_seconds is not None:
-                # jitter small
-                sleep_for = min(max(retry_seconds, initial_backoff), max_backoff)
-                jitter = random.uniform(0, min(2.0, sleep_for * 0.1))
-                time.sleep(sleep_for + jitter)
-                continue
-
-            # If it's quota/rate-limit type or transient (429, 503, 502), do exponential backoff
-            # We'll look for common HTTP codes or phrases
-            if "429" in msg or "quota" in msg.lower() or "rate" in msg.lower() or "503" in msg or "Timeout" in msg:
-                backoff = min(initial_backoff * (2 ** (attempt - 1)), max_backoff)
-                jitter = random.uniform(0, backoff * 0.1)
-                time.sleep(backoff + jitter)
+            delay = retry_delay_for(e, attempt, initial_backoff, max_backoff)
+            if delay is not None:
+                time.sleep(delay)
                 continue
 
             # For other exceptions, rethrow immediately
             raise
     # If we exhausted attempts, raise last exception
     raise RuntimeError("Exceeded retry attempts for genai call")
+
+# --- Shared GenerativeModel registry ---
+# One model object per (model name, tool config) for the whole process, reused by every
+# agent and thread instead of rebuilding the SDK client and tool objects on each call.
+DEFAULT_MODEL = "models/gemini-pro-latest"
+_MODEL_REGISTRY = {}
+_REGISTRY_LOCK = threading.Lock()
+_CONFIGURED_API_KEY = None
+
+def default_model_name() -> str:
+    return os.environ.get("GENAI_MODEL", DEFAULT_MODEL)
+
+def configure_genai():
+    """Run genai.configure once per API key (no-op when using ADC)."""
+    global _CONFIGURED_API_KEY
+    import google.generativeai as genai
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if api_key and api_key != _CONFIGURED_API_KEY:
+        with _REGISTRY_LOCK:
+            if api_key != _CONFIGURED_API_KEY:
+                genai.configure(api_key=api_key)
+                _CONFIGURED_API_KEY = api_key
+    return genai
+
+def _build_tools(tools: Optional[str]):
+    if tools is None:
+        return None
+    if tools == "google_search":
+        # raises ImportError on SDK builds without the search tool types
+        from google.generativeai.types import Tool as GenAITool, GoogleSearch as GenAIGoogleSearch
+        return [GenAITool(google_search=GenAIGoogleSearch())]
+    raise ValueError(f"Unknown tool config: {tools!r}")
+
+def get_model(model_name: str = None, tools: str = None):
+    """
+    Shared GenerativeModel for `model_name` (default: GENAI_MODEL env or DEFAULT_MODEL),
+    optionally bound to a tool config ("google_search"). Created on first use.
+    """
+    model_name = model_name or default_model_name()
+    key = (model_name, tools)
+    model = _MODEL_REGISTRY.get(key)
+    if model is not None:
+        return model
+    genai = configure_genai()
+    with _REGISTRY_LOCK:
+        model = _MODEL_REGISTRY.get(key)
+        if model is None:
+            tool_objs = _build_tools(tools)
+            if tool_objs:
+                model = genai.GenerativeModel(model_name, tools=tool_objs)
+            else:
+                model = genai.GenerativeModel(model_name)
+            _MODEL_REGISTRY[key] = model
+    return model
+
+def warm_models(model_names: Iterable[str] = None, tool_configs: Iterable[Optional[str]] = (None, "google_search")):
+    """
+    Create the shared models up front (e.g. at app start) so the first request does not
+    pay for SDK import and client setup. Failures are reported, not raised.
+    """
+    for name in (model_names or [default_model_name(), DEFAULT_MODEL]):
+        for tools in tool_configs:
+            try:
+                get_model(name, tools=tools)
+            except Exception as e:
+                print(f"[genai_wrapper] could not warm model {name} tools={tools}: {e}")
+
+def reset_models():
+    """Drop cached models, e.g. after credentials change."""
+    global _CONFIGURED_API_KEY
+    with _REGISTRY_LOCK:
+        _MODEL_REGISTRY.clear()
+        _CONFIGURED_API_KEY = None
@@ -0,0 +1,181 @@
+# src/llm_gateway.py
+"""
+Central gateway for every Gemini call made by agents and tools.
+
+- Priority classes: interactive (UI) requests are dispatched ahead of batch jobs.
+- Per-model quota buckets: each model name can have its own limiter; models without
+  one share the process-wide limiter from genai_wrapper.
+- Fair queuing: within a priority class, sessions are served round-robin (start-time
+  fair queuing on a per-session virtual clock), so one busy session cannot starve others.
+- Metrics: queue depth and wait time per priority class via stats(); wait and call
+  latency histograms per model/priority in the observability metrics registry.
+
+Callers pass priority/session explicitly or set them for a block of code with
+llm_context(); Orchestrator does the latter around each agent call.
+"""
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from genai_wrapper import default_model_name, get_global_rate_limiter, retry_delay_for
+from observability import METRICS, span
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+
+_REQUEST_CONTEXT = contextvars.ContextVar("llm_request_context", default=None)
+
+@contextmanager
+def llm_context(priority: int = None, session_id: str = None):
+    """Set the priority class and/or session for LLM calls made inside the block."""
+    current = _REQUEST_CONTEXT.get() or {}
+    merged = dict(current)
+    if priority is not None:
+        merged["priority"] = priority
+    if session_id is not None:
+        merged["session_id"] = session_id
+    token = _REQUEST_CONTEXT.set(merged)
+    try:
+        yield
+    finally:
+        _REQUEST_CONTEXT.reset(token)
+
+def current_priority() -> int:
+    """Priority class a call made here would get: the llm_context one, else the gateway default."""
+    ctx = _REQUEST_CONTEXT.get() or {}
+    return ctx.get("priority", get_gateway().default_priority)
+
+class _ModelQueue:
+    """Waiting tickets for one model, ordered by (priority, virtual start time, arrival)."""
+    def __init__(self):
+        self.heap = []
+        self.virtual_time = 0.0
+        self.session_finish: Dict[Any, float] = {}
+
+class LLMGateway:
+    def __init__(self, default_priority: int = PRIORITY_INTERACTIVE, max_attempts: int = 3,
+                 initial_backoff: float = 1.0, max_backoff: float = 120.0):
+        self.default_priority = default_priority
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._model_limiters: Dict[str, Any] = {}
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def set_model_limiter(self, model_name: str, limiter):
+        """Give `model_name` its own quota bucket (any object with try_acquire())."""
+        with self._cond:
+            self._model_limiters[model_name] = limiter
+            self._cond.notify_all()
+
+    def _limiter_for(self, model_name: str):
+        return self._model_limiters.get(model_name) or get_global_rate_limiter()
+
+    def call(self, fn: Callable[[], Any], model: str = None, priority: int = None,
+             session_id: str = None, max_attempts: int = None) -> Any:
+        """
+        Run `fn` (one generate_content call) once it is this request's turn and a quota
+        slot for `model` is free. Rate-limit/transient errors are retried; each retry
+        queues again so it is charged against the quota like any other request.
+        """
+        ctx = _REQUEST_CONTEXT.get() or {}
+        model = model or default_model_name()
+        priority = priority if priority is not None else ctx.get("priority", self.default_priority)
+        session_id = session_id if session_id is not None else ctx.get("session_id")
+        attempts = max_attempts or self.max_attempts
+        for attempt in range(1, attempts + 1):
+            with span("llm.request", model=model, priority=PRIORITY_NAMES.get(priority, str(priority)),
+                      attempt=attempt) as s:
+                queued = time.perf_counter()
+                self._acquire(model, priority, session_id)
+                t0 = time.perf_counter()
+                s.set_attribute("queue_wait_s", t0 - queued)
+                try:
+                    result = fn()
+                except Exception as e:
+                    delay = retry_delay_for(e, attempt, self.initial_backoff, self.max_backoff)
+                    final = delay is None or attempt == attempts
+                    self._record_call(model, t0, "error" if final else "retry")
+                    if final:
+                        raise
+                    s.record_error(e)
+                    s.set_attribute("retry_in_s", delay)
+                else:
+                    self._record_call(model, t0, "ok")
+                    return result
+            time.sleep(delay)
+        raise RuntimeError("Exceeded retry attempts for genai call")
+
+    def _acquire(self, model: str, priority: int, session_id):
+        enqueued = time.perf_counter()
+        with self._cond:
+            q = self._queues.setdefault(model, _ModelQueue())
+            start = max(q.virtual_time, q.session_finish.get((priority, session_id), 0.0))
+            q.session_finish[(priority, session_id)] = start + 1.0
+            ticket = (priority, start, next(self._seq))
+            heapq.heappush(q.heap, ticket)
+            self._record_enqueue(priority)
+            try:
+                while True:
+                    if q.heap[0] is ticket:
+                        wait = self._limiter_for(model).try_acquire()
+                        if wait == 0.0:
+                            heapq.heappop(q.heap)
+                            q.virtual_time = max(q.virtual_time, start)
+                            if not q.heap:
+                                # idle queue: per-session clocks no longer matter
+                                q.session_finish.clear()
+                            self._cond.notify_all()
+                            break
+                        # a newly arrived higher-priority ticket wakes us and takes the head
+                        self._cond.wait(timeout=wait + 0.01)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                q.heap.remove(ticket)
+                heapq.heapify(q.heap)
+                self._cond.notify_all()
+                self._record_dequeue(model, priority, enqueued)
+                raise
+            self._record_dequeue(model, priority, enqueued)
+
+    # --- metrics ---
+    def _record_enqueue(self, priority: int):
+        st = self._stats.setdefault(PRIORITY_NAMES.get(priority, str(priority)),
+                                    {"queue_depth": 0, "requests": 0, "total_wait_s": 0.0, "max_wait_s": 0.0})
+        st["queue_depth"] += 1
+        st["requests"] += 1
+
+    def _record_dequeue(self, model: str, priority: int, enqueued: float):
+        waited = time.perf_counter() - enqueued
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        METRICS.observe("llm_queue_wait_seconds", waited, {"model": model, "priority": name})
+        st = self._stats[name]
+        st["queue_depth"] -= 1
+        st["total_wait_s"] += waited
+        st["max_wait_s"] = max(st["max_wait_s"], waited)
+
+    @staticmethod
+    def _record_call(model: str, t0: float, status: str):
+        METRICS.observe("llm_call_seconds", time.perf_counter() - t0, {"model": model, "status": status})
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per priority class: current queue depth, requests seen, total/avg/max wait seconds."""
+        with self._cond:
+            out = {}
+            for name, st in self._stats.items():
+                out[name] = dict(st, avg_wait_s=st["total_wait_s"] / st["requests"] if st["requests"] else 0.0)
+            return out
+
+GATEWAY = LLMGateway()
+
+def get_gateway() -> LLMGateway:
+    return GATEWAY
@@ -0,0 +1,249 @@
+# src/log_writer.py
+"""
+Background, batched appender for line-oriented logs (JSONL traces/events, debug logs).
+
+Callers only enqueue a line; one daemon thread per file drains the queue and appends
+whole batches through a file handle it keeps open.
+- Batching: a batch is written once `batch_size` lines are queued or `flush_interval`
+  seconds after its first line, whichever comes first.
+- Rotation: before a batch would push the file past `max_bytes` it is renamed to
+  path.1 (path.1 -> path.2, ...; at most `backup_count` kept), gzip-compressed to
+  path.1.gz when `compress` is set.
+- Backpressure: the queue holds at most `max_queue` lines; policy "drop" discards new
+  lines when it is full (counted in stats()), policy "block" makes the caller wait.
+"""
+import os
+import time
+import gzip
+import queue
+import atexit
+import shutil
+import threading
+import multiprocessing.util
+from typing import Dict, Optional
+
+class _Flush:
+    __slots__ = ("done",)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+_STOP = object()
+
+class BackgroundLogWriter:
+    def __init__(self, path: str, max_queue: int = 10000, batch_size: int = 512, flush_interval: float = 1.0,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, compress: bool = False,
+                 policy: str = "drop"):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"unknown backpressure policy: {policy!r}")
+        self.path = os.path.abspath(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.policy = policy
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._file = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"log-writer:{os.path.basename(path)}", daemon=True)
+        self._thread.start()
+
+    def write(self, line: str) -> bool:
+        """Queue one line (newline added if missing). Returns False if it was dropped."""
+        if self._closed:
+            return False
+        if not line.endswith("\n"):
+            line += "\n"
+        if self.policy == "block":
+            self._queue.put(line)
+            return True
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self, timeout: float = None) -> bool:
+        """Block until every line queued before this call is written. False on timeout."""
+        if self._closed or not self._thread.is_alive():
+            return False
+        marker = _Flush()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """Write what is queued, stop the thread and close the file."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped,
+                "batches": self.batches, "rotations": self.rotations}
+
+    # --- writer thread ---
+    def _run(self):
+        batch, markers = [], []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            stop = item is _STOP
+            if isinstance(item, _Flush):
+                markers.append(item)
+            elif isinstance(item, str):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and (item is None or stop or markers or len(batch) >= self.batch_size
+                          or time.monotonic() >= deadline):
+                self._write_batch(batch)
+                batch, deadline = [], None
+            for m in markers:
+                m.done.set()
+            markers = []
+            if stop:
+                self._close_file()
+                return
+
+    def _write_batch(self, lines):
+        data = "".join(lines).encode("utf-8")
+        try:
+            f = self._open()
+            size = f.tell()
+            if self.max_bytes and size and size + len(data) > self.max_bytes:
+                self._rotate()
+                f = self._open()
+            f.write(data)
+            f.flush()
+            self.written += len(lines)
+            self.batches += 1
+        except OSError as e:
+            self.dropped += len(lines)
+            print(f"[BackgroundLogWriter] write error for {self.path}: {e}")
+            self._close_file()
+
+    def _open(self):
+        if self._file is not None:
+            # another process may have rotated the file under us: follow the path
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino:
+                    return self._file
+            except OSError:
+                pass
+            self._close_file()
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._file = open(self.path, "ab")
+        return self._file
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _backup_name(self, n: int) -> str:
+        return f"{self.path}.{n}" + (".gz" if self.compress else "")
+
+    def _rotate(self):
+        self._close_file()
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            self.rotations += 1
+            return
+        oldest = self._backup_name(self.backup_count)
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for n in range(self.backup_count - 1, 0, -1):
+            src = self._backup_name(n)
+            if os.path.exists(src):
+                os.replace(src, self._backup_name(n + 1))
+        if self.compress:
+            tmp = f"{self.path}.rotating"
+            os.replace(self.path, tmp)
+            with open(tmp, "rb") as src, gzip.open(self._backup_name(1), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(tmp)
+        else:
+            os.replace(self.path, self._backup_name(1))
+        self.rotations += 1
+
+# --- process-wide writers, one per file ---
+_WRITERS: Dict[str, BackgroundLogWriter] = {}
+_WRITERS_LOCK = threading.Lock()
+_EXIT_HOOKED = False
+
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+def get_log_writer(path: str, **kwargs) -> BackgroundLogWriter:
+    """
+    Shared writer for `path`, created on first use. Defaults come from LOG_WRITER_MAX_QUEUE,
+    LOG_WRITER_FLUSH_INTERVAL, LOG_WRITER_MAX_BYTES, LOG_WRITER_BACKUPS, LOG_WRITER_COMPRESS
+    and LOG_WRITER_POLICY; keyword arguments override them for a newly created writer.
+    """
+    key = os.path.abspath(path)
+    writer = _WRITERS.get(key)
+    if writer is not None:
+        return writer
+    with _WRITERS_LOCK:
+        writer = _WRITERS.get(key)
+        if writer is None:
+            opts = dict(
+                max_queue=int(os.environ.get("LOG_WRITER_MAX_QUEUE", "10000")),
+                flush_interval=float(os.environ.get("LOG_WRITER_FLUSH_INTERVAL", "1.0")),
+                max_bytes=int(os.environ.get("LOG_WRITER_MAX_BYTES", str(10 * 1024 * 1024))),
+                backup_count=int(os.environ.get("LOG_WRITER_BACKUPS", "5")),
+                compress=_env_flag("LOG_WRITER_COMPRESS"),
+                policy=os.environ.get("LOG_WRITER_POLICY", "drop"),
+            )
+            opts.update(kwargs)
+            writer = _WRITERS[key] = BackgroundLogWriter(key, **opts)
+            _hook_process_exit()
+        return writer
+
+def flush_all(timeout: Optional[float] = None):
+    for writer in list(_WRITERS.values()):
+        writer.flush(timeout)
+
+def close_all():
+    with _WRITERS_LOCK:
+        writers = list(_WRITERS.values())
+        _WRITERS.clear()
+    for writer in writers:
+        writer.close()
+
+def _hook_process_exit():
+    # multiprocessing children leave through os._exit, which skips atexit; its
+    # exit-time finalizers still run, so pool workers get their queues written too
+    global _EXIT_HOOKED
+    if not _EXIT_HOOKED:
+        multiprocessing.util.Finalize(None, close_all, exitpriority=10)
+        _EXIT_HOOKED = True
+
+def _reset_after_fork():
+    # writer threads do not survive fork; children start their own on first use
+    global _WRITERS_LOCK, _EXIT_HOOKED
+    _WRITERS_LOCK = threading.Lock()
+    _WRITERS.clear()
+    _EXIT_HOOKED = False
+
+atexit.register(close_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
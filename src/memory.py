@@ -1,8 +1,25 @@
 # src/memory.py
 import os
+import re
 import json
+import mmap
+import shutil
 import time
-from typing import Any, Dict, List, Optional
+import bisect
+import threading
+import unicodedata
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterator, List, Optional
+
+from file_lock import FileLock
+
+_DASHES = dict.fromkeys(map(ord, "\u2010\u2011\u2012\u2013\u2014\u2015\u2212"), "-")
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a query for lookups: NFKC, lowercase, ASCII dashes, single spaces."""
+    text = unicodedata.normalize("NFKC", query or "").translate(_DASHES).lower()
+    return re.sub(r"\s+", " ", text).strip()
 
 class Session:
     """
@@ -36,23 +53,319 @@ class Session:
         s.turns = d.get("turns", [])
         return s
 
+_DECODER = json.JSONDecoder()
+_WS = re.compile(r"[ \t\n\r]*")
+
+def _leading_fields(text: str, wanted) -> Dict[str, Any]:
+    """
+    Decode the leading key/value pairs of a JSON object for as long as they are in
+    `wanted`, stopping at the first other key, so values after it are never parsed.
+    """
+    found: Dict[str, Any] = {}
+    pos = _WS.match(text, 1).end()
+    try:
+        while len(found) < len(wanted) and text.startswith('"', pos):
+            key, pos = _DECODER.raw_decode(text, pos)
+            if key not in wanted:
+                break
+            pos = _WS.match(text, pos).end()
+            if not text.startswith(":", pos):
+                break
+            value, pos = _DECODER.raw_decode(text, _WS.match(text, pos + 1).end())
+            found[key] = value
+            pos = _WS.match(text, pos).end()
+            if not text.startswith(",", pos):
+                break
+            pos = _WS.match(text, pos + 1).end()
+    except ValueError:
+        pass
+    return found
+
+class MemoryRecord(Mapping):
+    """
+    Read-only record backed by its raw JSON line. The small lookup fields (session_id,
+    timestamp, query, reuse_key) are parsed from the head of the line without touching
+    the large text fields behind them; the full record is decoded once, on first access
+    to any other field, and kept for the life of this object.
+    """
+    __slots__ = ("_raw", "_small", "_full")
+    SMALL_FIELDS = ("session_id", "timestamp", "query", "reuse_key")
+    # fields every record has; the others only count as head fields when they lead the line
+    REQUIRED_FIELDS = SMALL_FIELDS[:3]
+    HEAD_BYTES = 4096
+
+    def __init__(self, raw: bytes):
+        self._raw = raw
+        self._small = None
+        self._full = None
+
+    def _decode(self) -> Dict[str, Any]:
+        if self._full is None:
+            try:
+                parsed = json.loads(self._raw)
+            except ValueError:
+                parsed = {}
+            self._full = parsed if isinstance(parsed, dict) else {"value": parsed}
+        return self._full
+
+    def _small_fields(self) -> Dict[str, Any]:
+        if self._small is None:
+            if self._full is not None:
+                small = self._full
+            else:
+                # the lookup fields lead every record the orchestrator writes; a head cut
+                # inside them just fails to parse and falls back to the full decode below
+                text = self._raw[:self.HEAD_BYTES].decode("utf-8", errors="ignore")
+                small = _leading_fields(text, self.SMALL_FIELDS) if text.startswith("{") else {}
+                if any(k not in small for k in self.REQUIRED_FIELDS):
+                    # fields missing from the head (other writers): decode it all
+                    small = self._decode()
+            self._small = {k: small[k] for k in self.SMALL_FIELDS if k in small}
+        return self._small
+
+    def head(self) -> Dict[str, Any]:
+        """
+        The lookup fields, without decoding the rest of the record when they lead it.
+        An optional field (reuse_key) missing here may still sit further down the line.
+        """
+        return self._small_fields()
+
+    def __getitem__(self, key):
+        if key in self.REQUIRED_FIELDS:
+            return self._small_fields()[key]
+        small = self._small_fields()
+        if key in small:
+            return small[key]
+        return self._decode()[key]
+
+    def __iter__(self):
+        return iter(self._decode())
+
+    def __len__(self):
+        return len(self._decode())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._decode()
+
+    def __repr__(self):
+        return f"MemoryRecord({self._raw[:80]!r})"
+
+class _RecordFile:
+    """One snapshot/segment file, opened at load so compaction cannot pull it from under us."""
+    def __init__(self, path: str, require_newline: bool):
+        self.fh = open(path, "rb")
+        self.size = os.fstat(self.fh.fileno()).st_size
+        self.require_newline = require_newline
+        self.mm = None
+        self._read_lock = threading.Lock()
+        if self.size:
+            try:
+                self.mm = mmap.mmap(self.fh.fileno(), self.size, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                self.mm = None
+
+    def read(self, start: int, length: int) -> bytes:
+        if self.mm is not None:
+            return self.mm[start:start + length]
+        with self._read_lock:
+            self.fh.seek(start)
+            return self.fh.read(length)
+
+    def line_spans(self):
+        """Yield (start, length) of each record line: '{...}' with any array comma stripped."""
+        data = self.mm if self.mm is not None else self.read(0, self.size)
+        pos = 0
+        while pos < self.size:
+            nl = data.find(b"\n", pos)
+            if nl == -1:
+                if self.require_newline:
+                    # torn final write in a log segment
+                    return
+                nl = self.size
+            a, b = pos, nl
+            while a < b and data[a:a + 1].isspace():
+                a += 1
+            while b > a and data[b - 1:b] in (b" ", b"\r", b"\t", b","):
+                b -= 1
+            if b > a and data[a:a + 1] == b"{" and data[b - 1:b] == b"}":
+                yield a, b - a
+            pos = nl + 1
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+        self.fh.close()
+
+class _LazyRecords(Sequence):
+    """
+    Sequence view over the on-disk records: an offset index (file, start, length) built
+    on first use, with records materialized as MemoryRecord on access. Records appended
+    after load are held in `_tail`.
+    """
+    def __init__(self, files: List[_RecordFile]):
+        self._files = files
+        self._file_idx = array("i")
+        self._starts = array("q")
+        self._lengths = array("i")
+        self._tail: List[Any] = []
+        self._scanned = False
+        self._scan_lock = threading.Lock()
+
+    def _ensure_scanned(self):
+        if self._scanned:
+            return
+        with self._scan_lock:
+            if self._scanned:
+                return
+            for idx, rf in enumerate(self._files):
+                for start, length in rf.line_spans():
+                    self._file_idx.append(idx)
+                    self._starts.append(start)
+                    self._lengths.append(length)
+            self._scanned = True
+
+    def __len__(self):
+        self._ensure_scanned()
+        return len(self._starts) + len(self._tail)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("record index out of range")
+        n_disk = len(self._starts)
+        if i >= n_disk:
+            return self._tail[i - n_disk]
+        rf = self._files[self._file_idx[i]]
+        return MemoryRecord(rf.read(self._starts[i], self._lengths[i]))
+
+    def append(self, record):
+        self._tail.append(record)
+
+    def close(self):
+        for rf in self._files:
+            rf.close()
+        self._files = []
+
 class MemoryStore:
     """
     Robust memory store:
-    - Loads either a single JSON value, a JSON array, or a JSONL file.
-    - Persists as a canonical JSON array.
-    - Provides append() and find helpers.
+    - Loads either a single JSON value, a JSON array, or a JSONL file (the snapshot at `path`),
+      followed by the append-only log segments in `path + ".log/"`.
+    - append() writes one JSON line to the active segment (O(1), no full rewrite).
+    - Segments roll over at `segment_max_bytes`; sealed segments are compacted into the
+      snapshot (a JSON array with one record per line) in a background thread.
+    - All writers (UI, notebooks, Orchestrator, other processes) serialize on a lock file.
+    - Lookups by session, timestamp range and normalized query go through in-memory
+      indexes, built on first use after a load and kept up to date by append().
+    - lazy=True keeps only an offset index resident: `store` becomes a read-only sequence
+      of MemoryRecord objects read from memory-mapped files on demand. Use iter_records()
+      or page() to walk history without materializing it.
+    - fsync policy: "always" (every append), "interval" (at most every `fsync_interval`
+      seconds) or "never" (leave it to the OS).
     """
-    def __init__(self, path: str):
+    FSYNC_POLICIES = ("always", "interval", "never")
+
+    def __init__(self, path: str, fsync: str = "interval", fsync_interval: float = 1.0,
+                 segment_max_bytes: int = 4 * 1024 * 1024, compact_after_segments: int = 4,
+                 background_compaction: bool = True, lazy: bool = False):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {self.FSYNC_POLICIES}, got {fsync!r}")
         self.path = path
+        self.log_dir = self.path + ".log"
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.segment_max_bytes = segment_max_bytes
+        self.compact_after_segments = compact_after_segments
+        self.background_compaction = background_compaction
+        self.lazy = lazy
         self.store: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(self.path + ".lock")
+        self._last_fsync = 0.0
+        self._compaction_thread = None
+        self._reset_indexes()
         os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        os.makedirs(self.log_dir, exist_ok=True)
         self._load()
 
     def _load(self):
+        if isinstance(self.store, _LazyRecords):
+            self.store.close()
+        with self._file_lock:
+            if self.lazy:
+                self.store = self._open_lazy()
+            else:
+                self.store = self._read_snapshot()
+                for name in self._segment_names():
+                    self.store.extend(self._read_jsonl(os.path.join(self.log_dir, name)))
+        self._reset_indexes()
+
+    def _open_lazy(self) -> "_LazyRecords":
+        # called with the file lock held
+        files = []
+        if os.path.exists(self.path):
+            if not self._snapshot_is_line_oriented():
+                self._convert_snapshot()
+            files.append(_RecordFile(self.path, require_newline=False))
+        for name in self._segment_names():
+            files.append(_RecordFile(os.path.join(self.log_dir, name), require_newline=True))
+        return _LazyRecords(files)
+
+    def _convert_snapshot(self):
+        """
+        One-time rewrite of a pretty-printed (or otherwise not line-oriented) snapshot
+        into one record per line. The original is kept next to it as a .bak file, and the
+        rewrite is skipped if any part of the file does not parse, so no record is lost.
+        """
+        # called with the file lock held
+        with open(self.path, "r", encoding="utf-8") as f:
+            content = f.read()
+        try:
+            parsed = json.loads(content)
+            records = parsed if isinstance(parsed, list) else [parsed]
+        except json.JSONDecodeError:
+            records, skipped = [], 0
+            for line in content.splitlines():
+                values = self._decode_line(line)
+                if values is None:
+                    skipped += 1
+                else:
+                    records.extend(values)
+            if skipped:
+                print(f"[MemoryStore] not rewriting {self.path}: {skipped} line(s) do not parse "
+                      "and would be dropped; those records are skipped on load until fixed")
+                return
+        backup = self.path + ".bak"
+        if os.path.exists(backup):
+            backup = f"{self.path}.{int(time.time())}.bak"
+        shutil.copy2(self.path, backup)
+        self._write_snapshot(records)
+        print(f"[MemoryStore] rewrote {self.path} with one record per line, original kept as {backup}")
+
+    def _snapshot_is_line_oriented(self) -> bool:
+        """True if every record in the snapshot sits on its own line (checked on the first one)."""
+        with open(self.path, "rb") as f:
+            for line in f:
+                line = line.strip().rstrip(b",").strip()
+                if not line or line == b"[":
+                    continue
+                if line in (b"[]", b"]"):
+                    return True
+                return line.startswith(b"{") and line.endswith(b"}")
+        return True
+
+    def refresh(self):
+        """Reload snapshot and segments to pick up records appended by other processes."""
+        with self._lock:
+            self._load()
+
+    def _read_snapshot(self) -> List[Dict[str, Any]]:
         if not os.path.exists(self.path):
-            self.store = []
-            return
+            return []
 
         with open(self.path, "r", encoding="utf-8") as f:
             content = f.read()
@@ -61,48 +374,244 @@ class MemoryStore:
         try:
             parsed = json.loads(content)
             if isinstance(parsed, list):
-                self.store = parsed
-            else:
-                # single JSON object -> wrap in list
-                self.store = [parsed]
-            return
+                return parsed
+            # single JSON object -> wrap in list
+            return [parsed]
         except json.JSONDecodeError:
             # fallback: parse as JSON lines (one JSON object per line)
-            items: List[Dict[str, Any]] = []
-            for i, line in enumerate(content.splitlines(), start=1):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    items.append(json.loads(line))
-                except json.JSONDecodeError:
-                    # skip invalid lines
-                    continue
-            self.store = items
+            return self._parse_jsonl(content)
+
+    def _read_jsonl(self, path: str) -> List[Dict[str, Any]]:
+        with open(path, "r", encoding="utf-8") as f:
+            return self._parse_jsonl(f.read())
+
+    @staticmethod
+    def _decode_line(line: str) -> Optional[List[Any]]:
+        """
+        Records on one line: a JSON value, values run together ('[]{...}' from an append
+        onto an empty array) or a line of a one-record-per-line array. None if it does not parse.
+        """
+        line = line.strip().rstrip(",").strip()
+        if line in ("", "[", "]"):
+            return []
+        # '[{...},' opens a one-record-per-line array written by other tools
+        for text in [line] + ([line[1:]] if line.startswith("[") else []):
+            values, pos = [], 0
+            try:
+                while pos < len(text):
+                    value, pos = _DECODER.raw_decode(text, pos)
+                    values.extend(value if isinstance(value, list) else [value])
+                    pos = _WS.match(text, pos).end()
+                    if text.startswith(",", pos):
+                        pos = _WS.match(text, pos + 1).end()
+            except ValueError:
+                continue
+            return values
+        return None
+
+    @classmethod
+    def _parse_jsonl(cls, content: str) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        for line in content.splitlines():
+            values = cls._decode_line(line)
+            # skip invalid lines (e.g. a torn final write)
+            if values:
+                items.extend(values)
+        return items
+
+    def _segment_names(self) -> List[str]:
+        names = [n for n in os.listdir(self.log_dir) if n.endswith(".jsonl") and n[:-6].isdigit()]
+        return sorted(names, key=lambda n: int(n[:-6]))
+
+    def _active_segment(self) -> str:
+        # called with the file lock held
+        names = self._segment_names()
+        if names:
+            last = os.path.join(self.log_dir, names[-1])
+            if os.path.getsize(last) < self.segment_max_bytes:
+                return last
+            seq = int(names[-1][:-6]) + 1
+        else:
+            seq = 1
+        return os.path.join(self.log_dir, f"{seq:08d}.jsonl")
+
+    def append(self, record: Dict[str, Any]) -> int:
+        """
+        Append a new record (dict) to memory and to the active log segment.
+        Returns its position in `store`.
+        """
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            with self._file_lock:
+                with open(self._active_segment(), "a+b") as f:
+                    if f.seek(0, os.SEEK_END):
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            # a torn write left a partial line: start ours on a fresh one
+                            f.write(b"\n")
+                    f.write(line)
+                    f.flush()
+                    self._maybe_fsync(f)
+                sealed = len(self._segment_names()) - 1
+            self.store.append(MemoryRecord(line.rstrip(b"\n")) if self.lazy else record)
+            pos = len(self.store) - 1
+            if self._indexed:
+                self._index_record(pos, record)
+        if self.background_compaction and sealed >= self.compact_after_segments:
+            self._start_compaction()
+        return pos
+
+    def _maybe_fsync(self, f):
+        if self.fsync == "never":
             return
+        now = time.time()
+        if self.fsync == "always" or now - self._last_fsync >= self.fsync_interval:
+            os.fsync(f.fileno())
+            self._last_fsync = now
 
-    def append(self, record: Dict[str, Any]):
+    def _start_compaction(self):
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        self._compaction_thread = threading.Thread(target=self.compact, name="memory-compaction", daemon=True)
+        self._compaction_thread.start()
+
+    def compact(self, include_active: bool = False):
         """
-        Append a new record (dict) to memory and persist the canonical array.
+        Fold sealed segments (and the active one if include_active) into the snapshot,
+        then delete them. Runs under the file lock, so appenders in any process wait
+        for the snapshot swap rather than racing it.
         """
-        self.store.append(record)
-        self._persist()
+        try:
+            with self._file_lock:
+                names = self._segment_names()
+                if not include_active:
+                    names = names[:-1]
+                if not names:
+                    return
+                records = self._read_snapshot()
+                for name in names:
+                    records.extend(self._read_jsonl(os.path.join(self.log_dir, name)))
+                self._write_snapshot(records)
+                for name in names:
+                    os.remove(os.path.join(self.log_dir, name))
+        except Exception as e:
+            print("[MemoryStore] compaction error:", e)
 
-    def _persist(self):
+    def _write_snapshot(self, records: List[Dict[str, Any]]):
+        # JSON array with one record per line: still valid JSON for older readers
         tmp = self.path + ".tmp"
         with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(self.store, f, ensure_ascii=False, indent=2)
+            if records:
+                f.write("[\n")
+                f.write(",\n".join(json.dumps(r, ensure_ascii=False) for r in records))
+                f.write("\n]\n")
+            else:
+                f.write("[]\n")
+            f.flush()
+            os.fsync(f.fileno())
         os.replace(tmp, self.path)
 
+    # --- indexes ---
+    def _reset_indexes(self):
+        self._indexed = False
+        self._by_session: Dict[str, List[int]] = {}
+        self._by_query: Dict[str, List[int]] = {}
+        # parallel lists sorted by timestamp: keys for bisect, positions into store
+        self._ts_keys: List[float] = []
+        self._ts_pos: List[int] = []
+
+    def _ensure_indexes(self):
+        if self._indexed:
+            return
+        with self._lock:
+            if self._indexed:
+                return
+            for pos, rec in enumerate(self.store):
+                self._index_record(pos, rec)
+            self._indexed = True
+
+    def _index_record(self, pos: int, rec: Dict[str, Any]):
+        if not isinstance(rec, Mapping):
+            return
+        session_id = rec.get("session_id")
+        if session_id is not None:
+            self._by_session.setdefault(session_id, []).append(pos)
+        query = rec.get("query")
+        if query:
+            self._by_query.setdefault(normalize_query(query), []).append(pos)
+        ts = rec.get("timestamp")
+        if isinstance(ts, (int, float)):
+            if not self._ts_keys or ts >= self._ts_keys[-1]:
+                self._ts_keys.append(ts)
+                self._ts_pos.append(pos)
+            else:
+                i = bisect.bisect_right(self._ts_keys, ts)
+                self._ts_keys.insert(i, ts)
+                self._ts_pos.insert(i, pos)
+
     def find_last_by_session(self, session_id: str) -> Optional[Dict[str, Any]]:
-        for rec in reversed(self.store):
-            if rec.get("session_id") == session_id:
-                return rec
-        return None
+        self._ensure_indexes()
+        positions = self._by_session.get(session_id)
+        return self.store[positions[-1]] if positions else None
+
+    def find_by_session(self, session_id: str) -> List[Dict[str, Any]]:
+        self._ensure_indexes()
+        return [self.store[i] for i in self._by_session.get(session_id, [])]
+
+    def find_by_query(self, query: str) -> List[Dict[str, Any]]:
+        """Records whose query matches after normalization (case, dashes, whitespace)."""
+        self._ensure_indexes()
+        return [self.store[i] for i in self._by_query.get(normalize_query(query), [])]
+
+    def find_last_by_query(self, query: str) -> Optional[Dict[str, Any]]:
+        """Most recent record for this query, i.e. "have we researched this before?"."""
+        self._ensure_indexes()
+        positions = self._by_query.get(normalize_query(query))
+        return self.store[positions[-1]] if positions else None
+
+    def find_by_time_range(self, start: float = None, end: float = None) -> List[Dict[str, Any]]:
+        """Records with start <= timestamp <= end (either bound optional), oldest first."""
+        self._ensure_indexes()
+        lo = 0 if start is None else bisect.bisect_left(self._ts_keys, start)
+        hi = len(self._ts_keys) if end is None else bisect.bisect_right(self._ts_keys, end)
+        return [self.store[i] for i in self._ts_pos[lo:hi]]
+
+    def find_recent(self, seconds: float) -> List[Dict[str, Any]]:
+        """Records from the last `seconds` seconds, e.g. find_recent(24 * 3600)."""
+        return self.find_by_time_range(start=time.time() - seconds)
+
+    def session_ids(self) -> List[str]:
+        self._ensure_indexes()
+        return list(self._by_session)
 
     def all_sessions(self) -> List[Dict[str, Any]]:
         return list(self.store)
 
+    # --- paging ---
+    def iter_records(self, start: int = 0, reverse: bool = False) -> Iterator[Dict[str, Any]]:
+        """Yield records from position `start` (counted from the newest end if reverse)."""
+        n = len(self.store)
+        positions = range(n - 1 - start, -1, -1) if reverse else range(start, n)
+        for i in positions:
+            yield self.store[i]
+
+    def page(self, offset: int = 0, limit: int = 50, reverse: bool = False) -> List[Dict[str, Any]]:
+        """Up to `limit` records starting at `offset`; reverse=True pages newest first."""
+        out = []
+        for rec in self.iter_records(offset, reverse=reverse):
+            if len(out) >= limit:
+                break
+            out.append(rec)
+        return out
+
     def clear(self):
-        self.store = []
-        self._persist()
+        with self._lock:
+            if isinstance(self.store, _LazyRecords):
+                # release our handles first so the files can be removed on Windows too
+                self.store.close()
+                self.store = []
+            with self._file_lock:
+                self._write_snapshot([])
+                for name in self._segment_names():
+                    os.remove(os.path.join(self.log_dir, name))
+            self._load()
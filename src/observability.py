@@ -1,27 +1,506 @@
-"""Simple observability utilities: logs, traces, and metrics (file-backed for demo)."""
-import json, os, time
-from typing import Dict, Any, List
+"""Simple observability utilities: logs, hierarchical trace spans (file-backed for demo) and an in-process metrics registry."""
+import json, os, time, uuid, atexit, bisect, asyncio, functools, threading, contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+from file_lock import FileLock
+from log_writer import get_log_writer
 LOG_PATH = 'data/processed/agent_logs.jsonl'
 TRACE_PATH = 'data/processed/agent_traces.jsonl'
 METRICS_PATH = 'data/processed/agent_metrics.json'
 
+# Both logs are appended by a background writer (batched, rotated); see log_writer.py
 def log_event(event: Dict[str, Any]):
-    os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
-    with open(LOG_PATH, 'a') as f:
-        f.write(json.dumps({**event, 'ts': time.time()}) + '\n')
+    get_log_writer(LOG_PATH).write(json.dumps({**event, 'ts': time.time()}))
 
 def trace_span(span: Dict[str, Any]):
-    os.makedirs(os.path.dirname(TRACE_PATH), exist_ok=True)
-    with open(TRACE_PATH, 'a') as f:
-        f.write(json.dumps({**span, 'ts': time.time()}) + '\n')
+    get_log_writer(TRACE_PATH).write(json.dumps({**span, 'ts': time.time()}))
+
+# --- Spans ---
+# Nested timed spans sharing a trace id. The active span lives in a ContextVar, so children
+# opened in the same thread, in asyncio tasks or in asyncio.to_thread workers attach to it;
+# plain executor threads need contextvars.copy_context().run to inherit it.
+TRACING_ENABLED = os.environ.get('TRACING_DISABLED', '').lower() not in ('1', 'true', 'yes')
+_CURRENT_SPAN: 'contextvars.ContextVar[Optional[Span]]' = contextvars.ContextVar('current_span', default=None)
+
+def _new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+class Span:
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'end', 'status', 'error', 'attributes', '_t0')
+
+    def __init__(self, name: str, parent: 'Span' = None, attributes: Dict[str, Any] = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = _new_id()
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.end = None
+        self.status = 'ok'
+        self.error = None
+        self.attributes = dict(attributes or {})
+        self._t0 = time.perf_counter()
+
+    @property
+    def duration_s(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, exc: BaseException):
+        self.status = 'error'
+        self.error = f'{type(exc).__name__}: {exc}'
+
+    def finish(self):
+        """End the span (once) and write it to the trace log."""
+        if self.end is not None:
+            return
+        self.end = self.start + (time.perf_counter() - self._t0)
+        if TRACING_ENABLED:
+            trace_span(self.to_dict())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'span': self.name, 'trace_id': self.trace_id, 'span_id': self.span_id,
+                'parent_id': self.parent_id, 'start': self.start, 'end': self.end,
+                'duration_s': self.duration_s, 'status': self.status, 'error': self.error,
+                'attributes': self.attributes}
+
+def current_span() -> Optional[Span]:
+    return _CURRENT_SPAN.get()
+
+def start_span(name: str, parent: Span = None, **attributes) -> Span:
+    """Create a span (child of `parent`, else of the active span) without activating it; call finish()."""
+    return Span(name, parent if parent is not None else _CURRENT_SPAN.get(), attributes)
+
+@contextmanager
+def use_span(s: Span):
+    """Make an existing span the active parent inside the block (does not finish it)."""
+    token = _CURRENT_SPAN.set(s)
+    try:
+        yield s
+    finally:
+        _CURRENT_SPAN.reset(token)
+
+@contextmanager
+def span(name: str, parent: Span = None, **attributes):
+    """
+    Timed span around the block, nested under `parent` or the active span. Exceptions
+    mark it status="error" and propagate. Yields the Span for set_attribute().
+    """
+    s = start_span(name, parent, **attributes)
+    token = _CURRENT_SPAN.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.record_error(e)
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        s.finish()
+
+def traced(name: str = None, **attributes):
+    """Decorator form of span() for plain and async functions; the name defaults to the qualname."""
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with span(span_name, **attributes):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def trace_tree(spans: List[Dict[str, Any]]) -> List[Tuple[int, Dict[str, Any]]]:
+    """(depth, span) pairs in start order, children under their parent, for rendering one trace."""
+    children: Dict[Any, List[Dict[str, Any]]] = {}
+    ids = {s.get('span_id') for s in spans}
+    for s in spans:
+        parent = s.get('parent_id') if s.get('parent_id') in ids else None
+        children.setdefault(parent, []).append(s)
+    out: List[Tuple[int, Dict[str, Any]]] = []
+    def walk(parent, depth):
+        for s in sorted(children.get(parent, []), key=lambda x: x.get('start') or 0):
+            out.append((depth, s))
+            walk(s.get('span_id'), depth + 1)
+    walk(None, 0)
+    return out
+
+def read_last_trace(path: str = None) -> List[Dict[str, Any]]:
+    """Spans of the most recently finished trace in the trace log (legacy flat rows are skipped)."""
+    path = path or TRACE_PATH
+    get_log_writer(path).flush(timeout=1.0)
+    if not os.path.exists(path):
+        return []
+    rows = []
+    with open(path) as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if row.get('trace_id'):
+                rows.append(row)
+    if not rows:
+        return []
+    # a trace's root span finishes last, so the last row belongs to the latest trace
+    trace_id = rows[-1]['trace_id']
+    return [r for r in rows if r['trace_id'] == trace_id]
+
+# --- Metrics ---
+# Latency buckets in seconds: sub-10ms cache hits up to multi-minute rate-limit waits
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, Any] = None) -> LabelKey:
+    return tuple(sorted((str(k), str(v)) for k, v in (labels or {}).items()))
+
+class _Histogram:
+    """Cumulative bucket counts (for Prometheus) plus a window of recent samples (for percentiles)."""
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'recent')
+
+    def __init__(self, buckets, window: int):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, gauges and histograms keyed by (name, labels).
+    - Recording only touches memory; a background thread flushes to `path` every
+      `flush_interval` seconds when something changed, and once at exit.
+    - Several processes may share one path (UI workers, scripts): flush() merges what
+      this process recorded since its last flush into the totals in the file, under a
+      lock file, so each writer adds to the others' series instead of replacing them.
+    - to_prometheus() renders the text exposition format; serve_prometheus(port) exposes
+      it on http://<addr>:<port>/metrics for a local scrape.
+    - Histogram percentiles (p50/p95/p99) are computed over the last `window` samples.
+    """
+    def __init__(self, path: str = METRICS_PATH, flush_interval: float = 10.0,
+                 buckets=DEFAULT_BUCKETS, window: int = 1024):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+        self.window = window
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, Tuple[float, float]]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        # series values as of the last flush, so the next one merges only the growth
+        self._flushed: Dict[tuple, Any] = {}
+        self._file_lock = FileLock(self.path + '.lock') if self.path else None
+        self._flusher = None
+        self._server = None
+        if self.path:
+            atexit.register(self.flush)
+
+    # --- recording ---
+    def inc(self, name: str, value: float = 1.0, labels: Dict[str, Any] = None):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+            self._dirty = True
+        self._ensure_flusher()
+
+    def set_gauge(self, name: str, value: float, labels: Dict[str, Any] = None):
+        key = _label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = (float(value), time.time())
+            self._dirty = True
+        self._ensure_flusher()
+
+    def observe(self, name: str, value: float, labels: Dict[str, Any] = None):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(self.buckets, self.window)
+            hist.observe(value)
+            self._dirty = True
+        self._ensure_flusher()
+
+    @contextmanager
+    def timer(self, name: str, labels: Dict[str, Any] = None):
+        """Observe the wall time of the block (seconds) in histogram `name`."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self._flushed.clear()
+            self._dirty = True
+
+    # --- cross-process aggregation ---
+    def drain(self) -> Dict[str, list]:
+        """
+        Raw, picklable state of every series, after which the registry is reset. A worker
+        process hands these deltas to its parent, which merge()s them into its registry.
+        """
+        with self._lock:
+            state = self._state()
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self._flushed.clear()
+            return state
+
+    def _state(self) -> Dict[str, list]:
+        # called with self._lock held
+        return {
+            'counters': [(name, key, value) for name, series in self._counters.items()
+                         for key, value in series.items()],
+            'gauges': [(name, key, value, ts) for name, series in self._gauges.items()
+                       for key, (value, ts) in series.items()],
+            'histograms': [(name, key, list(h.counts), h.count, h.sum, list(h.recent))
+                           for name, series in self._histograms.items() for key, h in series.items()],
+        }
+
+    def _unflushed(self) -> Tuple[Dict[str, list], Dict[tuple, Any]]:
+        """
+        What every series gained since the last flush, in drain() form, plus the marks
+        to record once it is written (called with self._lock held).
+        """
+        state = {'counters': [], 'gauges': [], 'histograms': []}
+        marks = {}
+        for name, series in self._counters.items():
+            for key, value in series.items():
+                prev = self._flushed.get(('c', name, key), 0.0)
+                if value != prev:
+                    state['counters'].append((name, key, value - prev))
+                    marks[('c', name, key)] = value
+        for name, series in self._gauges.items():
+            for key, (value, ts) in series.items():
+                if self._flushed.get(('g', name, key)) != ts:
+                    state['gauges'].append((name, key, value, ts))
+                    marks[('g', name, key)] = ts
+        for name, series in self._histograms.items():
+            for key, h in series.items():
+                counts, count, total = self._flushed.get(('h', name, key), ([0] * len(h.counts), 0, 0.0))
+                new = h.count - count
+                if new:
+                    recent = list(h.recent)[-new:]
+                    state['histograms'].append((name, key, [a - b for a, b in zip(h.counts, counts)],
+                                                new, h.sum - total, recent))
+                    marks[('h', name, key)] = (list(h.counts), h.count, h.sum)
+        return state, marks
+
+    def merge(self, state: Dict[str, list]):
+        """Fold in a drain()ed state: counters and histograms add up, the newest gauge value wins."""
+        if not state:
+            return
+        with self._lock:
+            for name, key, value in state.get('counters', ()):
+                series = self._counters.setdefault(name, {})
+                series[key] = series.get(key, 0.0) + value
+            for name, key, value, ts in state.get('gauges', ()):
+                series = self._gauges.setdefault(name, {})
+                if key not in series or series[key][1] <= ts:
+                    series[key] = (value, ts)
+            for name, key, counts, count, total, recent in state.get('histograms', ()):
+                series = self._histograms.setdefault(name, {})
+                hist = series.get(key)
+                if hist is None:
+                    hist = series[key] = _Histogram(self.buckets, self.window)
+                if len(counts) == len(hist.counts):
+                    hist.counts = [a + b for a, b in zip(hist.counts, counts)]
+                else:
+                    # registries with different buckets: re-bin what the sample window holds
+                    for v in recent:
+                        hist.counts[bisect.bisect_left(self.buckets, v)] += 1
+                hist.count += count
+                hist.sum += total
+                hist.recent.extend(recent)
+            self._dirty = True
+        self._ensure_flusher()
+
+    # --- reading / export ---
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        """All series as plain data: counters/gauges with value, histograms with count/sum/avg/p50/p95/p99."""
+        with self._lock:
+            out = {'counters': [], 'gauges': [], 'histograms': []}
+            for name, series in self._counters.items():
+                for key, value in series.items():
+                    out['counters'].append({'name': name, 'labels': dict(key), 'value': value})
+            for name, series in self._gauges.items():
+                for key, (value, ts) in series.items():
+                    out['gauges'].append({'name': name, 'labels': dict(key), 'value': value, 'ts': ts})
+            for name, series in self._histograms.items():
+                for key, h in series.items():
+                    out['histograms'].append({
+                        'name': name, 'labels': dict(key), 'count': h.count, 'sum': h.sum,
+                        'avg': h.sum / h.count if h.count else 0.0,
+                        'p50': h.quantile(0.50), 'p95': h.quantile(0.95), 'p99': h.quantile(0.99),
+                    })
+            return out
+
+    @staticmethod
+    def _fmt_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = key + extra
+        if not pairs:
+            return ''
+        def esc(v: str) -> str:
+            return v.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                for key, value in series.items():
+                    lines.append(f'{name}{self._fmt_labels(key)} {value}')
+            for name, series in sorted(self._gauges.items()):
+                lines.append(f'# TYPE {name} gauge')
+                for key, (value, _) in series.items():
+                    lines.append(f'{name}{self._fmt_labels(key)} {value}')
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for key, h in series.items():
+                    cumulative = 0
+                    for bound, n in zip(self.buckets + (float('inf'),), h.counts):
+                        cumulative += n
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{self._fmt_labels(key, (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_sum{self._fmt_labels(key)} {h.sum}')
+                    lines.append(f'{name}_count{self._fmt_labels(key)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    # --- persistence ---
+    def flush(self):
+        """
+        Merge what changed since the last flush into the totals at `path` and rewrite it
+        (atomically): the snapshot() fields plus a "state" section the next merge reads.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            delta, marks = self._unflushed()
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with self._file_lock:
+                total = MetricsRegistry(path=None, buckets=self.buckets, window=self.window)
+                total.merge(self._read_state())
+                total.merge(delta)
+                snap = total.snapshot()
+                with total._lock:
+                    state = total._state()
+                # per-process tmp name: writers never share a half-written file
+                tmp = f'{self.path}.{os.getpid()}.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(dict(snap, ts=time.time(), state=state), f, indent=2)
+                os.replace(tmp, self.path)
+        except OSError as e:
+            print('[MetricsRegistry] flush error:', e)
+            with self._lock:
+                self._dirty = True
+            return
+        with self._lock:
+            self._flushed.update(marks)
+
+    def _read_state(self) -> Dict[str, list]:
+        """The merged totals in the file, in drain() form (empty for a missing or older file)."""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print('[MetricsRegistry] ignoring unreadable metrics file:', e)
+            return {}
+        state = data.get('state') if isinstance(data, dict) else None
+        if not isinstance(state, dict):
+            return {}
+        # JSON turned the label tuples into lists
+        def key(k):
+            return tuple(tuple(pair) for pair in k)
+        return {
+            'counters': [(n, key(k), v) for n, k, v in state.get('counters', ())],
+            'gauges': [(n, key(k), v, ts) for n, k, v, ts in state.get('gauges', ())],
+            'histograms': [(n, key(k), c, cnt, tot, rec) for n, k, c, cnt, tot, rec in state.get('histograms', ())],
+        }
+
+    def _ensure_flusher(self):
+        if self._flusher is not None or not self.path or self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def serve_prometheus(self, port: int = 9464, addr: str = '127.0.0.1'):
+        """Serve to_prometheus() at /metrics from a daemon thread; returns the HTTP server."""
+        if self._server is not None:
+            return self._server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((addr, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        return self._server
+
+METRICS = MetricsRegistry(
+    path=os.environ.get('METRICS_PATH', METRICS_PATH),
+    flush_interval=float(os.environ.get('METRICS_FLUSH_INTERVAL', '10')),
+)
+
+def get_metrics() -> MetricsRegistry:
+    return METRICS
 
 def emit_metric(name: str, value: float, labels: Dict[str, str] = None):
-    os.makedirs(os.path.dirname(METRICS_PATH), exist_ok=True)
-    if os.path.exists(METRICS_PATH):
-        with open(METRICS_PATH, 'r') as f:
-            metrics = json.load(f)
-    else:
-        metrics = {}
-    metrics[name] = {'value': value, 'labels': labels or {}, 'ts': time.time()}
-    with open(METRICS_PATH, 'w') as f:
-        json.dump(metrics, f, indent=2)
+    # kept for existing callers: records a gauge; the file is written by the periodic flush
+    METRICS.set_gauge(name, value, labels)
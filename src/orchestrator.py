@@ -1,61 +1,666 @@
 # src/orchestrator.py
 import os
-import json
 import time
-from typing import List
+import uuid
+import asyncio
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from a2a_simulator import A2ABus, A2AMessage
+from agents import is_degraded
+from checkpoints import CheckpointStore, input_hash
+from genai_wrapper import default_model_name
+from llm_gateway import llm_context
+from memory import MemoryRecord, MemoryStore
+from observability import METRICS, current_span, span, start_span, use_span
+from pipeline import DEFAULT_PIPELINE, Pipeline, Stage, arun as arun_stages, run_iter as run_stages
+from profiling import StageProfiler, profiling_requested
+from semantic_index import SemanticIndex, NUMPY_AVAILABLE
+
+# seconds a bus request to an agent's workers may take when its stage sets no timeout
+A2A_REQUEST_TIMEOUT = float(os.environ.get("A2A_REQUEST_TIMEOUT", "600"))
+
+# stage name -> key of that stage's output in persisted memory records
+_RECORD_KEYS = {"findings": "findings", "summary": "summary", "critique": "critique", "final_draft": "draft"}
 
 class Orchestrator:
-    def __init__(self, agents: List = None, bus=None, memory_path: str = None, use_mock: bool = True):
+    def __init__(self, agents: List = None, bus=None, memory_path: str = None, use_mock: bool = True,
+                 max_concurrency: int = 16, reuse_threshold: float = None, findings_reuse_threshold: float = None,
+                 priority: int = None, profile: bool = None, agent_workers: int = None,
+                 pipeline: Pipeline = None, checkpoint_path: str = None, request_timeout: float = None):
         self.agents = agents or []
-        self.bus = bus
+        # stage graph (pipeline.py); agents are matched to its stages once, on first use
+        self.pipeline = pipeline or DEFAULT_PIPELINE
+        self._stage_agents = None
+        self._stage_agents_key = None
+        # async runs hand each stage to its agent's workers over the bus (request/reply)
+        self.bus = bus if bus is not None else A2ABus()
+        # local worker mailboxes are named "<instance>/<agent>", so orchestrators sharing a
+        # bus never take each other's requests (remote transports stay attached by agent name)
+        self._instance = f"orch-{uuid.uuid4().hex[:8]}"
+        # upper bound on one stage request, so a dead or cancelled worker cannot hang a run
+        self.request_timeout = request_timeout if request_timeout is not None else A2A_REQUEST_TIMEOUT
+        # long-lived worker tasks per agent (None = max_concurrency)
+        self.agent_workers = agent_workers
+        self._workers = []
+        self._workers_loop = None
         self.memory_path = memory_path
         self.use_mock = use_mock
+        # cap on sessions in flight at once for arun_pipeline / run_many
+        self.max_concurrency = max_concurrency
+        # LLM gateway priority class for this orchestrator's calls (None = gateway default)
+        self.priority = priority
+        # per-stage cProfile/tracemalloc artifacts (None = follow the PIPELINE_PROFILE env var)
+        self.profile = profile
+        self._semaphore = None
+        self._semaphore_loop = None
+        # semantic reuse of past runs (needs memory_path): a prior query with cosine
+        # similarity >= reuse_threshold returns its stored result outright; one with
+        # similarity >= findings_reuse_threshold reuses its findings and skips Research.
+        self.reuse_threshold = reuse_threshold
+        self.findings_reuse_threshold = findings_reuse_threshold
+        self._memory = None
+        self._memory_lock = threading.Lock()
+        self._semantic = None
+        self._semantic_key = None
+        self._semantic_built = 0
+        # per-stage checkpoints (checkpoints.py) keyed by session and input hash: re-runs
+        # and resumed sessions skip stages whose inputs did not change
+        self.checkpoint_path = checkpoint_path or os.environ.get("PIPELINE_CHECKPOINT_PATH") or None
+        self._checkpoints = None
+
+    def _resolve_agents(self):
+        # re-resolved only when the pipeline or the agent list is replaced or changes length
+        key = (id(self.pipeline), id(self.agents), len(self.agents))
+        if self._stage_agents_key != key:
+            self._stage_agents = self.pipeline.resolve(self.agents)
+            self._stage_agents_key = key
+        return self._stage_agents
 
-    def run_pipeline(self, session_id: str, user_query: str) -> dict:
-        # Find agents by role name
-        research = next((a for a in self.agents if 'Research' in a.name), None)
-        summarizer = next((a for a in self.agents if 'Summarizer' in a.name), None)
-        critic = next((a for a in self.agents if 'Critic' in a.name), None)
-        writer = next((a for a in self.agents if 'Writer' in a.name), None)
+    @staticmethod
+    def _content(out) -> str:
+        return out.get("content", "") if isinstance(out, dict) else str(out)
 
+    def run_pipeline(self, session_id: str, user_query: str, on_stage: Callable[[dict], None] = None,
+                     profile: bool = None, overrides: Dict[str, str] = None) -> dict:
+        """
+        Run the full pipeline and return the combined results. If `on_stage` is given it
+        is called with each stage event from iter_pipeline as soon as that stage finishes.
+        """
         results = {}
-        # 1) Research
-        findings = research.act(user_query) if research else {"content": ""}
-        findings_text = findings.get("content", "") if isinstance(findings, dict) else str(findings)
-        results["findings"] = findings_text
-
-        # 2) Summarize
-        summary = summarizer.act(findings_text) if summarizer else {"content": ""}
-        summary_text = summary.get("content", "") if isinstance(summary, dict) else str(summary)
-        results["summary"] = summary_text
-
-        # 3) Critique
-        critique = critic.act(summary_text) if critic else {"content": ""}
-        critique_text = critique.get("content", "") if isinstance(critique, dict) else str(critique)
-        results["critique"] = critique_text
-
-        # 4) Write final draft (combine)
-        combined = "\n\nFindings:\n" + findings_text + "\n\nSummary:\n" + summary_text + "\n\nCritique:\n" + critique_text
-        draft = writer.act(combined) if writer else {"content": ""}
-        draft_text = draft.get("content", "") if isinstance(draft, dict) else str(draft)
-        results["final_draft"] = draft_text
-
-        # Basic persistence: append to memory file (simple JSON lines)
+        for event in self.iter_pipeline(session_id, user_query, profile=profile, overrides=overrides):
+            if event["stage"] == "done":
+                results = event["results"]
+            elif on_stage is not None:
+                on_stage(event)
+        return results
+
+    def iter_pipeline(self, session_id: str, user_query: str, stream: bool = False,
+                      profile: bool = None, overrides: Dict[str, str] = None) -> Iterator[dict]:
+        """
+        Generator form of run_pipeline. Yields one event per stage of self.pipeline as soon
+        as it completes (independent stages run concurrently, so in completion order):
+            {"stage": "findings" | "summary" | "critique" | "final_draft",
+             "agent": <agent name or None>, "content": <text>, "elapsed": <stage seconds>}
+        plus "error" for an optional stage that failed, and finally
+            {"stage": "done", "results": <dict>, "elapsed": <total seconds>}.
+        With stream=True the pipeline's stream stage (the writer's final_draft) is also
+        forwarded while it is generated as
+            {"stage": "chunk", "target": "final_draft", "agent": <name>, "content": <new text>}
+        and its event carries "ttft", the seconds until the first chunk.
+        With profiling on (`profile`, else the constructor flag, else PIPELINE_PROFILE=1)
+        each stage runs under cProfile and tracemalloc and results["profile"] names the
+        directory with the per-stage .prof files and the top-N summary.
+        With checkpoints on (checkpoint_path / PIPELINE_CHECKPOINT_PATH) a stage whose
+        inputs match a checkpoint of this session is restored instead of run; its event
+        carries "checkpoint": True. Fallback output an agent flags as degraded (search
+        error, mock text after a Gemini failure, a cut-short stream) is never checkpointed:
+        its event carries "degraded": True and results["degraded"] lists those stages.
+        `overrides` ({stage: text}, e.g. UI edits) replace those stages' outputs, so only
+        the stages downstream of them run again.
+        """
+        # spans are only active while pipeline code runs, never while the caller holds an event
+        root = start_span("pipeline", session_id=session_id, query=user_query, mode="sync", stream=stream)
+        prof = self._profiler(session_id, profile)
+        last = None
+        try:
+            for event in self._iter_stages(root, session_id, user_query, stream, prof, overrides):
+                last = event["stage"]
+                yield event
+        except GeneratorExit:
+            if last != "done":
+                # the consumer stopped iterating before the pipeline finished
+                root.set_attribute("abandoned_after", last)
+            raise
+        except BaseException as e:
+            root.record_error(e)
+            raise
+        finally:
+            if prof is not None:
+                prof.finish()
+            root.finish()
+
+    def _profiler(self, session_id: str, flag: bool = None):
+        flag = flag if flag is not None else self.profile
+        return StageProfiler(session_id) if profiling_requested(flag) else None
+
+    @staticmethod
+    def _profiled(prof, stage: str):
+        return prof.stage(stage) if prof is not None else nullcontext()
+
+    def _iter_stages(self, root, session_id: str, user_query: str, stream: bool, prof=None,
+                     overrides: Dict[str, str] = None) -> Iterator[dict]:
+        started = time.perf_counter()
+        pipeline = self.pipeline
+        agents = self._resolve_agents()
+        self._check_overrides(overrides)
+
+        with span("reuse_lookup", parent=root):
+            # explicit overrides mean "recompute from here", not "serve a past answer"
+            reuse, prior, score = self._reuse_lookup(user_query) if not overrides else (None, None, 0.0)
+        if reuse == "full":
+            results = self._reused_results(prior, score)
+            for key in pipeline.names:
+                yield {"stage": key, "agent": None, "content": results[key], "elapsed": 0.0, "reused": True}
+            with span("persist", parent=root):
+                self._persist(session_id, user_query, results)
+            yield {"stage": "done", "results": results, "elapsed": time.perf_counter() - started}
+            return
+
+        results = {"profile": prof.out_dir} if prof is not None else {}
+        done = {}
+        if reuse == "findings" and "findings" in pipeline.by_name:
+            done["findings"] = prior.get("findings", "")
+            results["findings"] = done["findings"]
+            results["reused_from"] = self._reuse_info(prior, score, "findings")
+            yield {"stage": "findings", "agent": None, "content": done["findings"], "elapsed": 0.0, "reused": True}
+        for name, text in (overrides or {}).items():
+            done[name] = results[name] = text
+            yield {"stage": name, "agent": None, "content": text, "elapsed": 0.0, "override": True}
+
+        restored, degraded = set(), set()
+
+        def run_stage(stage: Stage, message: str) -> str:
+            # runs on the calling thread or a pipeline worker thread
+            agent = agents[stage.name]
+            with span("stage", parent=root, stage=stage.name) as s:
+                if agent is None:
+                    return ""
+                digest, out = self._restore(session_id, stage.name, agent, message)
+                if out is not None:
+                    s.set_attribute("checkpoint", True)
+                    restored.add(stage.name)
+                    return out
+                if prof is not None:
+                    raw = prof.run(stage.name, self._act, agent, message, session_id)
+                else:
+                    raw = self._act(agent, message, session_id)
+                return self._stage_output(session_id, stage.name, agent, digest, raw, degraded, s)
+
+        stream_stage = pipeline.stream_stage if stream and agents.get(pipeline.stream_stage) else None
+        timings = {}
+        for result in run_stages(pipeline, run_stage, user_query, done=done, defer=[stream_stage] if stream_stage else ()):
+            name = result.stage.name
+            extra = {}
+            if result.deferred:
+                # the streamed stage runs here so its chunks can be yielded as they arrive
+                extra["ttft"] = None
+                agent = agents[name]
+                digest, out = self._restore(session_id, name, agent, result.message)
+                if out is not None:
+                    restored.add(name)
+                    extra["ttft"] = time.perf_counter() - result.started
+                    result.output = out
+                    yield {"stage": "chunk", "target": name, "agent": agent.name, "content": out}
+                else:
+                    try:
+                        events = self._stream_stage(root, agent, name, result.message, session_id, prof)
+                        while True:
+                            try:
+                                event = next(events)
+                            except StopIteration as stop:
+                                # a fallback or cut-short stream is shown but never checkpointed
+                                if stop.value:
+                                    degraded.add(name)
+                                else:
+                                    self._checkpoint(session_id, name, agent, digest, result.output)
+                                break
+                            if extra["ttft"] is None:
+                                extra["ttft"] = time.perf_counter() - result.started
+                            result.output += event["content"]
+                            yield event
+                    except Exception as e:
+                        if not result.stage.optional:
+                            raise
+                        result.output, result.error = "", e
+                result.ended = time.perf_counter()
+            timings[name] = result
+            results[name] = result.output
+            event = dict(self._stage_event(name, agents[name], result.output, result.elapsed), **extra)
+            if name in restored:
+                event["checkpoint"] = True
+            if name in degraded:
+                results.setdefault("degraded", []).append(name)
+                event["degraded"] = True
+            if result.error is not None:
+                results.setdefault("errors", {})[name] = repr(result.error)
+                event["error"] = repr(result.error)
+            yield event
+
+        path, length = pipeline.critical_path(timings)
+        root.set_attribute("critical_path", path)
+        root.set_attribute("critical_path_s", length)
+        with span("persist", parent=root):
+            self._persist(session_id, user_query, results)
+        METRICS.observe("pipeline_seconds", time.perf_counter() - started, {"mode": "sync"})
+        yield {"stage": "done", "results": results, "elapsed": time.perf_counter() - started}
+
+    def _check_overrides(self, overrides: Dict[str, str] = None):
+        unknown = [name for name in overrides or {} if name not in self.pipeline.by_name]
+        if unknown:
+            raise ValueError(f"overrides for unknown stages: {unknown}")
+
+    def _get_checkpoints(self):
+        if not self.checkpoint_path:
+            return None
+        with self._memory_lock:
+            if self._checkpoints is None:
+                self._checkpoints = CheckpointStore(self.checkpoint_path)
+            return self._checkpoints
+
+    def _restore(self, session_id: str, stage: str, agent, message: str):
+        """(input hash, checkpointed output or None); the hash is None when checkpoints are off."""
+        store = self._get_checkpoints()
+        if store is None:
+            return None, None
+        digest = input_hash(stage, agent, message)
+        out = store.get(session_id, stage, digest)
+        METRICS.inc("pipeline_checkpoint_total", 1, {"stage": stage, "result": "miss" if out is None else "hit"})
+        return digest, out
+
+    def _stage_output(self, session_id: str, stage: str, agent, digest: str, raw, degraded: set, s=None) -> str:
+        # checkpoint a stage's act() result unless the agent flagged it as a fallback
+        out = self._content(raw)
+        if is_degraded(raw):
+            degraded.add(stage)
+            if s is not None:
+                s.set_attribute("degraded", True)
+        else:
+            self._checkpoint(session_id, stage, agent, digest, out)
+        return out
+
+    def _checkpoint(self, session_id: str, stage: str, agent, digest: str, output: str):
+        if digest is None:
+            return
+        try:
+            self._get_checkpoints().put(session_id, stage, digest, output, agent.name)
+        except OSError as e:
+            print("[Orchestrator] checkpoint write error:", e)
+
+    def _stream_stage(self, root, agent, name: str, message: str, session_id: str, prof=None) -> Iterator[dict]:
+        """Chunk events of a streamed stage; returns True if the agent reported its stream degraded."""
+        stage = start_span("stage", parent=root, stage=name, stream=True)
+        t0 = time.perf_counter()
+        if prof is not None:
+            prof.start(name)
+        try:
+            chunks = self._stream(agent, message, session_id, stage)
+            while True:
+                try:
+                    chunk = next(chunks)
+                except StopIteration as stop:
+                    return stop.value
+                if t0 is not None:
+                    stage.set_attribute("ttft_s", time.perf_counter() - t0)
+                    t0 = None
+                # the consumer's handling of a chunk is not part of the stage's profile
+                if prof is not None:
+                    prof.pause(name)
+                yield {"stage": "chunk", "target": name, "agent": agent.name, "content": chunk}
+                if prof is not None:
+                    prof.resume(name)
+        except BaseException as e:
+            if not isinstance(e, GeneratorExit):
+                stage.record_error(e)
+            raise
+        finally:
+            if prof is not None:
+                prof.stop(name)
+            stage.finish()
+
+    def _act(self, agent, message: str, session_id: str):
+        # tag the agent's LLM calls with this session and priority for the gateway
+        with llm_context(priority=self.priority, session_id=session_id), \
+                METRICS.timer("agent_act_seconds", {"agent": agent.name}), \
+                span("agent.act", agent=agent.name) as s:
+            out = agent.act(message, session=session_id)
+            s.set_attribute("output_chars", len(self._content(out)))
+            return out
+
+    def _stream(self, agent, message: str, session_id: str, parent=None) -> Iterator[str]:
+        # the LLM context and span are active only while the agent's generator runs, not while our caller holds a chunk
+        s = start_span("agent.stream", parent=parent, agent=agent.name)
+        chunks = agent.stream(message, session=session_id)
+        n = 0
+        try:
+            while True:
+                with llm_context(priority=self.priority, session_id=session_id), use_span(s):
+                    try:
+                        chunk = next(chunks)
+                    except StopIteration as stop:
+                        chunk, degraded = None, bool(stop.value)
+                if chunk is None:
+                    # agent.stream returns True when its text is a fallback or was cut short
+                    if degraded:
+                        s.set_attribute("degraded", True)
+                    return degraded
+                if chunk:
+                    n += 1
+                    yield chunk
+        except BaseException as e:
+            if not isinstance(e, GeneratorExit):
+                s.record_error(e)
+            raise
+        finally:
+            s.set_attribute("chunks", n)
+            s.finish()
+
+    def _mailbox(self, agent) -> str:
+        return f"{self._instance}/{agent.name}"
+
+    async def _aact(self, agent, message: str, session_id: str, prof=None, stage: str = None,
+                    timeout: float = None):
+        timeout = timeout or self.request_timeout
+        if self.bus.is_remote(agent.name):
+            return await self._aact_remote(agent, message, session_id, timeout)
+        self._ensure_workers()
+        request = A2AMessage(self._instance, self._mailbox(agent), {
+            "message": message, "session_id": session_id, "prof": prof, "stage": stage, "parent": current_span()})
+        reply = await self.bus.request(request, timeout)
+        return reply.content
+
+    async def _aact_remote(self, agent, message: str, session_id: str, timeout: float = None):
+        # the agent runs in worker processes behind a transport (a2a_transport.ProcessAgentPool);
+        # only picklable fields cross, so these stages are not covered by the stage profiler
+        with METRICS.timer("agent_act_seconds", {"agent": agent.name}), \
+                span("agent.act", agent=agent.name, remote=True) as s:
+            request = A2AMessage(self._instance, agent.name, {
+                "message": message, "session_id": session_id, "priority": self.priority})
+            out = (await self.bus.request(request, timeout)).content
+            s.set_attribute("output_chars", len(self._content(out)))
+            return out
+
+    def _ensure_workers(self):
+        # worker tasks live on one loop; start a fresh set when called from a new one
+        loop = asyncio.get_running_loop()
+        if self._workers_loop is loop:
+            return
+        self._workers = []
+        self._workers_loop = loop
+        n = max(1, self.agent_workers or self.max_concurrency)
+        for agent in self.agents:
+            if self.bus.is_remote(agent.name):
+                continue
+            self.bus.register(self._mailbox(agent))
+            for i in range(n):
+                self._workers.append(loop.create_task(self._agent_worker(agent), name=f"a2a:{agent.name}:{i}"))
+
+    async def _agent_worker(self, agent):
+        # consumes stage requests for one agent, so stages of different sessions overlap across agents
+        mailbox = self._mailbox(agent)
+        while True:
+            msg = await self.bus.receive(mailbox)
+            try:
+                out = await self._handle(agent, **msg.content)
+            except asyncio.CancelledError:
+                # fail the request now rather than leave its caller waiting for the timeout
+                await self.bus.reply(msg, error=RuntimeError(f"{agent.name} worker stopped"))
+                raise
+            except Exception as e:
+                await self.bus.reply(msg, error=e)
+            else:
+                await self.bus.reply(msg, out)
+
+    async def stop_workers(self):
+        workers, self._workers, self._workers_loop = self._workers, [], None
+        for t in workers:
+            t.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _handle(self, agent, message: str, session_id: str, prof=None, stage: str = None, parent=None):
+        with llm_context(priority=self.priority, session_id=session_id), \
+                METRICS.timer("agent_act_seconds", {"agent": agent.name}), \
+                span("agent.act", parent=parent, agent=agent.name) as s:
+            if prof is not None:
+                # cProfile only sees its own thread, so profile act() inside the worker thread
+                out = await asyncio.to_thread(prof.run, stage, agent.act, message, session_id)
+            else:
+                out = await agent.aact(message, session=session_id)
+            s.set_attribute("output_chars", len(self._content(out)))
+            return out
+
+    @staticmethod
+    def _stage_event(stage: str, agent, content: str, elapsed: float) -> dict:
+        METRICS.observe("pipeline_stage_seconds", elapsed, {"stage": stage})
+        return {"stage": stage, "agent": agent.name if agent else None, "content": content,
+                "elapsed": elapsed}
+
+    async def arun_pipeline(self, session_id: str, user_query: str, profile: bool = None,
+                            overrides: Dict[str, str] = None) -> dict:
+        """
+        Async variant of run_pipeline. Each stage is a request over the A2A bus to
+        the agent's long-lived workers, which await the agent's `aact`, so many
+        sessions can wait on Gemini/CSE concurrently on one event loop and their
+        stages pipeline through the agents. At most `max_concurrency` sessions run
+        at once per loop.
+        """
+        async with self._get_semaphore():
+            with span("pipeline", session_id=session_id, query=user_query, mode="async"):
+                prof = self._profiler(session_id, profile)
+                try:
+                    return await self._arun_stages(session_id, user_query, prof, overrides)
+                finally:
+                    if prof is not None:
+                        await asyncio.to_thread(prof.finish)
+
+    async def _arun_stages(self, session_id: str, user_query: str, prof=None,
+                           overrides: Dict[str, str] = None) -> dict:
+        started = time.perf_counter()
+        pipeline = self.pipeline
+        agents = self._resolve_agents()
+        self._check_overrides(overrides)
+
+        with span("reuse_lookup"):
+            reuse, prior, score = (await asyncio.to_thread(self._reuse_lookup, user_query)
+                                   if not overrides else (None, None, 0.0))
+        if reuse == "full":
+            results = self._reused_results(prior, score)
+            with span("persist"):
+                await asyncio.to_thread(self._persist, session_id, user_query, results)
+            return results
+
+        results = {"profile": prof.out_dir} if prof is not None else {}
+        done = {}
+        if reuse == "findings" and "findings" in pipeline.by_name:
+            done["findings"] = results["findings"] = prior.get("findings", "")
+            results["reused_from"] = self._reuse_info(prior, score, "findings")
+        for name, text in (overrides or {}).items():
+            done[name] = results[name] = text
+        degraded = set()
+
+        async def run_stage(stage: Stage, message: str) -> str:
+            agent = agents[stage.name]
+            with span("stage", stage=stage.name) as s:
+                if agent is None:
+                    return ""
+                # checkpoint file I/O stays off the event loop
+                digest, out = await asyncio.to_thread(self._restore, session_id, stage.name, agent, message)
+                if out is not None:
+                    s.set_attribute("checkpoint", True)
+                    return out
+                raw = await self._aact(agent, message, session_id, prof, stage.name, stage.timeout)
+                if digest is None:
+                    return self._stage_output(session_id, stage.name, agent, digest, raw, degraded, s)
+                return await asyncio.to_thread(self._stage_output, session_id, stage.name, agent, digest, raw,
+                                               degraded, s)
+
+        stage_results = await arun_stages(pipeline, run_stage, user_query, done=done)
+        for name in pipeline.names:
+            result = stage_results[name]
+            results[name] = result.output
+            if name in degraded:
+                results.setdefault("degraded", []).append(name)
+            if result.error is not None:
+                results.setdefault("errors", {})[name] = repr(result.error)
+            if result.started is not None:
+                self._stage_event(name, agents[name], result.output, result.elapsed)
+        path, length = pipeline.critical_path(stage_results)
+        root = current_span()
+        if root is not None:
+            root.set_attribute("critical_path", path)
+            root.set_attribute("critical_path_s", length)
+
+        # file I/O stays off the event loop
+        with span("persist"):
+            await asyncio.to_thread(self._persist, session_id, user_query, results)
+        METRICS.observe("pipeline_seconds", time.perf_counter() - started, {"mode": "async"})
+        return results
+
+    async def arun_many(self, jobs: Iterable[Tuple[str, str]], return_exceptions: bool = True) -> List:
+        """
+        Run (session_id, user_query) pairs concurrently, bounded by max_concurrency.
+        Results come back in input order; failed sessions yield the exception
+        instead of cancelling the rest unless return_exceptions is False.
+        """
+        tasks = [self.arun_pipeline(sid, q) for sid, q in jobs]
+        return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+
+    def run_many(self, jobs: Iterable[Tuple[str, str]], max_concurrency: int = None,
+                 return_exceptions: bool = True) -> List:
+        """
+        Blocking entry point: runs arun_many on a fresh event loop. The loop's
+        default executor is sized to the concurrency cap so blocking agent calls
+        (offloaded by aact) are not throttled by the stock thread pool size.
+        """
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+
+        async def _main():
+            loop = asyncio.get_running_loop()
+            executor = ThreadPoolExecutor(max_workers=max(1, self.max_concurrency),
+                                          thread_name_prefix="orchestrator")
+            loop.set_default_executor(executor)
+            return await self.arun_many(jobs, return_exceptions=return_exceptions)
+
+        return asyncio.run(_main())
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # asyncio primitives are bound to one loop; recreate when called from a new one
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    def _get_memory(self) -> MemoryStore:
+        # opened on first use so constructing an Orchestrator stays cheap
+        with self._memory_lock:
+            if self._memory is None:
+                self._memory = MemoryStore(self.memory_path, lazy=True)
+            return self._memory
+
+    def _reuse_key(self) -> str:
+        """
+        Which results may be reused for this orchestrator: mock output only by mock runs,
+        real output only by real runs against the same model.
+        """
+        mock = all(getattr(a, "use_mock", True) for a in self.agents) if self.agents else self.use_mock
+        return "mock" if mock else f"real:{default_model_name()}"
+
+    def _get_semantic_index(self) -> SemanticIndex:
+        memory = self._get_memory()
+        key = self._reuse_key()
+        with self._memory_lock:
+            if self._semantic is None or self._semantic_key != key:
+                index = SemanticIndex()
+                records = memory.store
+                n = len(records)
+                for pos in range(n):
+                    rec = records[pos]
+                    # only the head fields: the large text fields are never decoded here
+                    head = rec.head() if isinstance(rec, MemoryRecord) else rec
+                    # reused and fallback results are written without a reuse key
+                    if head.get("query") and head.get("reuse_key") == key:
+                        index.add(head["query"], pos)
+                # records at or past this position are added by _persist
+                self._semantic_built = n
+                self._semantic = index
+                self._semantic_key = key
+            return self._semantic
+
+    def _reuse_lookup(self, user_query: str):
+        """Returns (mode, prior_record, score) with mode "full", "findings" or None."""
+        thresholds = [t for t in (self.reuse_threshold, self.findings_reuse_threshold) if t is not None]
+        if not thresholds or not self.memory_path:
+            return None, None, 0.0
+        if not NUMPY_AVAILABLE:
+            print("[Orchestrator] result reuse disabled: numpy not installed")
+            return None, None, 0.0
+        try:
+            match = self._get_semantic_index().best_match(user_query)
+            if match is None:
+                return None, None, 0.0
+            score, pos = match
+            prior = self._get_memory().store[pos]
+            if self.reuse_threshold is not None and score >= self.reuse_threshold:
+                return "full", prior, score
+            if self.findings_reuse_threshold is not None and score >= self.findings_reuse_threshold:
+                return "findings", prior, score
+        except Exception as e:
+            print("[Orchestrator] reuse lookup error:", e)
+        return None, None, 0.0
+
+    @staticmethod
+    def _reuse_info(prior, score: float, mode: str) -> dict:
+        return {"session_id": prior.get("session_id"), "query": prior.get("query"),
+                "score": round(score, 4), "mode": mode}
+
+    def _reused_results(self, prior, score: float) -> dict:
+        results = {name: prior.get(_RECORD_KEYS.get(name, name), "") for name in self.pipeline.names}
+        results["reused_from"] = self._reuse_info(prior, score, "full")
+        return results
+
+    def _persist(self, session_id: str, user_query: str, results: dict):
+        # Basic persistence: append to the shared memory store's log
         try:
             if self.memory_path:
-                os.makedirs(os.path.dirname(self.memory_path), exist_ok=True)
                 rec = {
                     "session_id": session_id,
                     "timestamp": int(time.time()),
                     "query": user_query,
-                    "findings": findings_text,
-                    "summary": summary_text,
-                    "critique": critique_text,
-                    "draft": draft_text
+                    # reused or fallback results are never offered for reuse themselves
+                    "reuse_key": None if results.get("reused_from") or results.get("degraded") else self._reuse_key(),
+                    "findings": results.get("findings", ""),
+                    "summary": results.get("summary", ""),
+                    "critique": results.get("critique", ""),
+                    "draft": results.get("final_draft", "")
                 }
-                with open(self.memory_path, "a", encoding="utf-8") as f:
-                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                # outputs of stages beyond the standard four are stored under their own names
+                for name in self.pipeline.names:
+                    if name not in _RECORD_KEYS and name in results:
+                        rec[name] = results[name]
+                if results.get("reused_from"):
+                    rec["reused_from"] = results["reused_from"]
+                if results.get("degraded"):
+                    rec["degraded"] = results["degraded"]
+                # the position comes from the append itself: reading len(store) afterwards
+                # races with concurrent sessions and links the query to another record
+                pos = self._get_memory().append(rec)
+                with self._memory_lock:
+                    if (self._semantic is not None and rec["reuse_key"] is not None
+                            and rec["reuse_key"] == self._semantic_key and pos >= self._semantic_built):
+                        self._semantic.add(user_query, pos)
         except Exception as e:
             print("[Orchestrator] memory write error:", e)
-
-        return results
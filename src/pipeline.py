@@ -0,0 +1,265 @@
+# src/pipeline.py
+"""
+Declarative stage graph for the orchestrator.
+
+A Pipeline is a set of Stages; each names the agent that runs it and the stages whose
+output it consumes. A stage starts as soon as all of its inputs are done, so independent
+stages run concurrently and the critical path, not the sum of the stages, sets latency.
+
+    Pipeline([
+        Stage("findings", "Research"),
+        Stage("summary", "Summarizer", inputs=("findings",)),
+        Stage("critique", "Critic", inputs=("findings",), timeout=30, optional=True),
+        Stage("final_draft", "Writer", inputs=("findings", "summary", "critique")),
+    ])
+
+- Input message: a stage without inputs gets the user query, one with a single input gets
+  that stage's text, several inputs are joined as labelled sections ("Findings:", ...).
+  `build(query, inputs)` overrides this.
+- `timeout` (seconds) bounds one stage; `optional` stages that fail or time out yield ""
+  and the run goes on (their error is reported), any other failure aborts the run.
+- Executors: `run_iter` (threads, yields results in completion order) and `arun` (asyncio).
+"""
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+def labelled_inputs(query: str, inputs: Dict[str, str]) -> str:
+    return "".join(f"\n\n{name.replace('_', ' ').capitalize()}:\n{text}" for name, text in inputs.items())
+
+class Stage:
+    def __init__(self, name: str, agent: str, inputs: Sequence[str] = (), build: Callable = None,
+                 timeout: float = None, optional: bool = False):
+        self.name = name
+        # agent name, or a role substring such as "Research" (matches "ResearchAgent")
+        self.agent = agent
+        self.inputs = tuple(inputs)
+        self.build = build
+        self.timeout = timeout
+        self.optional = optional
+
+    def message(self, query: str, inputs: Dict[str, str]) -> str:
+        if self.build is not None:
+            return self.build(query, inputs)
+        if not self.inputs:
+            return query
+        if len(self.inputs) == 1:
+            return inputs[self.inputs[0]]
+        return labelled_inputs(query, inputs)
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, {self.agent!r}, inputs={self.inputs!r})"
+
+class StageResult:
+    __slots__ = ("stage", "output", "error", "started", "ended", "message", "deferred")
+
+    def __init__(self, stage: Stage, output: str = "", error: BaseException = None,
+                 started: float = None, ended: float = None, message: str = None, deferred: bool = False):
+        self.stage = stage
+        self.output = output
+        self.error = error
+        self.started = started
+        self.ended = ended
+        self.message = message
+        self.deferred = deferred
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None or self.ended is None:
+            return 0.0
+        return self.ended - self.started
+
+class Pipeline:
+    def __init__(self, stages: Iterable[Stage], stream_stage: str = None):
+        stages = list(stages)
+        self.by_name: Dict[str, Stage] = {}
+        for s in stages:
+            if s.name in self.by_name:
+                raise ValueError(f"duplicate stage {s.name!r}")
+            self.by_name[s.name] = s
+        for s in stages:
+            missing = [i for i in s.inputs if i not in self.by_name]
+            if missing:
+                raise ValueError(f"stage {s.name!r} has unknown inputs {missing}")
+        self.stages = self._toposort(stages)
+        self.names = [s.name for s in self.stages]
+        self.dependents: Dict[str, List[str]] = {s.name: [] for s in self.stages}
+        for s in self.stages:
+            for i in s.inputs:
+                self.dependents[i].append(s.name)
+        # the stage whose output can be streamed: by default the last sink
+        sinks = [s.name for s in self.stages if not self.dependents[s.name]]
+        self.stream_stage = stream_stage or sinks[-1]
+
+    @staticmethod
+    def _toposort(stages: List[Stage]) -> List[Stage]:
+        order, state = [], {}
+        by_name = {s.name: s for s in stages}
+
+        def visit(s: Stage, path: Tuple[str, ...]):
+            if state.get(s.name) == "done":
+                return
+            if state.get(s.name) == "visiting":
+                raise ValueError(f"cycle in pipeline: {' -> '.join(path + (s.name,))}")
+            state[s.name] = "visiting"
+            for i in s.inputs:
+                visit(by_name[i], path + (s.name,))
+            state[s.name] = "done"
+            order.append(s)
+
+        for s in stages:
+            visit(s, ())
+        return order
+
+    def resolve(self, agents: Sequence[Any]) -> Dict[str, Any]:
+        """Map stage name -> agent (None if no agent matches): exact name first, then substring."""
+        resolved = {}
+        for s in self.stages:
+            agent = next((a for a in agents if a.name == s.agent), None)
+            if agent is None:
+                agent = next((a for a in agents if s.agent in a.name), None)
+            resolved[s.name] = agent
+        return resolved
+
+    def critical_path(self, results: Dict[str, StageResult]) -> Tuple[List[str], float]:
+        """The chain of stages that determined the finish time, and its length in seconds."""
+        timed = {n: r for n, r in results.items() if r.ended is not None and r.started is not None}
+        if not timed:
+            return [], 0.0
+        name = max(timed, key=lambda n: timed[n].ended)
+        path = [name]
+        while True:
+            deps = [i for i in self.by_name[name].inputs if i in timed]
+            if not deps:
+                break
+            name = max(deps, key=lambda n: timed[n].ended)
+            path.append(name)
+        path.reverse()
+        return path, timed[path[-1]].ended - timed[path[0]].started
+
+def _inputs(stage: Stage, results: Dict[str, StageResult]) -> Dict[str, str]:
+    return {i: results[i].output for i in stage.inputs}
+
+def _failed(stage: Stage, result: StageResult, error: BaseException) -> StageResult:
+    if not stage.optional:
+        raise error
+    result.output, result.error = "", error
+    return result
+
+def run_iter(pipeline: Pipeline, run_stage: Callable[[Stage, str], str], query: str,
+             done: Dict[str, str] = None, defer: Iterable[str] = ()) -> Iterator[StageResult]:
+    """
+    Run the pipeline on threads, yielding each StageResult as its stage completes.
+    `done` pre-fills outputs of stages that should not run. A stage named in `defer` is
+    yielded with deferred=True (and its message) as soon as its inputs are ready; the
+    caller runs it and sets `output` (or `error`) before advancing the iterator. A lone
+    ready stage without a timeout runs on the calling thread, so a linear pipeline
+    needs no worker threads at all.
+    """
+    results: Dict[str, StageResult] = {n: StageResult(pipeline.by_name[n], out) for n, out in (done or {}).items()}
+    defer = set(defer)
+    started: Set[str] = set(results)
+    running: Dict[Any, StageResult] = {}
+    pool: Optional[ThreadPoolExecutor] = None
+
+    def ready() -> List[Stage]:
+        return [s for s in pipeline.stages
+                if s.name not in started and all(i in results for i in s.inputs)]
+
+    def complete(result: StageResult, call: Callable[[], str] = None, error: BaseException = None) -> StageResult:
+        if error is None:
+            try:
+                result.output = call()
+            except Exception as e:
+                error = e
+        if error is not None:
+            _failed(result.stage, result, error)
+        result.ended = result.ended or time.perf_counter()
+        results[result.stage.name] = result
+        return result
+
+    try:
+        while len(results) < len(pipeline.stages):
+            for stage in ready():
+                started.add(stage.name)
+                result = StageResult(stage, message=stage.message(query, _inputs(stage, results)),
+                                     started=time.perf_counter())
+                if stage.name in defer:
+                    result.deferred = True
+                    yield result
+                    result.deferred = False
+                    complete(result, lambda: result.output, result.error)
+                elif not running and stage.timeout is None and not ready():
+                    yield complete(result, lambda: run_stage(stage, result.message))
+                else:
+                    if pool is None:
+                        pool = ThreadPoolExecutor(max_workers=len(pipeline.stages), thread_name_prefix="pipeline")
+                    ctx = contextvars.copy_context()
+                    running[pool.submit(ctx.run, run_stage, stage, result.message)] = result
+            if not running:
+                continue
+            now = time.perf_counter()
+            deadlines = [r.started + r.stage.timeout for r in running.values() if r.stage.timeout is not None]
+            finished, _ = wait(list(running), timeout=max(0.0, min(deadlines) - now) if deadlines else None,
+                               return_when=FIRST_COMPLETED)
+            for fut in finished:
+                yield complete(running.pop(fut), fut.result)
+            now = time.perf_counter()
+            for fut, result in list(running.items()):
+                stage = result.stage
+                if stage.timeout is not None and now - result.started >= stage.timeout and not fut.done():
+                    # the thread cannot be interrupted; its late result is discarded
+                    del running[fut]
+                    fut.cancel()
+                    yield complete(result, error=TimeoutError(f"stage {stage.name!r} timed out after {stage.timeout}s"))
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+async def arun(pipeline: Pipeline, run_stage: Callable[[Stage, str], Awaitable[str]], query: str,
+               done: Dict[str, str] = None) -> Dict[str, StageResult]:
+    """Run the pipeline on the event loop; each stage is a task that starts when its inputs finish."""
+    results: Dict[str, StageResult] = {n: StageResult(pipeline.by_name[n], out) for n, out in (done or {}).items()}
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(stage: Stage):
+        await asyncio.gather(*(tasks[i] for i in stage.inputs if i in tasks))
+        result = StageResult(stage, message=stage.message(query, _inputs(stage, results)), started=time.perf_counter())
+        try:
+            result.output = await asyncio.wait_for(run_stage(stage, result.message), stage.timeout)
+        except asyncio.TimeoutError:
+            _failed(stage, result, TimeoutError(f"stage {stage.name!r} timed out after {stage.timeout}s"))
+        except Exception as e:
+            _failed(stage, result, e)
+        result.ended = time.perf_counter()
+        results[stage.name] = result
+
+    # stages are in topological order, so every input's task exists before its dependents'
+    for stage in pipeline.stages:
+        if stage.name not in results:
+            tasks[stage.name] = asyncio.ensure_future(run(stage))
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for t in tasks.values():
+            t.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return results
+
+DEFAULT_PIPELINE = Pipeline([
+    Stage("findings", "Research"),
+    Stage("summary", "Summarizer", inputs=("findings",)),
+    Stage("critique", "Critic", inputs=("summary",)),
+    Stage("final_draft", "Writer", inputs=("findings", "summary", "critique")),
+])
+
+# the Critic reviews the raw findings while the Summarizer works on them
+PARALLEL_REVIEW_PIPELINE = Pipeline([
+    Stage("findings", "Research"),
+    Stage("summary", "Summarizer", inputs=("findings",)),
+    Stage("critique", "Critic", inputs=("findings",)),
+    Stage("final_draft", "Writer", inputs=("findings", "summary", "critique")),
+])
@@ -0,0 +1,189 @@
+# src/profiling.py
+"""
+Opt-in per-stage profiling for pipeline runs.
+
+A StageProfiler wraps each stage of one session with cProfile (CPU, per function) and
+tracemalloc (allocations, per source line) and writes, per run:
+    <PROFILE_DIR>/<session>_<timestamp>/<stage>.prof   pstats dump (snakeviz, pstats.Stats)
+    <PROFILE_DIR>/<session>_<timestamp>/summary.txt    top-N functions and allocations per stage
+    <PROFILE_DIR>/<session>_<timestamp>/summary.json   the same, machine-readable
+
+cProfile only sees the thread that enables it, so a stage must be entered on the thread
+that does the work (the orchestrator runs async stages' agent calls under the profiler in
+their worker thread). tracemalloc is process-wide: with several profiled sessions running
+at once, allocation figures include the other sessions' work.
+"""
+import os
+import re
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+PROFILE_DIR = os.environ.get(
+    "PIPELINE_PROFILE_DIR", os.path.join(os.path.dirname(__file__), "..", "data", "processed", "profiles"))
+
+def profiling_requested(flag: Optional[bool] = None) -> bool:
+    """An explicit flag wins; otherwise the PIPELINE_PROFILE environment variable decides."""
+    if flag is not None:
+        return bool(flag)
+    return os.environ.get("PIPELINE_PROFILE", "").lower() in ("1", "true", "yes")
+
+# tracemalloc is global; keep it running while any profiler needs it and stop it only if we started it
+_TRACE_LOCK = threading.Lock()
+_TRACE_USERS = 0
+_TRACE_OWNED = False
+
+def _trace_acquire():
+    global _TRACE_USERS, _TRACE_OWNED
+    with _TRACE_LOCK:
+        if _TRACE_USERS == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _TRACE_OWNED = True
+        _TRACE_USERS += 1
+
+def _trace_release():
+    global _TRACE_USERS, _TRACE_OWNED
+    with _TRACE_LOCK:
+        _TRACE_USERS = max(0, _TRACE_USERS - 1)
+        if _TRACE_USERS == 0 and _TRACE_OWNED:
+            tracemalloc.stop()
+            _TRACE_OWNED = False
+
+class _StageRun:
+    __slots__ = ("profile", "snapshot", "wall", "t0", "cpu_error")
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.snapshot = None
+        self.wall = 0.0
+        self.t0 = None
+        self.cpu_error = None
+
+class StageProfiler:
+    def __init__(self, session_id: str, out_dir: str = None, top_n: int = 20):
+        self.session_id = session_id
+        self.top_n = top_n
+        safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(session_id))[:80] or "session"
+        self.out_dir = os.path.join(out_dir or PROFILE_DIR, f"{safe}_{time.strftime('%Y%m%d-%H%M%S')}")
+        self.summary: Dict[str, Any] = {"session_id": session_id, "stages": {}}
+        self._runs: Dict[str, _StageRun] = {}
+        self._closed = False
+        _trace_acquire()
+
+    # --- stage lifecycle: start -> (pause/resume)* -> stop ---
+    def start(self, stage: str):
+        run = self._runs[stage] = _StageRun()
+        tracemalloc.reset_peak()
+        run.snapshot = tracemalloc.take_snapshot()
+        self.resume(stage)
+
+    def pause(self, stage: str):
+        run = self._runs[stage]
+        if run.t0 is not None:
+            if run.profile is not None:
+                run.profile.disable()
+            run.wall += time.perf_counter() - run.t0
+            run.t0 = None
+
+    def resume(self, stage: str):
+        run = self._runs[stage]
+        if run.t0 is None:
+            try:
+                if run.profile is not None:
+                    run.profile.enable()
+            except ValueError as e:
+                # another profiler is active on this thread/interpreter: keep the allocation data
+                run.cpu_error = str(e)
+                run.profile = None
+            run.t0 = time.perf_counter()
+
+    def stop(self, stage: str):
+        run = self._runs.get(stage)
+        if run is None:
+            return
+        if run.t0 is not None:
+            if run.profile is not None:
+                run.profile.disable()
+            run.wall += time.perf_counter() - run.t0
+            run.t0 = None
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        self._record(stage, run, after, peak)
+        del self._runs[stage]
+
+    @contextmanager
+    def stage(self, name: str):
+        self.start(name)
+        try:
+            yield self
+        finally:
+            self.stop(name)
+
+    def run(self, stage: str, fn, *args, **kwargs):
+        """Call fn under the profiler for `stage` on the current thread."""
+        with self.stage(stage):
+            return fn(*args, **kwargs)
+
+    # --- output ---
+    def _record(self, stage: str, run: _StageRun, after, peak: int):
+        os.makedirs(self.out_dir, exist_ok=True)
+        entry: Dict[str, Any] = {"wall_s": round(run.wall, 6), "peak_traced_kb": round(peak / 1024, 1)}
+        if run.profile is not None:
+            prof_path = os.path.join(self.out_dir, f"{stage}.prof")
+            run.profile.dump_stats(prof_path)
+            stats = pstats.Stats(run.profile)
+            rows = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:self.top_n]
+            entry["profile"] = prof_path
+            entry["cpu_top"] = [
+                {"function": f"{os.path.basename(fn)}:{line}({name})", "ncalls": nc,
+                 "tottime_s": round(tt, 6), "cumtime_s": round(ct, 6)}
+                for (fn, line, name), (cc, nc, tt, ct, _callers) in rows
+            ]
+        else:
+            entry["cpu_error"] = run.cpu_error
+        diffs = after.compare_to(run.snapshot, "lineno")
+        entry["alloc_top"] = [
+            {"where": f"{d.traceback[0].filename}:{d.traceback[0].lineno}",
+             "size_diff_kb": round(d.size_diff / 1024, 2), "count_diff": d.count_diff}
+            for d in diffs[:self.top_n] if d.size_diff
+        ]
+        self.summary["stages"][stage] = entry
+
+    def finish(self) -> str:
+        """Write summary.json / summary.txt and release tracemalloc. Returns the artifact directory."""
+        if self._closed:
+            return self.out_dir
+        self._closed = True
+        for stage in list(self._runs):
+            self.stop(stage)
+        _trace_release()
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(os.path.join(self.out_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(self.summary, f, indent=2)
+        with open(os.path.join(self.out_dir, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write(self.format_summary())
+        return self.out_dir
+
+    def format_summary(self) -> str:
+        out = io.StringIO()
+        out.write(f"Profile for session {self.session_id}\n")
+        for stage, entry in self.summary["stages"].items():
+            out.write(f"\n== {stage}: {entry['wall_s']:.3f}s wall, peak traced {entry['peak_traced_kb']} KB ==\n")
+            if entry.get("cpu_top"):
+                out.write("  top functions by cumulative time:\n")
+                for row in entry["cpu_top"]:
+                    out.write(f"    {row['cumtime_s']:>9.4f}s cum {row['tottime_s']:>9.4f}s self "
+                              f"{row['ncalls']:>7} calls  {row['function']}\n")
+            elif entry.get("cpu_error"):
+                out.write(f"  cpu profile unavailable: {entry['cpu_error']}\n")
+            if entry.get("alloc_top"):
+                out.write("  top allocations (net, by line):\n")
+                for row in entry["alloc_top"]:
+                    out.write(f"    {row['size_diff_kb']:>10.2f} KB {row['count_diff']:>+8} blocks  {row['where']}\n")
+        return out.getvalue()
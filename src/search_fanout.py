@@ -0,0 +1,182 @@
+# src/search_fanout.py
+"""
+Fan-out search for broad questions: split the query into sub-queries, search them
+concurrently through a Tool, then merge, deduplicate and rank the hits.
+
+- Decomposition is heuristic (no LLM round trip): list-like queries are split on
+  commas/semicolons/"and"/"vs"; a query that does not split gets facet variants
+  (see FANOUT_FACETS). The original query is always searched too.
+- Sub-queries run on a shared bounded pool (SEARCH_FANOUT_WORKERS, default 8) so many
+  sessions fanning out at once cannot flood the search backends.
+- Dedup: hits with the same normalized link are merged; hits whose title+snippet
+  simhash is within `near_dup_bits` of a kept hit are treated as near duplicates.
+- Ranking: query-term coverage of title+snippet, how many sub-queries returned the
+  hit, and its best position in any sub-query's results.
+- Quota: every sub-query is a separate search call, and a search that reaches Gemini
+  takes a slot from the host-wide GENAI_RATE_LIMIT_RPM quota (default 2/min). With the
+  default max_subqueries=4 one research step can cost 4 requests, i.e. two minutes of
+  the default quota; cached sub-queries cost nothing. Lower max_subqueries (or raise
+  the quota) when fan-out runs against the live API.
+"""
+import os
+import re
+import time
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from memory import normalize_query
+from observability import METRICS, span
+
+FANOUT_WORKERS = int(os.environ.get("SEARCH_FANOUT_WORKERS", "8"))
+_FANOUT_POOL = ThreadPoolExecutor(max_workers=max(1, FANOUT_WORKERS), thread_name_prefix="search-fanout")
+
+# appended to a query that does not split into parts
+FANOUT_FACETS = ("overview", "latest research", "challenges and limitations")
+
+_LEAD = re.compile(r"^(?:compare|comparing|differences? between)\s+", re.I)
+_SPLIT = re.compile(r"\s*(?:[,;]|\band\b|\bvs\.?|\bversus\b)\s*")
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an the of in on for to and or with about what is are how why which who when does do vs versus "
+    "between from by at as be it its this that these those".split())
+
+def _terms(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(normalize_query(text)) if t not in _STOPWORDS]
+
+def decompose_query(query: str, max_subqueries: int = 4) -> List[str]:
+    """The query itself followed by up to max_subqueries - 1 narrower sub-queries."""
+    query = (query or "").strip()
+    if not query or max_subqueries <= 1:
+        return [query]
+    parts = [p.strip(" ?.!") for p in _SPLIT.split(_LEAD.sub("", query.rstrip("?.! ")))]
+    parts = [p for p in parts if len(_terms(p)) >= 1]
+    if len(parts) > 1:
+        subs = parts
+    else:
+        base = query.rstrip("?.! ")
+        subs = [f"{base} {facet}" for facet in FANOUT_FACETS]
+    out, seen = [query], {normalize_query(query)}
+    for sub in subs:
+        key = normalize_query(sub)
+        if key not in seen:
+            seen.add(key)
+            out.append(sub)
+        if len(out) >= max_subqueries:
+            break
+    return out
+
+def simhash(text: str, bits: int = 64) -> int:
+    """Charikar simhash over word bigrams (single words for very short texts)."""
+    words = _TOKEN.findall(normalize_query(text))
+    grams = [" ".join(words[i:i + 2]) for i in range(len(words) - 1)] or words
+    if not grams:
+        return 0
+    weights = [0] * bits
+    for g in grams:
+        h = int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=bits // 8).digest(), "big")
+        for i in range(bits):
+            weights[i] += 1 if (h >> i) & 1 else -1
+    return sum(1 << i for i, w in enumerate(weights) if w > 0)
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def normalize_link(link: str) -> str:
+    if not link:
+        return ""
+    parts = urlsplit(link.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    return f"{host}{path}" + (f"?{parts.query}" if parts.query else "")
+
+def merge_hits(query: str, results: Sequence[Tuple[str, List[Dict[str, Any]]]], max_hits: int = 10,
+               near_dup_bits: int = 3) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Merge (sub_query, hits) lists into one ranked, deduplicated list.
+    Returns (hits, duplicates_dropped); each hit gains "score" and "subqueries".
+    """
+    kept: List[Dict[str, Any]] = []
+    meta: List[Dict[str, Any]] = []   # per kept hit: simhash, sub-queries, best rank
+    by_link: Dict[str, int] = {}
+    dropped = 0
+    for sub, hits in results:
+        for rank, hit in enumerate(hits or []):
+            link = normalize_link(hit.get("link") or hit.get("url") or "")
+            sig = simhash(f"{hit.get('title', '')} {hit.get('snippet', '')}")
+            idx = by_link.get(link) if link else None
+            if idx is None:
+                idx = next((i for i, m in enumerate(meta) if hamming(m["sig"], sig) <= near_dup_bits), None)
+            if idx is not None:
+                dropped += 1
+                m = meta[idx]
+                if sub not in m["subs"]:
+                    m["subs"].append(sub)
+                m["rank"] = min(m["rank"], rank)
+                continue
+            if link:
+                by_link[link] = len(kept)
+            kept.append(dict(hit))
+            meta.append({"sig": sig, "subs": [sub], "rank": rank})
+
+    terms = set(_terms(query))
+    n_subs = max(1, len(results))
+    for hit, m in zip(kept, meta):
+        words = set(_terms(f"{hit.get('title', '')} {hit.get('snippet', '')}"))
+        coverage = len(terms & words) / len(terms) if terms else 0.0
+        hit["score"] = round(coverage + 0.5 * len(m["subs"]) / n_subs + 0.5 / (1 + m["rank"]), 4)
+        hit["subqueries"] = m["subs"]
+    kept.sort(key=lambda h: h["score"], reverse=True)
+    return kept[:max_hits], dropped
+
+def fanout_search(tool, query: str, max_subqueries: int = 4, max_hits: int = 10,
+                  timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Search `query` and its sub-queries concurrently via tool.call and return one result
+    dict shaped like simple_search's ({"query", "hits", "source", ...}). Sub-queries that
+    fail or miss `timeout` are skipped and listed under "errors"; if none of them returned
+    a hit, "error" is set as well, as simple_search does when it finds nothing.
+    """
+    subs = decompose_query(query, max_subqueries)
+    started = time.perf_counter()
+    with span("search.fanout", subqueries=len(subs)) as s:
+        # tool calls run in pool threads; copy the context so their spans nest under this one
+        futures = {_FANOUT_POOL.submit(contextvars.copy_context().run, tool.call, sub): sub for sub in subs}
+        done, not_done = wait(list(futures), timeout=timeout)
+        for fut in not_done:
+            fut.cancel()
+        results, errors, sources = [], {}, set()
+        for fut, sub in futures.items():
+            if fut not in done:
+                errors[sub] = "timeout"
+                continue
+            try:
+                resp = fut.result()
+            except Exception as e:
+                errors[sub] = str(e)
+                continue
+            if resp.get("status") != "ok":
+                errors[sub] = resp.get("error", "search failed")
+                continue
+            result = resp.get("result") or {}
+            if result.get("source"):
+                sources.add(result["source"])
+            results.append((sub, result.get("hits", [])))
+        hits, dropped = merge_hits(query, results, max_hits=max_hits)
+        s.set_attribute("hits", len(hits))
+        s.set_attribute("duplicates", dropped)
+        if errors:
+            s.set_attribute("errors", len(errors))
+    METRICS.observe("search_fanout_seconds", time.perf_counter() - started)
+    METRICS.inc("search_fanout_duplicates_total", dropped)
+    out = {"query": query, "hits": hits, "source": "fanout", "subqueries": subs, "sources": sorted(sources)}
+    if errors:
+        out["errors"] = errors
+        if not hits:
+            first = next(iter(errors.values()))
+            out["error"] = f"{len(errors)}/{len(subs)} sub-queries failed and none returned hits: {first}"
+    return out
@@ -0,0 +1,128 @@
+# src/semantic_index.py
+"""
+Near-duplicate lookup over past research queries.
+
+Queries are turned into hashed TF-IDF vectors (word unigrams/bigrams plus character
+trigrams of the normalized text, hashed into `n_features` buckets) and compared by
+cosine similarity with NumPy. Used by Orchestrator to reuse prior pipeline results
+for rephrased questions.
+"""
+import re
+import zlib
+import threading
+from typing import Any, List, Optional, Tuple
+
+from memory import normalize_query
+
+# Optional: NumPy (listed in requirements.txt)
+NUMPY_AVAILABLE = False
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except Exception:
+    NUMPY_AVAILABLE = False
+
+_TOKEN_RE = re.compile(r"\w+")
+
+class SemanticIndex:
+    """
+    Append-only index of (text, payload) pairs. Only the most recent `max_records`
+    entries are kept, which bounds memory at max_records * n_features * 4 bytes for the
+    term frequencies plus as much again for the weighted rows.
+
+    - Storage is a ring buffer: once full, each add overwrites the oldest slot in place.
+    - Document frequencies are updated per add. The weighted (tf-idf, L2-normalized)
+      rows are kept up to date: a new row is weighted with the current IDF snapshot, and
+      all rows are re-weighted once `reweight_fraction` of the index has been added since
+      the last snapshot, so a search never pays for a full rebuild after every add.
+    """
+    def __init__(self, n_features: int = 1024, max_records: int = 20000, reweight_fraction: float = 0.1):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("SemanticIndex requires numpy")
+        self.n_features = n_features
+        self.max_records = max_records
+        self.reweight_fraction = reweight_fraction
+        self._tf = np.zeros((min(64, max_records), n_features), dtype=np.float32)
+        self._df = np.zeros(n_features, dtype=np.int64)
+        self._payloads: List[Any] = []
+        self._next = 0          # slot the next add writes (wraps at max_records)
+        self._weighted = None   # L2-normalized tf-idf rows under self._idf, same shape as _tf
+        self._idf = None
+        self._stale = 0         # adds since the IDF snapshot
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def _features(self, text: str) -> "np.ndarray":
+        norm = normalize_query(text)
+        words = _TOKEN_RE.findall(norm)
+        grams = words + [a + " " + b for a, b in zip(words, words[1:])]
+        squashed = " ".join(words)
+        grams += ["#" + squashed[i:i + 3] for i in range(max(0, len(squashed) - 2))]
+        vec = np.zeros(self.n_features, dtype=np.float32)
+        for g in grams:
+            vec[zlib.crc32(g.encode("utf-8")) % self.n_features] += 1.0
+        nz = vec > 0
+        vec[nz] = 1.0 + np.log(vec[nz])
+        return vec
+
+    def add(self, text: str, payload: Any):
+        vec = self._features(text)
+        with self._lock:
+            slot = self._next
+            if len(self._payloads) >= self.max_records:
+                # overwrite the oldest entry in place
+                self._df -= (self._tf[slot] > 0)
+                self._payloads[slot] = payload
+            else:
+                if slot >= self._tf.shape[0]:
+                    self._tf = self._grown(self._tf)
+                    if self._weighted is not None:
+                        self._weighted = self._grown(self._weighted)
+                self._payloads.append(payload)
+            self._tf[slot] = vec
+            self._df += (vec > 0)
+            self._next = (slot + 1) % self.max_records
+            if self._weighted is not None:
+                self._weighted[slot] = self._weigh(vec)
+                self._stale += 1
+
+    def _grown(self, rows: "np.ndarray") -> "np.ndarray":
+        grown = np.zeros((min(rows.shape[0] * 2, self.max_records), self.n_features), dtype=np.float32)
+        grown[:rows.shape[0]] = rows
+        return grown
+
+    def _weigh(self, vec: "np.ndarray") -> "np.ndarray":
+        w = vec * self._idf
+        return w / (np.linalg.norm(w) or 1.0)
+
+    def _reweight(self, n: int):
+        # called with the lock held: new IDF snapshot and every row re-weighted under it
+        self._idf = (np.log((1.0 + n) / (1.0 + self._df)) + 1.0).astype(np.float32)
+        weighted = self._tf * self._idf
+        norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        weighted /= norms
+        self._weighted = weighted
+        self._stale = 0
+
+    def search(self, text: str, top_k: int = 1) -> List[Tuple[float, Any]]:
+        """Best `top_k` (cosine similarity, payload) pairs, highest first."""
+        vec = self._features(text)
+        with self._lock:
+            n = len(self._payloads)
+            if n == 0 or not vec.any():
+                return []
+            if self._weighted is None or self._stale > self.reweight_fraction * n:
+                self._reweight(n)
+            q = self._weigh(vec)
+            scores = self._weighted[:n] @ q
+            k = min(top_k, n)
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [(float(scores[i]), self._payloads[i]) for i in best]
+
+    def best_match(self, text: str) -> Optional[Tuple[float, Any]]:
+        hits = self.search(text, top_k=1)
+        return hits[0] if hits else None
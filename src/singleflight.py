@@ -0,0 +1,69 @@
+# src/singleflight.py
+"""
+Request coalescing: concurrent calls with the same key share one in-flight execution.
+
+The first caller for a key (the leader) runs the function; callers arriving while it is
+running wait for the same result or exception instead of starting their own. Each flight
+is a concurrent.futures.Future, so thread callers (do) and asyncio callers (ado) can join
+each other's flights.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, Future] = {}
+        self.coalesced = 0
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        with self._lock:
+            fut = self._flights.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                return fut, False
+            fut = Future()
+            self._flights[key] = fut
+            return fut, True
+
+    def _finish(self, key: Hashable):
+        with self._lock:
+            self._flights.pop(key, None)
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) unless a call with `key` is already in flight; share its outcome."""
+        fut, leader = self._join(key)
+        if not leader:
+            return fut.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._finish(key)
+
+    async def ado(self, key: Hashable, coro_fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Async do(): awaits coro_fn(*args, **kwargs) or joins the in-flight call for `key`."""
+        fut, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(fut)
+        try:
+            result = await coro_fn(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._finish(key)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
@@ -1,10 +1,22 @@
 # src/tool_adapter.py
 import os
 import time
+import asyncio
+import functools
+import contextvars
+import importlib
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import Any, Dict, Callable, Optional
 
+from cache import PersistentLRUCache
+from genai_wrapper import get_model, configure_genai
+from llm_gateway import get_gateway
+from memory import normalize_query
+from singleflight import SingleFlight
+from observability import METRICS, span
+
 # --- Logging setup (writes to data/processed/search_debug.log) ---
 LOG_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "processed")
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -12,27 +24,122 @@ log_path = os.path.join(LOG_DIR, "search_debug.log")
 logging.basicConfig(filename=log_path, level=logging.INFO, format="%(asctime)s [simple_search] %(message)s")
 
 # --- Small Tool wrapper used by agents/orchestrator/ui ---
+# Identical concurrent tool calls (same function and arguments) share one execution.
+TOOL_FLIGHTS = SingleFlight()
+
 class Tool:
     """
     Simple wrapper for tools so agents call .call(query) and get a consistent return value.
+    With coalesce=True, concurrent identical calls (from threads or via acall from asyncio)
+    run the underlying function once and all receive its result or error.
     """
-    def __init__(self, name: str, func: Callable):
+    def __init__(self, name: str, func: Callable, coalesce: bool = True):
         self.name = name
         self.func = func
+        self.coalesce = coalesce
+
+    def _flight_key(self, args, kwargs):
+        return (self.func, repr(args), repr(sorted(kwargs.items())))
+
+    @staticmethod
+    def _wrap(result):
+        if isinstance(result, dict):
+            return {"status": "ok", "result": result}
+        return {"status": "ok", "result": {"value": result}}
 
     def call(self, *args, **kwargs):
         # Standardize try/except and return a consistent dict structure
+        with span("tool.call", tool=self.name) as s:
+            try:
+                if self.coalesce:
+                    result = TOOL_FLIGHTS.do(self._flight_key(args, kwargs), self.func, *args, **kwargs)
+                else:
+                    result = self.func(*args, **kwargs)
+                return self._wrap(result)
+            except Exception as e:
+                s.record_error(e)
+                return {"status": "error", "error": str(e)}
+
+    async def acall(self, *args, **kwargs):
+        """Awaitable call(): runs the tool in a worker thread, coalescing with in-flight calls."""
+        with span("tool.call", tool=self.name) as s:
+            try:
+                if self.coalesce:
+                    result = await TOOL_FLIGHTS.ado(self._flight_key(args, kwargs), asyncio.to_thread,
+                                                    self.func, *args, **kwargs)
+                else:
+                    result = await asyncio.to_thread(self.func, *args, **kwargs)
+                return self._wrap(result)
+            except Exception as e:
+                s.record_error(e)
+                return {"status": "error", "error": str(e)}
+
+# --- Search result cache (normalized query -> result, persisted across restarts) ---
+# TTL in seconds per result source; unlisted sources use the cache default, 0 means never cache
+SEARCH_CACHE_TTLS = {
+    "genai_search": 6 * 3600,
+    "google_cse": 6 * 3600,
+    "genai_raw_fallback": 3600,
+    "mock": 0,
+}
+SEARCH_CACHE = PersistentLRUCache(
+    path=os.environ.get("SEARCH_CACHE_PATH", os.path.join(LOG_DIR, "search_cache.json")),
+    max_entries=int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "500")),
+    default_ttl=1800,
+)
+
+def _search_cache_enabled() -> bool:
+    return os.environ.get("SEARCH_CACHE_DISABLED", "").lower() not in ("1", "true", "yes")
+
+def _timed_search(backend: str, fn: Callable[..., Dict[str, Any]], query: str, *args, **kwargs) -> Dict[str, Any]:
+    """Call one search backend, recording its latency and outcome (hits / empty / error)."""
+    t0 = time.perf_counter()
+    outcome = "error"
+    with span("search.backend", backend=backend) as s:
         try:
-            result = self.func(*args, **kwargs)
-            if isinstance(result, dict):
-                return {"status": "ok", "result": result}
-            return {"status": "ok", "result": {"value": result}}
-        except Exception as e:
-            return {"status": "error", "error": str(e)}
+            resp = fn(query, *args, **kwargs)
+            if isinstance(resp, dict):
+                outcome = "error" if resp.get("error") else ("hits" if resp.get("hits") else "empty")
+                s.set_attribute("source", resp.get("source"))
+                s.set_attribute("hits", len(resp.get("hits") or []))
+            return resp
+        finally:
+            s.set_attribute("outcome", outcome)
+            METRICS.observe("search_backend_seconds", time.perf_counter() - t0,
+                            {"backend": backend, "outcome": outcome})
+
+def _cached_search(backend: str):
+    """Serve repeat queries for `backend` from SEARCH_CACHE; only results with hits are stored."""
+    def decorator(fn: Callable[..., Dict[str, Any]]):
+        @functools.wraps(fn)
+        def wrapper(query: str, *args, **kwargs) -> Dict[str, Any]:
+            if not _search_cache_enabled():
+                return _timed_search(backend, fn, query, *args, **kwargs)
+            key = f"{backend}|{normalize_query(query)}"
+            cached = SEARCH_CACHE.get(key)
+            if cached is not None:
+                logging.info(f"[simple_search] cache hit backend={backend} query={query!r}")
+                METRICS.inc("search_cache_total", labels={"backend": backend, "result": "hit"})
+                cached["query"] = query
+                return cached
+            METRICS.inc("search_cache_total", labels={"backend": backend, "result": "miss"})
+            resp = _timed_search(backend, fn, query, *args, **kwargs)
+            if isinstance(resp, dict) and resp.get("hits") and not resp.get("error"):
+                ttl = SEARCH_CACHE_TTLS.get(resp.get("source"), SEARCH_CACHE.default_ttl)
+                SEARCH_CACHE.set(key, resp, ttl=ttl)
+            return resp
+        return wrapper
+    return decorator
 
 # --- Mock results (fallback) ---
+def _mock_search_latency() -> float:
+    # synthetic backend latency for mock results (benchmarks set MOCK_SEARCH_LATENCY)
+    return float(os.environ.get("MOCK_SEARCH_LATENCY", "0.2") or 0)
+
 def _mock_results(query: str) -> Dict[str, Any]:
-    time.sleep(0.2)
+    delay = _mock_search_latency()
+    if delay > 0:
+        time.sleep(delay)
     return {
         "query": query,
         "hits": [
@@ -43,6 +150,7 @@ def _mock_results(query: str) -> Dict[str, Any]:
     }
 
 # --- Google Custom Search JSON API adapter (fallback) ---
+@_cached_search("google_cse")
 def _google_cse_search(query: str) -> Dict[str, Any]:
     api_key = os.environ.get("GOOGLE_API_KEY")
     cx = os.environ.get("GOOGLE_CX") or os.environ.get("CUSTOM_SEARCH_CX")
@@ -71,7 +179,8 @@ def _with_retries(fn: Callable, attempts: int = 3, initial_backoff: float = 1.0,
     last_exc = None
     for i in range(attempts):
         try:
-            return fn()
+            with span("retry.attempt", attempt=i + 1, of=attempts):
+                return fn()
         except Exception as e:
             last_exc = e
             logging.warning(f"[simple_search] attempt {i+1} failed: {e}; retrying after {backoff}s")
@@ -81,6 +190,9 @@ def _with_retries(fn: Callable, attempts: int = 3, initial_backoff: float = 1.0,
     raise last_exc
 
 # --- GenAI web-search wrapper with graceful fallbacks ---
+SEARCH_MODEL = "models/gemini-pro-latest"
+
+@_cached_search("genai")
 def _genai_web_search(query: str, retry_attempts: int = 3, backoff: float = 1.0) -> Dict[str, Any]:
     """
     Try the web-search tool (if SDK provides types). If the tool types are missing
@@ -89,7 +201,7 @@ def _genai_web_search(query: str, retry_attempts: int = 3, backoff: float = 1.0)
     """
     # runtime import (avoid reliance on module-level import status)
     try:
-        import google.generativeai as genai_runtime
+        importlib.import_module("google.generativeai")
     except Exception as e:
         return {"query": query, "hits": [], "error": f"genai_import_failed: {e}", "source": "genai_not_installed"}
 
@@ -97,19 +209,17 @@ def _genai_web_search(query: str, retry_attempts: int = 3, backoff: float = 1.0)
     if not (os.environ.get("GOOGLE_APPLICATION_CREDENTIALS") or os.environ.get("GOOGLE_API_KEY")):
         return {"query": query, "hits": [], "error": "no_credentials", "source": "genai_no_creds"}
 
-    # if API key present, configure (no-op when ADC used)
+    # if API key present, configure once per key (no-op when ADC used)
     try:
-        if os.environ.get("GOOGLE_API_KEY"):
-            genai_runtime.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
+        configure_genai()
     except Exception:
         # non-fatal
         pass
 
     # Attempt to use tool-based web-search types when available
     try:
-        from google.generativeai.types import Tool as GenAITool, GoogleSearch as GenAIGoogleSearch
-
-        model = genai_runtime.GenerativeModel("models/gemini-pro-latest")
+        # shared model bound to the search tool (ImportError if the SDK lacks the tool types)
+        model = get_model(SEARCH_MODEL, tools="google_search")
 
         prompt = (
             f"Search the web for up-to-date findings about: {query}\n"
@@ -117,8 +227,10 @@ def _genai_web_search(query: str, retry_attempts: int = 3, backoff: float = 1.0)
         )
 
         def call_tool():
-            # call generate_content via model (no explicit timeout param available in many SDK builds)
-            return model.generate_content(contents=prompt, tools=[GenAITool(google_search=GenAIGoogleSearch())])
+            # call generate_content via model (no explicit timeout param available in many SDK builds);
+            # _with_retries owns retrying, the gateway only schedules against the quota
+            return get_gateway().call(lambda: model.generate_content(contents=prompt),
+                                      model=SEARCH_MODEL, max_attempts=1)
 
         # Use retry wrapper for transient network errors
         try:
@@ -146,14 +258,15 @@ def _genai_web_search(query: str, retry_attempts: int = 3, backoff: float = 1.0)
 
         # Direct generate_content fallback (not a true web-search tool — best effort)
         try:
-            model = genai_runtime.GenerativeModel("models/gemini-pro-latest")
+            model = get_model(SEARCH_MODEL)
             prompt = (
                 f"Provide an up-to-date summary of recent findings related to: {query}\n"
                 "If you cannot access the live web, explicitly state that and provide the best plausible recent updates with a cautionary note."
             )
 
             def call_raw():
-                return model.generate_content(contents=prompt)
+                return get_gateway().call(lambda: model.generate_content(contents=prompt),
+                                          model=SEARCH_MODEL, max_attempts=1)
 
             try:
                 resp = _with_retries(call_raw, attempts=retry_attempts, initial_backoff=backoff)
@@ -167,51 +280,114 @@ def _genai_web_search(query: str, retry_attempts: int = 3, backoff: float = 1.0)
     except Exception as e:
         return {"query": query, "hits": [], "error": str(e), "source": "genai_error"}
 
+# --- Hedged mode: race genai and CSE instead of trying them in sequence ---
+# Seconds to wait on genai before also starting CSE (0 = start both at once).
+# Unset = sequential genai -> CSE -> mock. Can be overridden per call via simple_search(hedge_delay=...).
+SEARCH_HEDGE_DELAY = os.environ.get("SEARCH_HEDGE_DELAY")
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="search-hedge")
+
+def _genai_search_ready() -> bool:
+    try:
+        importlib.import_module("google.generativeai")
+    except Exception:
+        return False
+    return bool(os.environ.get("GOOGLE_APPLICATION_CREDENTIALS") or os.environ.get("GOOGLE_API_KEY"))
+
+def _cse_configured() -> bool:
+    return bool(os.environ.get("GOOGLE_API_KEY") and (os.environ.get("GOOGLE_CX") or os.environ.get("CUSTOM_SEARCH_CX")))
+
+def _hedged_search(query: str, hedge_delay: float) -> Optional[Dict[str, Any]]:
+    """
+    Start genai, and CSE after `hedge_delay` seconds unless genai already returned hits.
+    The first response with hits wins; the other call is cancelled if it has not started
+    yet, otherwise left to finish in the background and ignored (its result still lands
+    in the search cache). Returns None when neither backend produced anything usable.
+    """
+    # backend calls run in pool threads; copy the context so their spans nest under this search
+    pending = {_HEDGE_POOL.submit(contextvars.copy_context().run, _genai_web_search, query): "genai"}
+    fallback = None
+    cse_started = False
+    while pending:
+        timeout = hedge_delay if not cse_started else None
+        done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done and not cse_started:
+            logging.info(f"[simple_search] hedge: genai slower than {hedge_delay}s, starting CSE")
+            pending[_HEDGE_POOL.submit(contextvars.copy_context().run, _google_cse_search, query)] = "google_cse"
+            cse_started = True
+            continue
+        for fut in done:
+            backend = pending.pop(fut)
+            try:
+                resp = fut.result()
+            except Exception as e:
+                logging.exception("[simple_search] hedge: %s failed: %s", backend, e)
+                continue
+            logging.info(f"[simple_search] hedge: {backend} resp source={resp.get('source')} hits={len(resp.get('hits', []))} error={resp.get('error', '')}")
+            if resp.get("hits"):
+                for other in pending:
+                    other.cancel()
+                logging.info(f"[simple_search] hedge winner: {backend}")
+                METRICS.inc("search_hedge_wins_total", labels={"backend": backend})
+                return {**resp, "backend": backend}
+            if resp.get("raw") and fallback is None:
+                fallback = {"query": query, "hits": [{"title": "Faiq's AI", "snippet": resp.get("raw")[:400]}],
+                            "source": resp.get("source"), "raw": resp.get("raw"), "backend": backend}
+        if not cse_started:
+            # genai finished without hits: CSE is the only hope left
+            pending[_HEDGE_POOL.submit(contextvars.copy_context().run, _google_cse_search, query)] = "google_cse"
+            cse_started = True
+    return fallback
+
 # --- Top-level adapter: selects genai -> CSE -> mock with logging ---
-def simple_search(query: str) -> Dict[str, Any]:
+def simple_search(query: str, hedge_delay: float = None) -> Dict[str, Any]:
     """
     Robust top-level search adapter:
       1) Try genai (runtime): prefer tool-based web-search; fallback to CSE or direct genai.
       2) Try Google CSE if configured.
       3) Fallback to mock.
+    With a hedge delay (argument or SEARCH_HEDGE_DELAY) and both backends configured,
+    steps 1 and 2 race concurrently instead; the result's "backend" names the winner.
+    Caching happens one level down: each backend's results with hits are cached per
+    normalized query (see SEARCH_CACHE_TTLS); mock results are never cached.
     """
-    time.sleep(0.2)
     logging.info(f"[simple_search] called with query: {query!r}")
 
-    # Try genai runtime first (call-time import)
-    try:
-        # quick check if runtime module importable
-        import importlib
-        try:
-            importlib.import_module("google.generativeai")
-            genai_runtime_available = True
-        except Exception:
-            genai_runtime_available = False
+    if hedge_delay is None and SEARCH_HEDGE_DELAY not in (None, ""):
+        hedge_delay = float(SEARCH_HEDGE_DELAY)
+    genai_ready = _genai_search_ready()
 
-        if genai_runtime_available and (os.environ.get("GOOGLE_APPLICATION_CREDENTIALS") or os.environ.get("GOOGLE_API_KEY")):
-            logging.info("[simple_search] genai runtime available and credentials present -> calling _genai_web_search")
-            resp = _genai_web_search(query)
-            logging.info(f"[simple_search] genai resp source={resp.get('source')} hits={len(resp.get('hits', []))} error={resp.get('error', '')}")
-            if resp.get("hits"):
-                return resp
-            if resp.get("raw"):
-                # return raw as single hit so UI displays helpful text
-                return {"query": query, "hits": [{"title": "Faiq's AI", "snippet": resp.get("raw")[:400]}], "source": resp.get("source"), "raw": resp.get("raw")}
-    except Exception as e:
-        logging.exception("[simple_search] unexpected error trying genai: %s", e)
-
-    # Try Google Custom Search (CSE)
-    api_key = os.environ.get("GOOGLE_API_KEY")
-    cx = os.environ.get("GOOGLE_CX") or os.environ.get("CUSTOM_SEARCH_CX")
-    if api_key and cx:
-        logging.info("[simple_search] attempting Google Custom Search (CSE) fallback")
+    if hedge_delay is not None and genai_ready and _cse_configured():
         try:
-            resp = _google_cse_search(query)
-            logging.info(f"[simple_search] cse resp source={resp.get('source')} hits={len(resp.get('hits', []))} error={resp.get('error', '')}")
-            if resp.get("hits"):
+            resp = _hedged_search(query, max(0.0, hedge_delay))
+            if resp is not None:
                 return resp
         except Exception as e:
-            logging.exception("[simple_search] unexpected error calling CSE: %s", e)
+            logging.exception("[simple_search] unexpected error in hedged search: %s", e)
+    else:
+        # Try genai runtime first (call-time import)
+        try:
+            if genai_ready:
+                logging.info("[simple_search] genai runtime available and credentials present -> calling _genai_web_search")
+                resp = _genai_web_search(query)
+                logging.info(f"[simple_search] genai resp source={resp.get('source')} hits={len(resp.get('hits', []))} error={resp.get('error', '')}")
+                if resp.get("hits"):
+                    return resp
+                if resp.get("raw"):
+                    # return raw as single hit so UI displays helpful text
+                    return {"query": query, "hits": [{"title": "Faiq's AI", "snippet": resp.get("raw")[:400]}], "source": resp.get("source"), "raw": resp.get("raw")}
+        except Exception as e:
+            logging.exception("[simple_search] unexpected error trying genai: %s", e)
+
+        # Try Google Custom Search (CSE)
+        if _cse_configured():
+            logging.info("[simple_search] attempting Google Custom Search (CSE) fallback")
+            try:
+                resp = _google_cse_search(query)
+                logging.info(f"[simple_search] cse resp source={resp.get('source')} hits={len(resp.get('hits', []))} error={resp.get('error', '')}")
+                if resp.get("hits"):
+                    return resp
+            except Exception as e:
+                logging.exception("[simple_search] unexpected error calling CSE: %s", e)
 
     # Final fallback: mock
     logging.info(f"[simple_search] returning mock results for query: {query!r}")
@@ -0,0 +1,23 @@
+# tests/conftest.py
+import os
+import sys
+import logging
+import tempfile
+
+# modules under src/ import each other as top-level modules (as the notebook and UI do)
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+# keep test runs out of data/processed: caches, metrics and logs go to a scratch dir
+_SCRATCH = tempfile.mkdtemp(prefix="capstone-tests-")
+os.environ.setdefault("TRACING_DISABLED", "1")
+os.environ.setdefault("METRICS_PATH", os.path.join(_SCRATCH, "agent_metrics.json"))
+os.environ.setdefault("LLM_CACHE_PATH", os.path.join(_SCRATCH, "llm_cache.json"))
+os.environ.setdefault("SEARCH_CACHE_PATH", os.path.join(_SCRATCH, "search_cache.json"))
+# tool_adapter's basicConfig(filename=...search_debug.log) is a no-op once logging is configured
+logging.basicConfig(handlers=[logging.NullHandler()])
+
+import agents  # noqa: E402
+
+agents.AGENT_DEBUG_LOG = os.path.join(_SCRATCH, "agent_debug.log")
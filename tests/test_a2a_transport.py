@@ -0,0 +1,110 @@
+# tests/test_a2a_transport.py
+import asyncio
+import gc
+import os
+import time
+import weakref
+
+import pytest
+
+from a2a_simulator import A2ABus, A2AMessage, BusFull
+from a2a_transport import ProcessAgentPool, TransportError
+
+class _Echo:
+    """Picklable agent for the worker processes: "sleep:<s>", "die", "fail" or anything to echo."""
+    def __init__(self, name):
+        self.name = name
+
+    def act(self, message, session=None):
+        if message.startswith("sleep:"):
+            time.sleep(float(message.split(":", 1)[1]))
+        elif message == "die":
+            os._exit(1)
+        elif message == "fail":
+            raise ValueError("bad input")
+        return f"echo:{message}"
+
+def _wait_until(cond, timeout=5.0):
+    deadline = time.time() + timeout
+    while not cond():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.005)
+
+def _msg(content):
+    return A2AMessage("Caller", "Echo", content)
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**kwargs):
+        pool = ProcessAgentPool(_Echo("Echo"), **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close(timeout=1)
+
+def test_bus_requests_round_trip_through_the_pool(make_pool):
+    bus = A2ABus()
+    bus.attach("Echo", make_pool(workers=2))
+
+    async def main():
+        replies = await asyncio.gather(*(bus.request(_msg(f"m{i}"), timeout=30) for i in range(6)))
+        with pytest.raises(ValueError, match="bad input"):
+            await bus.request(_msg("fail"), timeout=30)
+        return replies
+
+    replies = asyncio.run(main())
+    assert [r.content for r in replies] == [f"echo:m{i}" for i in range(6)]
+    assert all(r.kind == "reply" and r.receiver == "Caller" for r in replies)
+
+def test_submit_raises_bus_full_when_max_pending_are_in_flight(make_pool):
+    pool = make_pool(workers=1, max_pending=2)
+    busy = [pool.submit(_msg("sleep:0.5")) for _ in range(2)]
+    with pytest.raises(BusFull):
+        pool.submit(_msg("late"), timeout=0.05)
+    assert [f.result(10).content for f in busy] == ["echo:sleep:0.5"] * 2
+    # the slots are free again
+    assert pool.call(_msg("after"), timeout=10).content == "echo:after"
+
+def test_a_killed_worker_fails_only_its_in_flight_request(make_pool):
+    pool = make_pool(workers=2)
+    slow = pool.submit(_msg("sleep:0.5"))
+    doomed = pool.submit(_msg("die"))
+    queued = [pool.submit(_msg(f"q{i}")) for i in range(4)]
+    with pytest.raises(TransportError, match="worker lost"):
+        doomed.result(10)
+    assert slow.result(10).content == "echo:sleep:0.5"
+    assert [f.result(10).content for f in queued] == [f"echo:q{i}" for i in range(4)]
+    _wait_until(lambda: pool.alive() == 1)
+    assert pool.failed == 1
+
+def test_request_that_cannot_be_sent_goes_to_another_worker(make_pool):
+    pool = make_pool(workers=2)
+    # the dead worker's dispatcher only notices when it tries to send
+    pool._procs[0].kill()
+    pool._procs[0].join(5)
+    # keeps the live worker busy, so the dead worker's dispatcher takes one of the two
+    futures = [pool.submit(_msg("sleep:0.5")), pool.submit(_msg("hi"))]
+    assert [f.result(10).content for f in futures] == ["echo:sleep:0.5", "echo:hi"]
+    _wait_until(lambda: pool.alive() == 1)
+    assert pool.failed == 0
+
+def test_hung_worker_times_out_and_frees_its_slot(make_pool):
+    pool = make_pool(workers=1, max_pending=1, request_timeout=0.3)
+    with pytest.raises(TransportError, match="did not answer"):
+        pool.call(_msg("sleep:30"), timeout=10)
+    _wait_until(lambda: pool.alive() == 0)
+    # the slot is released, and with no worker left the next request fails at once
+    with pytest.raises(TransportError, match="no Echo workers left"):
+        pool.call(_msg("hi"), timeout=1)
+
+def test_closed_pool_is_not_kept_alive_by_its_atexit_hook():
+    pool = ProcessAgentPool(_Echo("Echo"), workers=1)
+    pool.close(timeout=1)
+    ref = weakref.ref(pool)
+    del pool
+    gc.collect()
+    assert ref() is None
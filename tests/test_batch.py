@@ -0,0 +1,104 @@
+# tests/test_batch.py
+import json
+import multiprocessing
+
+import pytest
+
+import agents
+import batch
+import tool_adapter
+from cache import PersistentLRUCache
+from observability import METRICS
+
+def _write_queries(path, queries):
+    path.write_text("".join(json.dumps({"id": i, "query": q}) + "\n" for i, q in enumerate(queries)))
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+class _Model:
+    def generate_content(self, contents, **kwargs):
+        return _Response(f"response to: {contents[-60:]}")
+
+class _Gateway:
+    default_priority = None
+
+    def call(self, fn, **kwargs):
+        return fn()
+
+def _search(query, *args, **kwargs):
+    return {"query": query, "source": "test",
+            "hits": [{"title": f"{query} paper", "snippet": f"about {query}", "link": "https://example.com/" + query}]}
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="workers inherit the patched modules only when forked")
+def test_batch_workers_persist_every_llm_response(tmp_path, monkeypatch):
+    cache_path = str(tmp_path / "llm_cache.json")
+    # only the end-of-job flush can write the file before the workers exit
+    monkeypatch.setattr(agents, "LLM_CACHE", PersistentLRUCache(cache_path, save_interval=3600))
+    monkeypatch.setattr(agents, "GENAI_AVAILABLE", True)
+    monkeypatch.setattr(agents, "get_model", lambda *a, **k: _Model())
+    monkeypatch.setattr(agents, "get_gateway", lambda: _Gateway())
+    monkeypatch.setattr(tool_adapter, "simple_search", _search)
+    monkeypatch.setenv("SEARCH_CACHE_DISABLED", "1")
+
+    queries = [f"topic {i}" for i in range(8)]
+    input_path = tmp_path / "queries.jsonl"
+    _write_queries(input_path, queries)
+    summary = batch.run_batch(str(input_path), str(tmp_path / "results.jsonl"), workers=4, use_mock=False)
+    assert summary["ok"] == len(queries)
+
+    cached = PersistentLRUCache(cache_path)
+    model = agents.default_model_name()
+    with open(tmp_path / "results.jsonl", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    for rec in records:
+        results = rec["results"]
+        # Summarizer, Critic and Writer responses are cached (Research is not by default)
+        for stage, prompt in (
+                ("summary", f"Summarize the following findings in 3 clear bullets:\n\n{results['findings']}"),
+                ("critique", f"Critically evaluate for factuality and gaps:\n\n{results['summary']}"),
+                ("final_draft", agents.WriterAgent._prompt(
+                    f"\n\nFindings:\n{results['findings']}\n\nSummary:\n{results['summary']}"
+                    f"\n\nCritique:\n{results['critique']}"))):
+            assert cached.get(agents.response_cache_key(model, prompt)) == results[stage], (rec["id"], stage)
+
+def test_batch_merges_worker_metrics_into_the_parent(tmp_path, monkeypatch):
+    monkeypatch.setenv("MOCK_SEARCH_LATENCY", "0")
+    input_path = tmp_path / "queries.jsonl"
+    _write_queries(input_path, [f"metrics topic {i}" for i in range(6)])
+    METRICS.reset()
+    summary = batch.run_batch(str(input_path), str(tmp_path / "results.jsonl"), workers=3, use_mock=True)
+    assert summary["ok"] == 6
+    acts = {h["labels"]["agent"]: h["count"] for h in METRICS.snapshot()["histograms"]
+            if h["name"] == "agent_act_seconds"}
+    assert acts == {"ResearchAgent": 6, "SummarizerAgent": 6, "CriticAgent": 6, "WriterAgent": 6}
+
+class _WriterDownModel:
+    def generate_content(self, contents, **kwargs):
+        if contents.startswith("Write a concise"):
+            raise RuntimeError("503 service unavailable")
+        return _Response(f"response to: {contents[-60:]}")
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="workers inherit the patched modules only when forked")
+def test_degraded_runs_are_retried_on_resume(tmp_path, monkeypatch):
+    monkeypatch.setattr(agents, "LLM_CACHE", PersistentLRUCache(None))
+    monkeypatch.setattr(agents, "GENAI_AVAILABLE", True)
+    monkeypatch.setattr(agents, "get_gateway", lambda: _Gateway())
+    monkeypatch.setattr(tool_adapter, "simple_search", _search)
+    monkeypatch.setenv("SEARCH_CACHE_DISABLED", "1")
+    input_path = tmp_path / "queries.jsonl"
+    output_path = str(tmp_path / "results.jsonl")
+    _write_queries(input_path, ["topic a", "topic b"])
+
+    monkeypatch.setattr(agents, "get_model", lambda *a, **k: _WriterDownModel())
+    summary = batch.run_batch(str(input_path), output_path, workers=2, use_mock=False)
+    assert (summary["ok"], summary["degraded"]) == (0, 2)
+    assert batch._completed_ids(output_path) == set()
+
+    monkeypatch.setattr(agents, "get_model", lambda *a, **k: _Model())
+    summary = batch.run_batch(str(input_path), output_path, workers=2, use_mock=False)
+    assert (summary["skipped"], summary["ok"], summary["degraded"]) == (0, 2, 0)
+    assert batch._completed_ids(output_path) == {job["id"] for job in batch.read_queries(str(input_path))}
@@ -0,0 +1,95 @@
+# tests/test_cache.py
+import json
+import multiprocessing
+
+import cache
+from cache import PersistentLRUCache
+
+class _Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache.time, "time", clock.time)
+    c = PersistentLRUCache(default_ttl=10)
+    c.set("a", 1)
+    c.set("b", 2, ttl=100)
+    c.set("skip", 3, ttl=0)
+    clock.now += 50
+    assert c.get("a") is None
+    assert c.get("b") == 2
+    assert c.get("skip") is None
+    assert c.stats() == {"hits": 1, "misses": 2, "evictions": 0, "size": 1}
+
+def test_least_recently_used_entry_is_evicted_and_values_are_copies():
+    c = PersistentLRUCache(max_entries=2)
+    c.set("a", {"v": [1]})
+    c.set("b", 2)
+    c.get("a")["v"].append(99)  # callers cannot mutate the cached value
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert c.get("a") == {"v": [1]}
+    assert c.stats()["evictions"] == 1
+
+def test_save_merges_with_entries_written_by_another_instance(tmp_path):
+    path = str(tmp_path / "cache.json")
+    a = PersistentLRUCache(path, save_interval=3600)
+    b = PersistentLRUCache(path, save_interval=3600)
+    a.set("shared", "from a")
+    a.set("only_a", 1)
+    a.save()
+    b.set("shared", "from b")
+    b.set("only_b", 2)
+    b.save()
+    fresh = PersistentLRUCache(path)
+    assert fresh.get("only_a") == 1 and fresh.get("only_b") == 2
+    # the last writer wins for a key both hold
+    assert fresh.get("shared") == "from b"
+
+def test_delete_and_clear_are_carried_into_the_file(tmp_path):
+    path = str(tmp_path / "cache.json")
+    a = PersistentLRUCache(path, save_interval=3600)
+    a.set("x", 1)
+    a.set("y", 2)
+    a.save()
+    b = PersistentLRUCache(path, save_interval=3600)
+    b.delete("x")
+    b.save()
+    assert [row[0] for row in json.load(open(path, encoding="utf-8"))] == ["y"]
+    b.clear()
+    assert json.load(open(path, encoding="utf-8")) == []
+
+def test_expired_rows_are_dropped_on_load_and_merge(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache.time, "time", clock.time)
+    path = str(tmp_path / "cache.json")
+    a = PersistentLRUCache(path, default_ttl=10, save_interval=3600)
+    a.set("old", 1)
+    a.save()
+    clock.now += 20
+    b = PersistentLRUCache(path, save_interval=3600)
+    assert b.get("old") is None
+    b.set("new", 2)
+    b.save()
+    assert [row[0] for row in json.load(open(path, encoding="utf-8"))] == ["new"]
+
+def _writer(path, worker, n):
+    c = PersistentLRUCache(path, save_interval=0)
+    for i in range(n):
+        c.set(f"w{worker}-{i}", i)
+
+def test_processes_sharing_one_file_keep_each_others_entries(tmp_path):
+    path = str(tmp_path / "cache.json")
+    workers, per_worker = 4, 20
+    procs = [multiprocessing.Process(target=_writer, args=(path, w, per_worker)) for w in range(workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(timeout=60)
+        assert p.exitcode == 0
+    keys = {row[0] for row in json.load(open(path, encoding="utf-8"))}
+    assert keys == {f"w{w}-{i}" for w in range(workers) for i in range(per_worker)}
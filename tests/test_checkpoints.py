@@ -0,0 +1,125 @@
+# tests/test_checkpoints.py
+import asyncio
+
+import pytest
+
+import agents
+from agents import CriticAgent, ResearchAgent, SummarizerAgent, WriterAgent
+from orchestrator import Orchestrator
+from tool_adapter import Tool
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+class _FlakyModel:
+    """Stub Gemini model: the Writer prompt fails (or, streamed, breaks after one chunk) while `down`."""
+    def __init__(self):
+        self.down = True
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        writer = contents.startswith("Write a concise")
+        if stream:
+            return self._stream(writer)
+        if writer and self.down:
+            raise RuntimeError("503 service unavailable")
+        return _Response(("draft: " if writer else "llm: ") + contents[-40:])
+
+    def _stream(self, writer):
+        yield _Response("draft part 1. ")
+        if self.down:
+            raise RuntimeError("stream reset")
+        yield _Response("draft part 2.")
+
+class _Gateway:
+    def call(self, fn, **kwargs):
+        return fn()
+
+@pytest.fixture
+def model(monkeypatch):
+    model = _FlakyModel()
+    monkeypatch.setattr(agents, "GENAI_AVAILABLE", True)
+    monkeypatch.setattr(agents, "get_model", lambda *a, **k: model)
+    monkeypatch.setattr(agents, "get_gateway", lambda: _Gateway())
+    monkeypatch.setenv("LLM_CACHE_DISABLED", "1")
+    return model
+
+def _orchestrator(tmp_path, search=None):
+    search = search or (lambda q: {"query": q, "source": "test", "hits": [{"title": q, "snippet": "s", "link": "l"}]})
+    return Orchestrator(agents=[
+        ResearchAgent("ResearchAgent", tools={"search": Tool("web_search", search)}, use_mock=False),
+        SummarizerAgent("SummarizerAgent", use_mock=False),
+        CriticAgent("CriticAgent", use_mock=False),
+        WriterAgent("WriterAgent", use_mock=False),
+    ], use_mock=False, checkpoint_path=str(tmp_path / "checkpoints.jsonl"))
+
+def _stages(events, flag):
+    return [e["stage"] for e in events if e.get(flag)]
+
+def test_fallback_draft_is_not_checkpointed(tmp_path, model):
+    orch = _orchestrator(tmp_path)
+    first = orch.run_pipeline("s1", "qubits")
+    assert first["final_draft"].startswith("Draft Brief:")
+    assert first["degraded"] == ["final_draft"]
+
+    model.down = False
+    events = []
+    second = orch.run_pipeline("s1", "qubits", on_stage=events.append)
+    assert second["final_draft"].startswith("draft: ")
+    assert "degraded" not in second
+    assert _stages(events, "checkpoint") == ["findings", "summary", "critique"]
+
+def test_fallback_draft_is_not_checkpointed_async(tmp_path, model):
+    orch = _orchestrator(tmp_path)
+    first = asyncio.run(orch.arun_pipeline("s1", "qubits"))
+    assert first["degraded"] == ["final_draft"]
+
+    model.down = False
+    second = asyncio.run(orch.arun_pipeline("s1", "qubits"))
+    assert second["final_draft"].startswith("draft: ")
+    assert "degraded" not in second
+
+def test_cut_short_stream_is_not_checkpointed(tmp_path, model):
+    orch = _orchestrator(tmp_path)
+    events = list(orch.iter_pipeline("s1", "qubits", stream=True))
+    assert events[-1]["results"]["final_draft"] == "draft part 1. "
+    assert _stages(events, "degraded") == ["final_draft"]
+
+    model.down = False
+    events = list(orch.iter_pipeline("s1", "qubits", stream=True))
+    assert events[-1]["results"]["final_draft"] == "draft part 1. draft part 2."
+    assert not _stages(events, "degraded")
+    assert _stages(events, "checkpoint") == ["findings", "summary", "critique"]
+
+def test_search_error_findings_are_retried(tmp_path, model):
+    calls = []
+
+    def search(q):
+        calls.append(q)
+        if len(calls) == 1:
+            return {"query": q, "source": "test", "hits": [], "error": "quota exceeded"}
+        return {"query": q, "source": "test", "hits": [{"title": "real", "snippet": "hit", "link": "l"}]}
+
+    model.down = False
+    orch = _orchestrator(tmp_path, search)
+    first = orch.run_pipeline("s1", "qubits")
+    assert first["findings"].startswith("[search-error]")
+    assert first["degraded"] == ["findings"]
+
+    second = orch.run_pipeline("s1", "qubits")
+    assert second["findings"] == "real - hit"
+    assert "degraded" not in second
+
+def test_input_hash_covers_model_and_generation_config(monkeypatch):
+    from checkpoints import input_hash
+
+    real, mock = WriterAgent("WriterAgent", use_mock=False), WriterAgent("WriterAgent", use_mock=True)
+    monkeypatch.setenv("GENAI_MODEL", "models/model-a")
+    before = input_hash("final_draft", real, "msg"), input_hash("final_draft", mock, "msg")
+    monkeypatch.setattr(WriterAgent, "GENERATION_CONFIG", {"temperature": 0.2})
+    assert input_hash("final_draft", real, "msg") != before[0]
+    monkeypatch.setattr(WriterAgent, "GENERATION_CONFIG", None)
+    monkeypatch.setenv("GENAI_MODEL", "models/model-b")
+    # a different model re-runs real stages; mock output does not depend on it
+    assert input_hash("final_draft", real, "msg") != before[0]
+    assert input_hash("final_draft", mock, "msg") == before[1]
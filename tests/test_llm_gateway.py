@@ -0,0 +1,106 @@
+# tests/test_llm_gateway.py
+import threading
+import time
+
+import pytest
+
+from llm_gateway import PRIORITY_BATCH, PRIORITY_INTERACTIVE, LLMGateway
+
+class _Gate:
+    """Quota bucket that hands out exactly the slots released with open()."""
+    def __init__(self):
+        self.slots = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        with self.lock:
+            if self.slots:
+                self.slots -= 1
+                return 0.0
+            return 0.01
+
+    def open(self, n=1):
+        with self.lock:
+            self.slots += n
+
+def _wait_until(cond, timeout=5.0):
+    deadline = time.time() + timeout
+    while not cond():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.005)
+
+def _queued(gateway):
+    return sum(st["queue_depth"] for st in gateway.stats().values())
+
+def _run_in_order(gateway, requests):
+    """Queue `requests` ((label, priority, session) in arrival order) behind a closed gate, then drain it."""
+    gate = _Gate()
+    gateway.set_model_limiter("m", gate)
+    served = []
+    threads = []
+    for label, priority, session in requests:
+        t = threading.Thread(target=gateway.call, args=(lambda label=label: served.append(label),),
+                             kwargs={"model": "m", "priority": priority, "session_id": session})
+        t.start()
+        threads.append(t)
+        n = len(threads)
+        _wait_until(lambda: _queued(gateway) == n)
+    for _ in requests:
+        done = len(served)
+        gate.open()
+        _wait_until(lambda: len(served) == done + 1)
+    for t in threads:
+        t.join(timeout=5)
+    return served
+
+def test_interactive_requests_go_ahead_of_queued_batch_requests():
+    gateway = LLMGateway()
+    served = _run_in_order(gateway, [
+        ("b1", PRIORITY_BATCH, "s1"), ("b2", PRIORITY_BATCH, "s1"),
+        ("i1", PRIORITY_INTERACTIVE, "ui"), ("b3", PRIORITY_BATCH, "s1"), ("i2", PRIORITY_INTERACTIVE, "ui"),
+    ])
+    # b1 was at the head first but had no slot yet: priority decides once slots free up
+    assert served == ["i1", "i2", "b1", "b2", "b3"]
+    stats = gateway.stats()
+    assert stats["interactive"]["requests"] == 2 and stats["batch"]["requests"] == 3
+    assert stats["batch"]["queue_depth"] == 0
+
+def test_sessions_in_one_priority_class_are_served_round_robin():
+    gateway = LLMGateway()
+    served = _run_in_order(gateway, [
+        ("a1", PRIORITY_BATCH, "a"), ("a2", PRIORITY_BATCH, "a"), ("a3", PRIORITY_BATCH, "a"),
+        ("b1", PRIORITY_BATCH, "b"), ("c1", PRIORITY_BATCH, "c"), ("b2", PRIORITY_BATCH, "b"),
+    ])
+    assert served == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+def test_retries_are_queued_like_new_requests():
+    gateway = LLMGateway(initial_backoff=0.0)
+    gate = _Gate()
+    gate.open(10)
+    gateway.set_model_limiter("m", gate)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("503 service unavailable")
+        return "ok"
+
+    assert gateway.call(flaky, model="m", max_attempts=3) == "ok"
+    # every attempt took its own quota slot
+    assert len(attempts) == 3 and gate.slots == 7
+
+def test_non_retryable_errors_are_raised_at_once():
+    gateway = LLMGateway(initial_backoff=0.0)
+    gate = _Gate()
+    gate.open(10)
+    gateway.set_model_limiter("m", gate)
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        gateway.call(broken, model="m", max_attempts=3)
+    assert len(attempts) == 1
@@ -0,0 +1,83 @@
+# tests/test_log_writer.py
+import gzip
+import os
+import threading
+
+import pytest
+
+from log_writer import BackgroundLogWriter
+
+def _lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return f.read().splitlines()
+
+def _writer(tmp_path, **kwargs):
+    kwargs.setdefault("flush_interval", 60)
+    return BackgroundLogWriter(str(tmp_path / "app.log"), **kwargs)
+
+def test_lines_are_batched_and_written_on_flush(tmp_path):
+    w = _writer(tmp_path, batch_size=1000)
+    for i in range(10):
+        w.write(f"line {i}")
+    assert w.flush(timeout=5)
+    assert _lines(w.path) == [f"line {i}" for i in range(10)]
+    assert w.stats()["batches"] == 1 and w.stats()["written"] == 10
+    w.close()
+
+def test_rotation_keeps_backup_count_files(tmp_path):
+    # each batch is 10 lines of 9 bytes; the file rolls over before it would pass 200
+    w = _writer(tmp_path, batch_size=10, max_bytes=200, backup_count=2)
+    for batch in range(6):
+        for i in range(10):
+            w.write(f"b{batch}-l{i}...")
+        w.flush(timeout=5)
+    w.close()
+    assert os.path.exists(w.path + ".1") and os.path.exists(w.path + ".2")
+    assert not os.path.exists(w.path + ".3")
+    assert w.stats()["rotations"] == 2
+    # newest lines in the live file, older batches in .1 then .2, no batch split across files
+    assert [len(_lines(p)) for p in (w.path, w.path + ".1", w.path + ".2")] == [20, 20, 20]
+    assert _lines(w.path)[0].startswith("b4") and _lines(w.path + ".2")[0].startswith("b0")
+
+def test_rotation_can_gzip_backups(tmp_path):
+    w = _writer(tmp_path, batch_size=5, max_bytes=60, backup_count=3, compress=True)
+    for i in range(10):
+        w.write(f"line {i:04d}")
+        if i % 5 == 4:
+            w.flush(timeout=5)
+    w.close()
+    assert _lines(w.path + ".1.gz") == [f"line {i:04d}" for i in range(5)]
+    assert _lines(w.path) == [f"line {i:04d}" for i in range(5, 10)]
+
+def test_drop_policy_counts_lines_it_cannot_queue(tmp_path):
+    w = _writer(tmp_path, max_queue=5)
+    busy, release = threading.Event(), threading.Event()
+    real_write = w._write_batch
+
+    def slow_write(lines):
+        busy.set()
+        release.wait(5)
+        real_write(lines)
+
+    # park the writer thread in a write so nothing drains the queue
+    w._write_batch = slow_write
+    w.write("first")
+    w.flush(timeout=0)
+    assert busy.wait(5)
+    accepted = [w.write(f"line {i}") for i in range(20)]
+    assert accepted.count(True) == 5 and w.stats()["dropped"] == 15
+    release.set()
+    w.close()
+    assert _lines(w.path) == ["first"] + [f"line {i}" for i in range(5)]
+
+def test_unknown_policy_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        _writer(tmp_path, policy="spill")
+
+def test_closed_writer_refuses_lines_and_keeps_what_was_queued(tmp_path):
+    w = _writer(tmp_path)
+    w.write("kept")
+    w.close()
+    assert w.write("late") is False
+    assert _lines(w.path) == ["kept"]
@@ -0,0 +1,159 @@
+# tests/test_memory.py
+import json
+import os
+
+from memory import MemoryRecord, MemoryStore
+
+def _store(tmp_path, **kwargs):
+    kwargs.setdefault("fsync", "never")
+    kwargs.setdefault("background_compaction", False)
+    return MemoryStore(str(tmp_path / "memory.json"), **kwargs)
+
+def _segments(store):
+    return store._segment_names()
+
+def test_append_rolls_segments_and_compaction_folds_sealed_ones(tmp_path):
+    store = _store(tmp_path, segment_max_bytes=200)
+    for i in range(10):
+        store.append({"session_id": f"s{i}", "timestamp": i, "query": f"q{i}", "text": "x" * 100})
+    names = _segments(store)
+    assert len(names) > 1
+
+    store.compact()
+    # the active segment stays behind for appenders; everything sealed is in the snapshot
+    assert _segments(store) == names[-1:]
+    with open(store.path, encoding="utf-8") as f:
+        snapshot = json.load(f)
+    assert [r["session_id"] for r in snapshot] == [f"s{i}" for i in range(len(snapshot))]
+
+    reopened = _store(tmp_path)
+    assert [r["session_id"] for r in reopened.store] == [f"s{i}" for i in range(10)]
+
+def test_compact_include_active_leaves_no_segments(tmp_path):
+    store = _store(tmp_path)
+    for i in range(3):
+        store.append({"session_id": f"s{i}"})
+    store.compact(include_active=True)
+    assert _segments(store) == []
+    # one record per line, still a valid JSON array
+    with open(store.path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "[" and lines[-1] == "]" and len(lines) == 5
+    assert [r["session_id"] for r in _store(tmp_path).store] == ["s0", "s1", "s2"]
+
+def test_background_compaction_after_enough_sealed_segments(tmp_path):
+    store = _store(tmp_path, segment_max_bytes=1, compact_after_segments=2, background_compaction=True)
+    for i in range(4):
+        store.append({"session_id": f"s{i}"})
+    store._compaction_thread.join(timeout=10)
+    # the third append sealed two segments and started a compaction of them
+    assert "00000001.jsonl" not in _segments(store) and "00000002.jsonl" not in _segments(store)
+    assert [r["session_id"] for r in _store(tmp_path).store] == ["s0", "s1", "s2", "s3"]
+
+def test_appends_from_another_store_survive_compaction(tmp_path):
+    a = _store(tmp_path, segment_max_bytes=1)
+    b = _store(tmp_path, segment_max_bytes=1)
+    for i in range(3):
+        a.append({"session_id": f"a{i}"})
+        b.append({"session_id": f"b{i}"})
+    a.compact()
+    b.append({"session_id": "b3"})
+    b.refresh()
+    assert sorted(r["session_id"] for r in b.store) == ["a0", "a1", "a2", "b0", "b1", "b2", "b3"]
+    assert os.path.exists(a.path)
+
+def _history(store):
+    store.append({"session_id": "a", "timestamp": 100, "query": "Quantum  Computing – 2024"})
+    store.append({"session_id": "b", "timestamp": 50, "query": "other"})
+    store.append({"session_id": "a", "timestamp": 200, "query": "quantum computing - 2024"})
+
+def test_indexes_answer_session_query_and_time_lookups(tmp_path):
+    store = _store(tmp_path)
+    _history(store)
+    assert [r["timestamp"] for r in store.find_by_session("a")] == [100, 200]
+    assert store.find_last_by_session("a")["timestamp"] == 200
+    assert store.find_last_by_session("missing") is None
+    # case, dashes and whitespace are normalized
+    assert [r["timestamp"] for r in store.find_by_query("QUANTUM computing — 2024")] == [100, 200]
+    assert store.find_last_by_query("quantum computing - 2024")["timestamp"] == 200
+    # time range comes back oldest first even though records were appended out of order
+    assert [r["timestamp"] for r in store.find_by_time_range()] == [50, 100, 200]
+    assert [r["timestamp"] for r in store.find_by_time_range(60, 200)] == [100, 200]
+    assert [r["timestamp"] for r in store.find_by_time_range(end=99)] == [50]
+    assert sorted(store.session_ids()) == ["a", "b"]
+
+def test_indexes_are_kept_up_to_date_by_append_and_rebuilt_on_load(tmp_path):
+    store = _store(tmp_path)
+    _history(store)
+    store.find_by_session("a")  # build the indexes, then keep appending
+    store.append({"session_id": "a", "timestamp": 75, "query": "late"})
+    assert [r["timestamp"] for r in store.find_by_session("a")] == [100, 200, 75]
+    assert [r["timestamp"] for r in store.find_by_time_range(60, 100)] == [75, 100]
+
+    reopened = _store(tmp_path)
+    assert [r["timestamp"] for r in reopened.find_by_session("a")] == [100, 200, 75]
+    assert reopened.find_last_by_query("LATE")["session_id"] == "a"
+
+def test_lazy_store_reads_records_on_demand_and_pages(tmp_path):
+    eager = _store(tmp_path)
+    for i in range(5):
+        eager.append({"session_id": f"s{i}", "timestamp": i, "query": f"q{i}", "text": f"t{i}"})
+    eager.compact(include_active=True)
+    eager.append({"session_id": "s5", "timestamp": 5, "query": "q5", "text": "t5"})
+
+    lazy = _store(tmp_path, lazy=True)
+    assert len(lazy.store) == 6
+    assert lazy.store[-1]["text"] == "t5" and lazy.store[0].to_dict()["text"] == "t0"
+    lazy.append({"session_id": "s6", "timestamp": 6, "query": "q6", "text": "t6"})
+    assert [r["session_id"] for r in lazy.iter_records(start=5)] == ["s5", "s6"]
+    assert [r["session_id"] for r in lazy.iter_records(start=1, reverse=True)] == ["s5", "s4", "s3", "s2", "s1", "s0"]
+    assert [r["session_id"] for r in lazy.page(offset=2, limit=3)] == ["s2", "s3", "s4"]
+    assert [r["session_id"] for r in lazy.page(offset=0, limit=2, reverse=True)] == ["s6", "s5"]
+    assert lazy.page(offset=10) == []
+    assert lazy.find_last_by_query("Q3")["text"] == "t3"
+
+def test_memory_record_parses_head_fields_without_full_decode():
+    big = "x" * 10000
+    rec = MemoryRecord(json.dumps({"session_id": "s", "timestamp": 1.5, "query": "q", "draft": big}).encode())
+    assert (rec["session_id"], rec["timestamp"], rec["query"]) == ("s", 1.5, "q")
+    assert rec._full is None
+    assert rec["draft"] == big and rec._full is not None
+
+    # lookup fields out of order or missing: falls back to decoding the whole line
+    rec = MemoryRecord(json.dumps({"draft": big, "query": "q2", "session_id": "s2"}).encode())
+    assert rec["query"] == "q2" and rec.get("timestamp") is None
+    # optional head fields are read from the head when they lead the line
+    rec = MemoryRecord(json.dumps({"session_id": "s", "timestamp": 1, "query": "q", "reuse_key": "mock",
+                                   "draft": big}).encode())
+    assert rec.head() == {"session_id": "s", "timestamp": 1, "query": "q", "reuse_key": "mock"}
+    assert rec["reuse_key"] == "mock" and rec._full is None
+    # a line that does not parse reads as an empty record rather than raising
+    assert MemoryRecord(b'{"session_id": "s", "tim').get("session_id") is None
+
+def test_lazy_open_converts_snapshot_and_keeps_backup(tmp_path):
+    path = tmp_path / "memory.json"
+    # an append onto an empty array left '[]' in front of the first record
+    original = "[]" + "\n".join(json.dumps({"session_id": f"s{i}"}) for i in range(3)) + "\n"
+    path.write_text(original, encoding="utf-8")
+    lazy = _store(tmp_path, lazy=True)
+    assert [r["session_id"] for r in lazy.store] == ["s0", "s1", "s2"]
+    assert (tmp_path / "memory.json.bak").read_text(encoding="utf-8") == original
+    assert [r["session_id"] for r in _store(tmp_path).store] == ["s0", "s1", "s2"]
+
+def test_lazy_open_leaves_unparseable_snapshot_alone(tmp_path):
+    path = tmp_path / "memory.json"
+    original = '[{"session_id": "s0"},\n  {"session_id": "s1", "que\n]'
+    path.write_text(original, encoding="utf-8")
+    _store(tmp_path, lazy=True)
+    assert path.read_text(encoding="utf-8") == original
+    assert not (tmp_path / "memory.json.bak").exists()
+
+def test_append_after_torn_write_starts_a_new_line(tmp_path):
+    store = _store(tmp_path)
+    store.append({"session_id": "s0"})
+    segment = os.path.join(store.log_dir, _segments(store)[-1])
+    with open(segment, "ab") as f:
+        f.write(b'{"session_id": "torn", "que')
+    store.append({"session_id": "s1"})
+    assert [r["session_id"] for r in _store(tmp_path).store] == ["s0", "s1"]
+    assert [r["session_id"] for r in _store(tmp_path, lazy=True).store] == ["s0", "s1"]
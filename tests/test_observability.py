@@ -0,0 +1,150 @@
+# tests/test_observability.py
+import asyncio
+import contextvars
+import json
+import multiprocessing
+import threading
+import urllib.request
+
+import pytest
+
+import observability
+from observability import MetricsRegistry, current_span, read_last_trace, span, traced, trace_tree
+
+def test_prometheus_text_for_counters_gauges_and_histograms():
+    m = MetricsRegistry(path=None, buckets=(0.1, 1.0))
+    m.inc("requests_total", 2, {"agent": "Writer", "note": 'say "hi"\n'})
+    m.set_gauge("queue_depth", 3)
+    for v in (0.05, 0.5, 5.0):
+        m.observe("latency_seconds", v, {"agent": "Writer"})
+    lines = m.to_prometheus().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    # label values are escaped
+    assert 'requests_total{agent="Writer",note="say \\"hi\\"\\n"} 2.0' in lines
+    assert "# TYPE queue_depth gauge" in lines and "queue_depth 3.0" in lines
+    assert "# TYPE latency_seconds histogram" in lines
+    # buckets are cumulative and end with +Inf == count
+    assert 'latency_seconds_bucket{agent="Writer",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{agent="Writer",le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{agent="Writer",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{agent="Writer"} 3' in lines
+    assert 'latency_seconds_sum{agent="Writer"} 5.55' in lines
+
+def test_serve_prometheus_exposes_metrics_over_http():
+    m = MetricsRegistry(path=None)
+    m.inc("scraped_total")
+    server = m.serve_prometheus(port=0)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as resp:
+            assert resp.headers["Content-Type"].startswith("text/plain")
+            assert "scraped_total 1.0" in resp.read().decode()
+    finally:
+        server.shutdown()
+
+def _totals(path):
+    with open(path, encoding="utf-8") as f:
+        snap = json.load(f)
+    counters = {(c["name"], tuple(sorted(c["labels"].items()))): c["value"] for c in snap["counters"]}
+    hists = {h["name"]: h for h in snap["histograms"]}
+    return counters, hists
+
+def test_flush_merges_registries_sharing_a_file(tmp_path):
+    path = str(tmp_path / "metrics.json")
+    a = MetricsRegistry(path=path, flush_interval=0)
+    b = MetricsRegistry(path=path, flush_interval=0)
+    a.inc("runs_total", 2)
+    a.observe("latency_seconds", 1.0)
+    a.flush()
+    b.inc("runs_total", 3)
+    b.inc("other_total")
+    b.observe("latency_seconds", 3.0)
+    b.flush()
+    # only what changed since a's last flush is added again
+    a.inc("runs_total", 1)
+    a.flush()
+    counters, hists = _totals(path)
+    assert counters[("runs_total", ())] == 6
+    assert counters[("other_total", ())] == 1
+    assert hists["latency_seconds"]["count"] == 2 and hists["latency_seconds"]["sum"] == 4.0
+    # the process-local view is unchanged by flushing
+    assert a.snapshot()["counters"][0]["value"] == 3
+
+def _flushing_worker(path, worker, n):
+    m = MetricsRegistry(path=path, flush_interval=0)
+    for i in range(n):
+        m.inc("work_total", 1, {"kind": "job"})
+        m.observe("work_seconds", 0.01 * worker)
+        m.flush()
+
+def test_processes_flushing_one_file_lose_no_counts(tmp_path):
+    path = str(tmp_path / "metrics.json")
+    workers, per_worker = 4, 25
+    procs = [multiprocessing.Process(target=_flushing_worker, args=(path, w, per_worker)) for w in range(workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(timeout=60)
+        assert p.exitcode == 0
+    counters, hists = _totals(path)
+    assert counters[("work_total", (("kind", "job"),))] == workers * per_worker
+    assert hists["work_seconds"]["count"] == workers * per_worker
+
+def test_spans_nest_share_a_trace_and_record_errors():
+    with span("root", query="q") as root:
+        assert current_span() is root
+        with span("child") as child:
+            pass
+        with pytest.raises(ValueError):
+            with span("failing") as failing:
+                raise ValueError("boom")
+    assert current_span() is None
+    assert child.parent_id == root.span_id and child.trace_id == root.trace_id
+    assert failing.status == "error" and failing.error == "ValueError: boom"
+    assert root.status == "ok" and root.attributes == {"query": "q"}
+    assert root.duration_s >= child.duration_s >= 0
+
+def test_spans_follow_asyncio_tasks_and_to_thread_but_not_plain_threads():
+    seen = {}
+
+    @traced("work")
+    async def work(label):
+        seen[label] = current_span()
+
+    def in_thread(label):
+        seen[label] = current_span().span_id if current_span() else None
+
+    async def main():
+        with span("root") as root:
+            await asyncio.gather(work("a"), work("b"))
+            await asyncio.to_thread(in_thread, "to_thread")
+            plain = threading.Thread(target=in_thread, args=("plain",))
+            plain.start()
+            plain.join()
+            copied = threading.Thread(target=contextvars.copy_context().run, args=(in_thread, "copied"))
+            copied.start()
+            copied.join()
+        return root
+
+    root = asyncio.run(main())
+    assert seen["a"].parent_id == seen["b"].parent_id == root.span_id
+    assert seen["a"].name == "work"
+    assert seen["to_thread"] == seen["copied"] == root.span_id
+    assert seen["plain"] is None
+
+def test_finished_spans_are_written_and_read_back_as_a_tree(tmp_path, monkeypatch):
+    path = str(tmp_path / "traces.jsonl")
+    monkeypatch.setattr(observability, "TRACING_ENABLED", True)
+    monkeypatch.setattr(observability, "TRACE_PATH", path)
+    with span("old trace"):
+        pass
+    with span("pipeline") as root:
+        with span("stage", stage="findings"):
+            with span("tool.call"):
+                pass
+        with span("stage", stage="summary"):
+            pass
+    spans = read_last_trace(path)
+    assert {s["trace_id"] for s in spans} == {root.trace_id}
+    tree = [(depth, s["span"], s["attributes"].get("stage")) for depth, s in trace_tree(spans)]
+    assert tree == [(0, "pipeline", None), (1, "stage", "findings"), (2, "tool.call", None), (1, "stage", "summary")]
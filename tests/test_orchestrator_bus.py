@@ -0,0 +1,61 @@
+# tests/test_orchestrator_bus.py
+import asyncio
+
+import pytest
+
+from a2a_simulator import A2ABus
+from agents import BaseAgent
+from orchestrator import Orchestrator
+from pipeline import Pipeline, Stage
+
+class _Tagged(BaseAgent):
+    def __init__(self, name, tag, delay=0.0):
+        super().__init__(name)
+        self.tag = tag
+        self.delay = delay
+
+    def act(self, message, session=None):
+        return {"role": self.name, "content": f"{self.tag}:{message}"}
+
+    async def aact(self, message, session=None):
+        await asyncio.sleep(self.delay)
+        return self.act(message, session)
+
+_ONE_STAGE = Pipeline([Stage("final_draft", "WriterAgent")])
+
+def test_orchestrators_sharing_a_bus_keep_their_own_agents():
+    bus = A2ABus()
+    a = Orchestrator(agents=[_Tagged("WriterAgent", "a", 0.01)], bus=bus, pipeline=_ONE_STAGE)
+    b = Orchestrator(agents=[_Tagged("WriterAgent", "b", 0.01)], bus=bus, pipeline=_ONE_STAGE)
+
+    async def main():
+        runs = [o.arun_pipeline(f"{tag}-{i}", f"q{i}") for i in range(10) for tag, o in (("a", a), ("b", b))]
+        out = await asyncio.gather(*runs)
+        await a.stop_workers()
+        await b.stop_workers()
+        return out
+
+    results = asyncio.run(main())
+    assert [r["final_draft"] for r in results] == [f"{tag}:q{i}" for i in range(10) for tag in ("a", "b")]
+
+def test_stage_request_fails_when_its_worker_stops():
+    orch = Orchestrator(agents=[_Tagged("WriterAgent", "a", 30)], pipeline=_ONE_STAGE, request_timeout=5)
+
+    async def main():
+        run = asyncio.ensure_future(orch.arun_pipeline("s", "q"))
+        await asyncio.sleep(0.05)
+        await orch.stop_workers()
+        with pytest.raises(RuntimeError, match="worker stopped"):
+            await asyncio.wait_for(run, 1)
+
+    asyncio.run(main())
+
+def test_stage_request_times_out_without_a_reply():
+    orch = Orchestrator(agents=[_Tagged("WriterAgent", "a", 30)], pipeline=_ONE_STAGE, request_timeout=0.1)
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(orch.arun_pipeline("s", "q"), 2)
+        await orch.stop_workers()
+
+    asyncio.run(main())
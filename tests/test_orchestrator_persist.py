@@ -0,0 +1,67 @@
+# tests/test_orchestrator_persist.py
+import threading
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import memory
+from orchestrator import Orchestrator
+
+def test_concurrent_persist_links_each_query_to_its_own_record(tmp_path):
+    orch = Orchestrator(agents=[], memory_path=str(tmp_path / "memory.json"), reuse_threshold=0.99)
+    # build the semantic index first so every _persist below goes through index.add
+    orch._get_semantic_index()
+    threads, per_thread = 8, 50
+
+    def persist(t):
+        for i in range(per_thread):
+            q = f"query thread {t} item {i}"
+            orch._persist(f"s-{t}-{i}", q, {"findings": f"findings for {q}", "final_draft": f"draft for {q}"})
+
+    workers = [threading.Thread(target=persist, args=(t,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    index = orch._get_semantic_index()
+    store = orch._get_memory().store
+    assert len(index) == len(store) == threads * per_thread
+    positions = list(index._payloads)
+    assert len(set(positions)) == len(positions)
+    for t in range(threads):
+        for i in range(per_thread):
+            q = f"query thread {t} item {i}"
+            score, pos = index.best_match(q)
+            assert store[pos]["query"] == q
+            assert store[pos]["draft"] == f"draft for {q}"
+
+class _Agent:
+    def __init__(self, use_mock):
+        self.name = "ResearchAgent"
+        self.use_mock = use_mock
+
+def test_reuse_is_keyed_by_mode_and_skips_reused_or_degraded_records(tmp_path, monkeypatch):
+    path = str(tmp_path / "memory.json")
+    mock = Orchestrator(agents=[_Agent(True)], memory_path=path, reuse_threshold=0.9)
+    mock._persist("s1", "quantum computing breakthroughs", {"findings": "mock findings"})
+    mock._persist("s2", "battery chemistry advances", {"findings": "f", "degraded": ["findings"]})
+    mock._persist("s3", "fusion energy milestones", {"findings": "f", "reused_from": {"session_id": "s0"}})
+
+    monkeypatch.setattr(memory.MemoryRecord, "_decode", lambda self: pytest.fail("full decode while indexing"))
+    fresh = Orchestrator(agents=[_Agent(True)], memory_path=path, reuse_threshold=0.9)
+    assert len(fresh._get_semantic_index()) == 1
+    monkeypatch.undo()
+    mode, prior, _ = fresh._reuse_lookup("quantum computing breakthroughs")
+    assert mode == "full" and prior["findings"] == "mock findings"
+    assert fresh._reuse_lookup("battery chemistry advances")[0] is None
+
+    # mock results are never handed to a real-mode run, nor one model's results to another
+    monkeypatch.setenv("GENAI_MODEL", "models/model-a")
+    real = Orchestrator(agents=[_Agent(False)], memory_path=path, reuse_threshold=0.9)
+    assert real._reuse_lookup("quantum computing breakthroughs")[0] is None
+    real._persist("s4", "quantum computing breakthroughs", {"findings": "real findings"})
+    assert real._reuse_lookup("quantum computing breakthroughs")[1]["findings"] == "real findings"
+    monkeypatch.setenv("GENAI_MODEL", "models/model-b")
+    assert real._reuse_lookup("quantum computing breakthroughs")[0] is None
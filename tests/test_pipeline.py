@@ -0,0 +1,144 @@
+# tests/test_pipeline.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from pipeline import PARALLEL_REVIEW_PIPELINE, Pipeline, Stage, arun, run_iter
+
+class _Agent:
+    def __init__(self, name):
+        self.name = name
+
+def _diamond(**critique):
+    return Pipeline([
+        Stage("final_draft", "Writer", inputs=("findings", "summary", "critique")),
+        Stage("summary", "Summarizer", inputs=("findings",)),
+        Stage("critique", "Critic", inputs=("findings",), **critique),
+        Stage("findings", "Research"),
+    ])
+
+def test_stages_are_ordered_so_inputs_come_first():
+    p = _diamond()
+    assert p.names.index("findings") == 0 and p.names[-1] == "final_draft"
+    assert sorted(p.dependents["findings"]) == ["critique", "final_draft", "summary"]
+    assert p.stream_stage == "final_draft"
+
+@pytest.mark.parametrize("stages, error", [
+    ([Stage("a", "A"), Stage("a", "B")], "duplicate stage 'a'"),
+    ([Stage("a", "A", inputs=("missing",))], "unknown inputs"),
+    ([Stage("a", "A", inputs=("b",)), Stage("b", "B", inputs=("a",))], "cycle in pipeline: a -> b -> a"),
+])
+def test_invalid_graphs_are_rejected(stages, error):
+    with pytest.raises(ValueError, match=error):
+        Pipeline(stages)
+
+def test_resolve_prefers_exact_names_over_substrings():
+    agents = [_Agent("ResearchAgentV2"), _Agent("Research"), _Agent("SummarizerAgent"), _Agent("WriterAgent")]
+    resolved = _diamond().resolve(agents)
+    assert resolved["findings"].name == "Research"
+    assert resolved["summary"].name == "SummarizerAgent"
+    assert resolved["critique"] is None
+
+def test_stage_messages_follow_their_inputs():
+    p = _diamond()
+    assert p.by_name["findings"].message("q", {}) == "q"
+    assert p.by_name["summary"].message("q", {"findings": "F"}) == "F"
+    joined = p.by_name["final_draft"].message("q", {"findings": "F", "summary": "S", "critique": "C"})
+    assert joined == "\n\nFindings:\nF\n\nSummary:\nS\n\nCritique:\nC"
+    custom = Stage("x", "X", inputs=("findings",), build=lambda query, inputs: f"{query}|{inputs['findings']}")
+    assert custom.message("q", {"findings": "F"}) == "q|F"
+
+def _recording_stage(log, delays=None, fail=()):
+    """run_stage for run_iter: returns "stage(message)" after an optional delay, records the thread."""
+    def run_stage(stage, message):
+        log.append((stage.name, threading.current_thread().name))
+        time.sleep((delays or {}).get(stage.name, 0))
+        if stage.name in fail:
+            raise RuntimeError(f"{stage.name} failed")
+        return f"{stage.name}({message.strip()})"
+    return run_stage
+
+def test_run_iter_runs_independent_stages_concurrently():
+    log = []
+    p = _diamond()
+    started = time.perf_counter()
+    results = list(run_iter(p, _recording_stage(log, {"summary": 0.3, "critique": 0.3}), "q"))
+    elapsed = time.perf_counter() - started
+    # summary and critique overlap: the run takes one 0.3s stage, not two
+    assert elapsed < 0.55
+    assert [r.stage.name for r in results][0] == "findings" and results[-1].stage.name == "final_draft"
+    assert results[-1].output.startswith("final_draft(Findings:\nfindings(q)")
+    # findings and final_draft are alone when they run, so they stay on the calling thread
+    threads = dict(log)
+    assert threads["findings"] == threads["final_draft"] == threading.current_thread().name
+    assert threads["summary"] != threads["critique"]
+
+def test_run_iter_yields_in_completion_order_and_skips_done_stages():
+    log = []
+    results = list(run_iter(_diamond(), _recording_stage(log, {"summary": 0.2}), "q", done={"findings": "F"}))
+    assert [r.stage.name for r in results] == ["critique", "summary", "final_draft"]
+    assert "findings" not in dict(log)
+    assert results[0].output == "critique(F)"
+
+def test_optional_stage_failure_and_timeout_yield_empty_output():
+    for critique, run_kwargs in ((dict(optional=True), dict(fail=("critique",))),
+                                 (dict(optional=True, timeout=0.1), dict(delays={"critique": 1.0}))):
+        results = {r.stage.name: r for r in run_iter(_diamond(**critique), _recording_stage([], **run_kwargs), "q")}
+        assert results["critique"].output == "" and results["critique"].error is not None
+        assert results["final_draft"].message.endswith("Critique:\n")
+    assert isinstance(results["critique"].error, TimeoutError)
+    assert results["critique"].elapsed < 0.5
+
+def test_required_stage_failure_aborts_the_run():
+    with pytest.raises(RuntimeError, match="summary failed"):
+        list(run_iter(_diamond(), _recording_stage([], fail=("summary",)), "q"))
+
+def test_deferred_stage_is_run_by_the_caller():
+    p = Pipeline([Stage("findings", "Research"), Stage("final_draft", "Writer", inputs=("findings",))])
+    seen = []
+    for result in run_iter(p, _recording_stage([]), "q", defer=("final_draft",)):
+        if result.deferred:
+            seen.append(result.message)
+            result.output = "streamed"
+    assert seen == ["findings(q)"]
+
+def test_critical_path_follows_the_last_input_to_finish():
+    results = {r.stage.name: r for r in run_iter(_diamond(), _recording_stage([], {"critique": 0.2}), "q")}
+    path, length = _diamond().critical_path(results)
+    assert path == ["findings", "critique", "final_draft"]
+    assert length >= 0.2
+
+async def _async_stage(stage, message, delays=None, fail=()):
+    await asyncio.sleep((delays or {}).get(stage.name, 0))
+    if stage.name in fail:
+        raise RuntimeError(f"{stage.name} failed")
+    return f"{stage.name}({message.strip()})"
+
+def test_arun_runs_independent_stages_concurrently():
+    delays = {"summary": 0.3, "critique": 0.3}
+    started = time.perf_counter()
+    results = asyncio.run(arun(PARALLEL_REVIEW_PIPELINE, lambda s, m: _async_stage(s, m, delays), "q"))
+    assert time.perf_counter() - started < 0.55
+    assert results["summary"].output == "summary(findings(q))"
+    assert results["final_draft"].output.startswith("final_draft(Findings:\nfindings(q)")
+
+def test_arun_optional_timeout_and_required_failure():
+    p = _diamond(optional=True, timeout=0.1)
+    results = asyncio.run(arun(p, lambda s, m: _async_stage(s, m, {"critique": 5}), "q"))
+    assert isinstance(results["critique"].error, TimeoutError) and results["critique"].output == ""
+    assert results["final_draft"].output
+    cancelled = []
+
+    async def run_stage(stage, message):
+        try:
+            return await _async_stage(stage, message, {"critique": 5}, fail=("summary",))
+        except asyncio.CancelledError:
+            cancelled.append(stage.name)
+            raise
+
+    with pytest.raises(RuntimeError, match="summary failed"):
+        asyncio.run(arun(_diamond(), run_stage, "q"))
+    # the stage still running when the run failed is cancelled
+    assert cancelled == ["critique"]
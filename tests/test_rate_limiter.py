@@ -0,0 +1,70 @@
+# tests/test_rate_limiter.py
+import multiprocessing
+import time
+
+import pytest
+
+from genai_wrapper import FileRateLimiter
+
+def _hammer(path, max_requests, per_seconds, start, until, results):
+    limiter = FileRateLimiter(max_requests, per_seconds, path=path)
+    time.sleep(max(0.0, start - time.time()))
+    taken = 0
+    while time.time() < until:
+        wait = limiter.try_acquire()
+        if wait == 0.0:
+            taken += 1
+        else:
+            time.sleep(min(wait, 0.005))
+    results.put(taken)
+
+def _run_processes(path, rates, duration):
+    """One process per (max_requests, per_seconds) in `rates`, all on one state file; total tokens taken."""
+    ctx = multiprocessing.get_context()
+    results = ctx.Queue()
+    # all processes start hammering together once they are up
+    start = time.time() + 0.5
+    procs = [ctx.Process(target=_hammer, args=(path, m, s, start, start + duration, results)) for m, s in rates]
+    for p in procs:
+        p.start()
+    total = sum(results.get(timeout=duration + 30) for _ in procs)
+    for p in procs:
+        p.join(timeout=10)
+    return total
+
+@pytest.mark.parametrize("processes", [1, 4])
+def test_processes_sharing_a_file_get_the_configured_rate_in_total(tmp_path, processes):
+    path = str(tmp_path / "bucket")
+    FileRateLimiter(40, 1, path=path).configure()
+    duration = 1.5
+    total = _run_processes(path, [(40, 1)] * processes, duration)
+    # 40/s over the run plus the one token the idle bucket holds at the start
+    expected = 40 * duration + 1
+    assert expected * 0.8 <= total <= expected * 1.1
+
+def test_the_rate_in_the_state_file_wins_over_each_instances_own(tmp_path):
+    path = str(tmp_path / "bucket")
+    FileRateLimiter(20, 1, path=path).configure()
+    # processes constructed with a much higher rate still refill at the shared 20/s
+    total = _run_processes(path, [(1000, 1), (20, 1), (500, 1)], 1.5)
+    expected = 20 * 1.5 + 1
+    assert expected * 0.8 <= total <= expected * 1.1
+
+def test_configure_returns_the_previous_budget_and_keeps_tokens(tmp_path):
+    path = str(tmp_path / "bucket")
+    limiter = FileRateLimiter(2, 60, path=path, burst=5)
+    assert limiter.budget() is None
+    assert limiter.configure() is None
+    assert limiter.budget() == (2 / 60, 5.0)
+    other = FileRateLimiter(60, 60, path=path, burst=1)
+    assert other.configure() == (2 / 60, 5.0)
+    # capacity shrank to 1: the bucket keeps at most one token
+    assert limiter.try_acquire() == 0.0
+    assert 0.9 < limiter.try_acquire() <= 1.0
+
+def test_legacy_state_file_keeps_its_tokens(tmp_path):
+    path = tmp_path / "bucket"
+    path.write_bytes(FileRateLimiter._LEGACY_STATE.pack(0.0, time.time()))
+    limiter = FileRateLimiter(1, 60, path=str(path))
+    assert limiter.try_acquire() > 50
+    assert limiter.budget() == (1 / 60, 1.0)
@@ -0,0 +1,109 @@
+# tests/test_search_fanout.py
+import threading
+
+import pytest
+
+from agents import ResearchAgent, is_degraded
+from search_fanout import FANOUT_FACETS, decompose_query, fanout_search, merge_hits, normalize_link
+
+class _Tool:
+    """Search tool stub: hits per sub-query; a sub-query mapped to an exception raises it."""
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def call(self, query):
+        with self.lock:
+            self.calls.append(query)
+        resp = self.responses.get(query, [])
+        if isinstance(resp, Exception):
+            raise resp
+        if isinstance(resp, dict):
+            return resp
+        return {"status": "ok", "result": {"query": query, "hits": resp, "source": "stub"}}
+
+def _hit(title, link, snippet=""):
+    return {"title": title, "link": link, "snippet": snippet}
+
+def test_list_like_queries_split_into_their_parts():
+    assert decompose_query("Compare PyTorch, JAX and TensorFlow?") == [
+        "Compare PyTorch, JAX and TensorFlow?", "PyTorch", "JAX", "TensorFlow"]
+    assert decompose_query("rust vs go") == ["rust vs go", "rust", "go"]
+
+def test_queries_that_do_not_split_get_facets_and_the_cap_applies():
+    subs = decompose_query("quantum error correction", max_subqueries=3)
+    assert subs == ["quantum error correction"] + [f"quantum error correction {f}" for f in FANOUT_FACETS[:2]]
+    assert decompose_query("anything", max_subqueries=1) == ["anything"]
+    # a part equal to the query (after normalisation) is not searched twice
+    assert decompose_query("Python, python, Java") == ["Python, python, Java", "Python", "Java"]
+
+def test_links_normalise_scheme_www_and_trailing_slash():
+    assert normalize_link("https://www.Example.com/path/") == normalize_link("http://example.com/path")
+    assert normalize_link("https://example.com/p?q=1") == "example.com/p?q=1"
+
+def test_merge_drops_same_link_and_near_duplicate_snippets():
+    snippet = "researchers report a new technique that improves qubit coherence times"
+    hits, dropped = merge_hits("qubit coherence", [
+        ("a", [_hit("Qubit coherence record", "https://www.lab.org/news/", snippet)]),
+        ("b", [_hit("Qubit coherence record", "http://lab.org/news", snippet),
+               _hit("QUBIT coherence record!", "https://mirror.net/copy", snippet.capitalize() + ".")]),
+        ("c", [_hit("Unrelated cooking tips", "https://food.com/x", "how to bake bread at home")]),
+    ])
+    assert dropped == 2
+    assert [h["link"] for h in hits] == ["https://www.lab.org/news/", "https://food.com/x"]
+    assert hits[0]["subqueries"] == ["a", "b"]
+
+def test_ranking_rewards_term_coverage_agreement_and_position():
+    hits, _ = merge_hits("solid state batteries", [
+        ("q1", [_hit("Cooking with gas", "https://x.com/1", "recipes for dinner"),
+                _hit("Solid state batteries explained", "https://x.com/2", "how batteries work")]),
+        ("q2", [_hit("Solid state batteries explained", "https://x.com/2", "how batteries work"),
+                _hit("Battery news", "https://x.com/3", "state of the market")]),
+    ])
+    # full coverage and returned by both sub-queries beats being first in one
+    assert [h["link"] for h in hits] == ["https://x.com/2", "https://x.com/3", "https://x.com/1"]
+    assert hits[0]["score"] > hits[1]["score"] > hits[2]["score"]
+
+def test_fanout_searches_every_subquery_and_merges_the_hits():
+    tool = _Tool({"rust vs go": [_hit("Rust vs Go", "https://a.com/1")],
+                  "rust": [_hit("Rust book", "https://b.com/rust", "ownership and borrowing")],
+                  "go": [_hit("Go tour", "https://c.com/go", "goroutines and channels")]})
+    out = fanout_search(tool, "rust vs go")
+    assert sorted(tool.calls) == ["go", "rust", "rust vs go"]
+    assert out["source"] == "fanout" and out["sources"] == ["stub"]
+    assert {h["link"] for h in out["hits"]} == {"https://a.com/1", "https://b.com/rust", "https://c.com/go"}
+    assert "errors" not in out and "error" not in out
+
+def test_failed_subqueries_are_reported_without_losing_the_others():
+    tool = _Tool({"rust vs go": [_hit("Rust vs Go", "https://a.com/1")],
+                  "rust": RuntimeError("quota exceeded"),
+                  "go": {"status": "error", "error": "backend down"}})
+    out = fanout_search(tool, "rust vs go")
+    assert out["errors"] == {"rust": "quota exceeded", "go": "backend down"}
+    assert [h["link"] for h in out["hits"]] == ["https://a.com/1"]
+    assert "error" not in out
+
+def test_all_subqueries_failing_sets_error():
+    tool = _Tool({q: RuntimeError("quota exceeded") for q in ("rust vs go", "rust", "go")})
+    out = fanout_search(tool, "rust vs go")
+    assert out["hits"] == [] and len(out["errors"]) == 3
+    assert out["error"].startswith("3/3 sub-queries failed")
+
+@pytest.fixture
+def research_agent():
+    def make(responses):
+        return ResearchAgent("ResearchAgent", tools={"search": _Tool(responses)}, use_mock=False, fanout=True)
+    return make
+
+def test_research_agent_reports_a_failed_fanout_as_degraded(research_agent):
+    agent = research_agent({q: RuntimeError("quota exceeded") for q in ("rust vs go", "rust", "go")})
+    out = agent.act("rust vs go")
+    assert is_degraded(out)
+    assert out["content"].startswith("[search-error] 3/3 sub-queries failed")
+
+def test_research_agent_uses_the_merged_hits(research_agent):
+    agent = research_agent({"rust": [_hit("Rust book", "https://b.com/rust", "ownership")]})
+    out = agent.act("rust vs go")
+    assert not is_degraded(out)
+    assert out["content"] == "Rust book - ownership"
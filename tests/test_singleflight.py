@@ -0,0 +1,135 @@
+# tests/test_singleflight.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+import agents
+from llm_gateway import PRIORITY_BATCH, PRIORITY_INTERACTIVE, llm_context
+from singleflight import SingleFlight
+
+def _wait_until(cond, timeout=5.0):
+    deadline = time.time() + timeout
+    while not cond():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.005)
+
+def test_concurrent_callers_share_one_execution():
+    flights = SingleFlight()
+    release = threading.Event()
+    runs = []
+
+    def slow():
+        runs.append(1)
+        release.wait(5)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("k", slow))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    _wait_until(lambda: flights.coalesced == 4)
+    release.set()
+    for t in threads:
+        t.join(timeout=5)
+    assert runs == [1] and results == ["value"] * 5
+    assert flights.in_flight() == 0
+    # the flight is over: the next call runs again
+    assert flights.do("k", lambda: "fresh") == "fresh"
+
+def test_followers_get_the_leaders_exception():
+    flights = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    def call():
+        try:
+            flights.do("k", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for t in threads:
+        t.start()
+    _wait_until(lambda: flights.coalesced == 2)
+    release.set()
+    for t in threads:
+        t.join(timeout=5)
+    assert errors == ["boom"] * 3
+
+def test_async_callers_join_a_thread_flight():
+    flights = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flights.do, args=("k", lambda: release.wait(5) and "from thread"))
+    leader.start()
+    _wait_until(lambda: flights.in_flight() == 1)
+
+    async def main():
+        joined = asyncio.ensure_future(flights.ado("k", asyncio.sleep, 0, "own call"))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await joined
+
+    assert asyncio.run(main()) == "from thread"
+    leader.join(timeout=5)
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+class _BlockingModel:
+    """generate_content blocks until released; counts calls per prompt."""
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def generate_content(self, contents, **kwargs):
+        self.calls += 1
+        self.release.wait(5)
+        return _Response(f"response to {contents}")
+
+class _Gateway:
+    def call(self, fn, **kwargs):
+        return fn()
+
+@pytest.fixture
+def model(monkeypatch):
+    model = _BlockingModel()
+    monkeypatch.setattr(agents, "get_model", lambda *a, **k: model)
+    monkeypatch.setattr(agents, "get_gateway", lambda: _Gateway())
+    return model
+
+def _generate_in_thread(prompt, priority, results):
+    def run():
+        with llm_context(priority=priority):
+            results.append(agents._generate(prompt))
+    t = threading.Thread(target=run)
+    t.start()
+    return t
+
+def test_identical_prompts_of_one_priority_share_a_call(model):
+    results = []
+    threads = [_generate_in_thread("same prompt", PRIORITY_BATCH, results) for _ in range(3)]
+    _wait_until(lambda: agents.LLM_FLIGHTS.in_flight() == 1 and model.calls == 1)
+    time.sleep(0.05)
+    model.release.set()
+    for t in threads:
+        t.join(timeout=5)
+    assert model.calls == 1 and results == ["response to same prompt"] * 3
+
+def test_interactive_call_does_not_wait_behind_a_batch_flight(model):
+    batch_results, ui_results = [], []
+    batch = _generate_in_thread("shared prompt", PRIORITY_BATCH, batch_results)
+    _wait_until(lambda: model.calls == 1)
+    ui = _generate_in_thread("shared prompt", PRIORITY_INTERACTIVE, ui_results)
+    # the interactive request starts its own call instead of joining the batch leader
+    _wait_until(lambda: model.calls == 2)
+    model.release.set()
+    for t in (batch, ui):
+        t.join(timeout=5)
+    assert batch_results == ui_results == ["response to shared prompt"]
@@ -0,0 +1,97 @@
+# tests/test_tool_adapter.py
+import threading
+import time
+
+import pytest
+
+import tool_adapter
+from cache import PersistentLRUCache
+
+def _hits(source):
+    return {"hits": [{"title": f"{source} hit", "snippet": "s"}], "source": source}
+
+@pytest.fixture
+def backends(monkeypatch):
+    """Both backends configured; each test sets what genai and CSE return and how fast."""
+    calls = []
+    spec = {"genai": (0.0, _hits("genai_search")), "google_cse": (0.0, _hits("google_cse"))}
+
+    def fake(backend):
+        def search(query, *args, **kwargs):
+            calls.append(backend)
+            delay, resp = spec[backend]
+            time.sleep(delay)
+            return {"query": query, **resp}
+        return search
+
+    monkeypatch.setattr(tool_adapter, "_genai_search_ready", lambda: True)
+    monkeypatch.setattr(tool_adapter, "_cse_configured", lambda: True)
+    monkeypatch.setattr(tool_adapter, "_genai_web_search", fake("genai"))
+    monkeypatch.setattr(tool_adapter, "_google_cse_search", fake("google_cse"))
+    monkeypatch.setenv("MOCK_SEARCH_LATENCY", "0")
+    return spec, calls
+
+def test_hedge_fast_genai_wins_without_starting_cse(backends):
+    spec, calls = backends
+    resp = tool_adapter.simple_search("q", hedge_delay=5)
+    assert resp["backend"] == "genai" and resp["source"] == "genai_search"
+    assert calls == ["genai"]
+
+def test_hedge_starts_cse_after_the_delay_and_takes_the_first_hits(backends):
+    spec, calls = backends
+    spec["genai"] = (1.0, _hits("genai_search"))
+    t0 = time.perf_counter()
+    resp = tool_adapter.simple_search("q", hedge_delay=0.05)
+    assert resp["backend"] == "google_cse"
+    # did not wait for the slow genai call
+    assert time.perf_counter() - t0 < 0.9
+    assert calls == ["genai", "google_cse"]
+
+def test_hedge_goes_straight_to_cse_when_genai_has_no_hits(backends):
+    spec, calls = backends
+    spec["genai"] = (0.0, {"hits": [], "error": "genai_tool_failed", "source": "genai_error"})
+    resp = tool_adapter.simple_search("q", hedge_delay=5)
+    assert resp["backend"] == "google_cse"
+
+def test_hedge_falls_back_to_raw_text_then_mock(backends):
+    spec, calls = backends
+    spec["genai"] = (0.0, {"hits": [], "raw": "model text", "source": "genai_empty"})
+    spec["google_cse"] = (0.0, {"hits": [], "source": "error_fallback", "error": "boom"})
+    resp = tool_adapter.simple_search("q", hedge_delay=0)
+    assert resp["hits"][0]["snippet"] == "model text" and resp["backend"] == "genai"
+    spec["genai"] = (0.0, {"hits": [], "source": "genai_error", "error": "boom"})
+    assert tool_adapter.simple_search("q", hedge_delay=0)["source"] == "mock"
+
+def test_sequential_mode_without_hedge_delay(backends, monkeypatch):
+    spec, calls = backends
+    monkeypatch.setattr(tool_adapter, "SEARCH_HEDGE_DELAY", None)
+    spec["genai"] = (0.0, {"hits": [], "source": "genai_error", "error": "boom"})
+    resp = tool_adapter.simple_search("q")
+    assert resp["source"] == "google_cse" and "backend" not in resp
+    assert calls == ["genai", "google_cse"]
+
+class _Response:
+    text = ""
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"items": [{"title": "t", "link": "https://example.com", "snippet": "s"}]}
+
+def test_results_are_cached_once_at_the_backend(monkeypatch):
+    monkeypatch.setattr(tool_adapter, "SEARCH_CACHE", PersistentLRUCache(None))
+    monkeypatch.delenv("SEARCH_CACHE_DISABLED", raising=False)
+    monkeypatch.setattr(tool_adapter, "SEARCH_HEDGE_DELAY", None)
+    monkeypatch.setattr(tool_adapter, "_genai_search_ready", lambda: False)
+    monkeypatch.setenv("GOOGLE_API_KEY", "key")
+    monkeypatch.setenv("GOOGLE_CX", "cx")
+    requests_made = []
+    monkeypatch.setattr(tool_adapter.requests, "get", lambda *a, **k: requests_made.append(a) or _Response())
+
+    first = tool_adapter.simple_search("Quantum  Computing")
+    second = tool_adapter.simple_search("quantum computing")
+    assert first["source"] == second["source"] == "google_cse"
+    assert second["query"] == "quantum computing"
+    assert len(requests_made) == 1
+    assert list(tool_adapter.SEARCH_CACHE._entries) == ["google_cse|quantum computing"]
@@ -59,7 +59,23 @@ from agents import ResearchAgent, SummarizerAgent, CriticAgent, WriterAgent
 from tool_adapter import Tool, simple_search
 from a2a_simulator import A2ABus
 from memory import Session, MemoryStore
-from observability import log_event, trace_span, emit_metric
+from observability import log_event, trace_span, emit_metric, get_metrics, read_last_trace, trace_tree
+from genai_wrapper import warm_models
+
+if not USE_MOCK_UI and (os.environ.get("GOOGLE_API_KEY") or os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")):
+    # build the shared Gemini models once per process instead of on the first request
+    @st.cache_resource
+    def _warm_genai_models():
+        warm_models()
+        return True
+    _warm_genai_models()
+
+if os.environ.get("METRICS_PORT"):
+    # Prometheus scrape endpoint, started once per process
+    @st.cache_resource
+    def _serve_metrics():
+        return get_metrics().serve_prometheus(int(os.environ["METRICS_PORT"]))
+    _serve_metrics()
 
 st.subheader("Run Research Pipeline")
 query = st.text_input("Enter research query:", "Recent breakthroughs in quantum computing and impact on AI (2024–2025)", key="query_input")
@@ -79,36 +95,17 @@ orch = Orchestrator(
     use_mock=USE_MOCK_UI
 )
 
-import shutil
-
-# --- Memory store (robust initialization) ---
+# --- Memory store (opened once per process; refreshed after each run) ---
 memory_path = os.path.join(ROOT, "data", "processed", "memory_store.json")
 
-try:
-    # Attempt normal load
-    memory = MemoryStore(memory_path)
-
-except Exception as e:
-    # Recovery path when JSON is corrupted
-    st.warning("⚠️ Memory store corrupted — creating backup and resetting. Error: " + str(e))
-
-    # Backup original file if exists
-    if os.path.exists(memory_path):
-        shutil.copyfile(memory_path, memory_path + ".corrupt.bak")
-        st.info(f"Backup created: {memory_path}.corrupt.bak")
-
-    # Write a clean empty JSON array
-    try:
-        os.makedirs(os.path.dirname(memory_path), exist_ok=True)
-        with open(memory_path, "w", encoding="utf-8") as f:
-            f.write("[]")
-    except Exception as write_err:
-        st.error(f"Failed to create clean memory file: {write_err}")
-        raise
+@st.cache_resource
+def _open_memory(path):
+    # lazy: only an offset index is kept; a snapshot that is not one record per line is
+    # converted on first open with the original kept as .bak, and lines that do not parse
+    # are skipped rather than failing the load
+    return MemoryStore(path, lazy=True)
 
-    # Reload clean store
-    memory = MemoryStore(memory_path)
-    st.success("Memory store reset successfully.")
+memory = _open_memory(memory_path)
 
 
 progress_bar = st.progress(0)
@@ -129,26 +126,43 @@ if run_button:
     else:
         status_text.info("Starting pipeline…")
         session = Session(f"ui-session-{int(time.time())}")
-        session.add_turn("user", query)
-        steps = ["research", "summarize", "critique", "write", "finalize"]
-        results = orch.run_pipeline(session_id=session.session_id, user_query=current_query)
-        for i, step in enumerate(steps):
-            status_text.info(f"Running step: {step}")
-            time.sleep(0.5)
-            progress_bar.progress(int(((i+1)/len(steps))*100))
-            if step == "finalize":
-                results = orch.run_pipeline(session_id=session.session_id, user_query=query)
+        session.add_turn("user", current_query)
+        # render each stage as soon as the orchestrator yields it (one pipeline run per click)
+        stage_views = {
+            "findings": (findings_expander, "Findings", 150),
+            "summary": (summary_expander, "Summary", 150),
+            "critique": (critique_expander, "Critique", 150),
+            "final_draft": (draft_expander, "Final Draft", 300),
+        }
+        results = {}
+        done_count = 0
+        # the draft is streamed: show it growing in a live preview until the stage completes
+        draft_live = draft_expander.empty()
+        draft_so_far = ""
+        for event in orch.iter_pipeline(session_id=session.session_id, user_query=current_query, stream=True):
+            if event["stage"] == "done":
+                results = event["results"]
+                break
+            if event["stage"] == "chunk":
+                if not draft_so_far:
+                    status_text.info("Writing final draft…")
+                draft_so_far += event["content"]
+                draft_live.markdown(draft_so_far)
+                continue
+            if event["stage"] == "final_draft":
+                draft_live.empty()
+            done_count += 1
+            progress_bar.progress(int(done_count / len(stage_views) * 100))
+            status_text.info(f"Finished step: {event['stage']} ({event['elapsed']:.1f}s)")
+            expander, label, height = stage_views[event["stage"]]
+            with expander:
+                st.text_area(label, event["content"], height=height)
         progress_bar.progress(100)
         status_text.success("Pipeline complete ✔️")
+        # the orchestrator wrote the record through its own store: pick it up here
+        memory.refresh()
 
-        with findings_expander:
-            st.text_area("Findings", results.get("findings", ""), height=150)
-        with summary_expander:
-            st.text_area("Summary", results.get("summary", ""), height=150)
-        with critique_expander:
-            st.text_area("Critique", results.get("critique", ""), height=150)
         with draft_expander:
-            st.text_area("Final Draft", results.get("final_draft", ""), height=300)
             st.download_button("Download Draft as TXT", data=results.get("final_draft", ""), file_name="final_draft.txt")
 
 
@@ -164,6 +178,30 @@ if st.sidebar.checkbox("Show Logs / Traces"):
         st.write(logs)
     else:
         st.write("No logs available.")
+    # where the latest run spent its time, as a span tree
+    spans = read_last_trace(os.path.join(ROOT, "data", "processed", "agent_traces.jsonl"))
+    if spans:
+        st.write("Last trace")
+        st.text("\n".join(
+            f"{'  ' * depth}{s['span']} {(s.get('duration_s') or 0) * 1000:.1f} ms"
+            f"{' [' + s['status'] + ']' if s.get('status') != 'ok' else ''} {s.get('attributes') or ''}"
+            for depth, s in trace_tree(spans)))
+if st.sidebar.checkbox("Show Metrics"):
+    st.subheader("Metrics")
+    snap = get_metrics().snapshot()
+    st.write("Latency (seconds)")
+    st.dataframe([{"name": h["name"], **h["labels"], "count": h["count"], "p50": round(h["p50"], 3),
+                   "p95": round(h["p95"], 3), "p99": round(h["p99"], 3)} for h in snap["histograms"]])
+    st.write("Counters")
+    st.dataframe([{"name": c["name"], **c["labels"], "value": c["value"]} for c in snap["counters"]])
 if st.sidebar.checkbox("Show Memory Store"):
     st.subheader("Memory Store")
-    st.json(memory.store)
+    page_size = 20
+    if st.button("Reload Memory Store"):
+        # records written by other processes (batch runs, notebooks)
+        memory.refresh()
+    total = len(memory.store)
+    page_count = max(1, (total + page_size - 1) // page_size)
+    page_no = st.number_input(f"Page (newest first, {total} records)", min_value=1, max_value=page_count, value=1, step=1)
+    records = memory.page(offset=(int(page_no) - 1) * page_size, limit=page_size, reverse=True)
+    st.json([r.to_dict() if hasattr(r, "to_dict") else r for r in records])